@@ -0,0 +1,610 @@
+# batch_converter.py
+"""
+Conversione in blocco di file XML esportati da Access in fatture elettroniche.
+
+Uso:
+    python batch_converter.py INPUT [INPUT ...] --profilo profilo.json --output-dir fatture/
+
+Ogni INPUT può essere una directory (vengono letti tutti i file *.xml) o un
+pattern glob. Ogni file può contenere più <Fattura>: ne viene generata una
+fattura elettronica per ciascuna. Il profilo è un file JSON con gli stessi parametri che il form
+Streamlit passa a crea_fattura_elettronica (dati trasmissione, cedente,
+pagamento, ...); i dati del destinatario e le righe vengono presi da ogni
+singolo file. Numero, data, causale e importi vanno lasciati fuori dal
+profilo: se presenti varrebbero per tutte le fatture.
+
+Con --lotto le fatture di tutti i file in input vengono raggruppate per
+cessionario e ogni gruppo diventa un unico file FatturaPA con più
+FatturaElettronicaBody, anche se le fatture arrivano da export diversi (es.
+un export per giorno). Per raggrupparle le fatture di tutti i file vengono
+prima lette e tenute in memoria.
+
+Con --registro clienti.sqlite i destinatari letti vengono aggiunti
+all'anagrafica clienti (vedi registro_clienti) e i dati del cessionario,
+compresi CodiceDestinatario e PEC, vengono presi dal registro.
+
+Con --allegati DIR a ogni fattura vengono allegati i file di DIR il cui nome
+è il numero della fattura (es. 255FE25.pdf) o inizia con il numero seguito
+da "_" (es. 255FE25_DDT78.pdf). Gli allegati vengono letti e codificati a
+blocchi mentre il file viene scritto.
+
+Con --progressivi progressivi.sqlite a ogni file generato viene assegnato un
+ProgressivoInvio univoco (vedi progressivi) e il file prende il nome
+richiesto dallo SdI, IT<IdCodiceMittente>_<progressivo>.xml. Ogni processo
+riserva i progressivi a blocchi, quindi i worker non si contendono il
+database a ogni fattura.
+
+Con --manifesto conversioni.sqlite vengono convertiti solo i file nuovi o
+modificati dall'ultima esecuzione con lo stesso profilo e le stesse opzioni
+(vedi manifesto); --forza li riconverte tutti aggiornando il manifesto. I
+file generati per la versione precedente di un input e non riscritti
+vengono rimossi. Con --lotto vengono ricostruiti anche i lotti degli altri
+file che avevano fatture in comune con quelli modificati. Un allegato
+aggiunto o modificato in --allegati fa riconvertire tutti i file; dopo una
+modifica all'anagrafica di --registro serve --forza.
+"""
+import argparse
+import glob
+import json
+import os
+import re
+import sys
+import tempfile
+from multiprocessing import Pool
+from pathlib import Path
+
+from xml_invoice_backend import (
+    iter_fatture_access, costruisci_fattura_elettronica, costruisci_lotto, compila_params,
+    iter_xml_bytes, chiave_cessionario, Allegato, ProfiloCedente
+)
+from manifesto import (
+    ManifestoConversioni, chiave_input, chiave_output, elenco_directory, hash_configurazione, hash_file
+)
+from progressivi import AllocatoreProgressivi
+from registro_clienti import RegistroClienti
+from xsd_validator import carica_schema, errori_fattura
+
+# Stato del processo worker, impostato una sola volta da _init_worker
+_profilo = None
+_cedente = None
+_output_dir = None
+_valida = False
+_registro = None
+_allegati_dir = None
+_progressivi = None
+
+
+def trova_file_input(sorgenti):
+    """Espande directory e pattern glob in una lista ordinata di file XML senza duplicati."""
+    trovati = {}
+    for sorgente in sorgenti:
+        if os.path.isdir(sorgente):
+            percorsi = Path(sorgente).glob("*.xml")
+        else:
+            percorsi = (Path(p) for p in glob.glob(sorgente, recursive=True))
+        for percorso in percorsi:
+            if percorso.is_file():
+                trovati.setdefault(percorso.resolve(), percorso)
+    return sorted(trovati.values())
+
+
+def _permessi_predefiniti():
+    """Permessi di un file nuovo secondo la umask del processo (mkstemp usa 0600)."""
+    umask = os.umask(0)
+    os.umask(umask)
+    return 0o666 & ~umask
+
+
+def scrivi_atomico(percorso, contenuto):
+    """Scrive il file tramite un file temporaneo nella stessa directory e os.replace.
+
+    Un lettore vede il vecchio contenuto o quello nuovo, mai un file troncato.
+
+    Args:
+        percorso (str | Path): File di destinazione
+        contenuto (bytes | iterable): Il contenuto, anche come iterabile di
+            blocchi di bytes scritti uno alla volta
+    """
+    percorso = Path(percorso)
+    if isinstance(contenuto, bytes):
+        contenuto = (contenuto,)
+    fd, tmp = tempfile.mkstemp(dir=percorso.parent, prefix=f".{percorso.name}.", suffix=".tmp")
+    try:
+        with os.fdopen(fd, "wb") as f:
+            for blocco in contenuto:
+                f.write(blocco)
+            f.flush()
+            os.fsync(f.fileno())
+        os.chmod(tmp, _permessi_predefiniti())
+        os.replace(tmp, percorso)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
+
+
+def nome_file_output(dati, percorso_input):
+    """Nome del file generato, come nel download della UI: Fattura_Elettronica_<Numero>.xml"""
+    numero = re.sub(r"[^\w.-]", "_", dati.get("Numero", "")) or Path(percorso_input).stem
+    return f"Fattura_Elettronica_{numero}.xml"
+
+
+def trova_allegati(cartella, numero):
+    """File di cartella da allegare alla fattura numero: <numero>.* e <numero>_*"""
+    numero = re.sub(r"[^\w.-]", "_", numero or "")
+    if not numero:
+        return []
+    cartella = Path(cartella)
+    trovati = set(cartella.glob(glob.escape(numero) + ".*")) | set(cartella.glob(glob.escape(numero) + "_*"))
+    return [Allegato(p) for p in sorted(trovati) if p.is_file()]
+
+
+def nome_file_lotto(fatture, percorso_input):
+    """Nome del file di un lotto: Lotto_<Numero prima fattura>_<numero di fatture>.xml"""
+    numero = re.sub(r"[^\w.-]", "_", fatture[0].get("Numero", "")) or Path(percorso_input).stem
+    return f"Lotto_{numero}_{len(fatture)}.xml"
+
+
+def _init_worker(profilo, output_dir, valida=False, registro=None, allegati_dir=None, progressivi=None):
+    global _profilo, _cedente, _output_dir, _valida, _registro, _allegati_dir, _progressivi
+    _profilo = profilo
+    # Header fisso del cedente, costruito una volta per processo
+    _cedente = ProfiloCedente(profilo)
+    _output_dir = Path(output_dir)
+    _valida = valida
+    # Ogni processo apre una propria connessione al registro
+    _registro = RegistroClienti(registro) if registro else None
+    _allegati_dir = allegati_dir
+    _progressivi = (AllocatoreProgressivi(progressivi, profilo["IdPaeseMittente"], profilo["IdCodiceMittente"])
+                    if progressivi else None)
+    if valida:
+        # Compila lo schema una volta per processo, non per fattura
+        carica_schema()
+
+
+def _scrivi_fattura(root, output):
+    """Valida (se richiesto) e scrive un albero FatturaElettronica.
+
+    Returns:
+        tuple: (percorso output o None, messaggio di errore o None)
+    """
+    if _valida:
+        errori = errori_fattura(root)
+        if errori:
+            dettagli = "; ".join(f"{e['percorso']}: {e['messaggio']}" for e in errori)
+            return None, f"schema XSD non rispettato: {dettagli}"
+    scrivi_atomico(output, iter_xml_bytes(root))
+    return str(output), None
+
+
+def _aggiungi_allegati(dati):
+    if _allegati_dir is not None:
+        dati["Allegati"] = trova_allegati(_allegati_dir, dati.get("Numero"))
+
+
+def _converti_fattura(dati, percorso):
+    """Converte una fattura letta dal file percorso."""
+    try:
+        _aggiungi_allegati(dati)
+        params = compila_params(_profilo, dati, _registro)
+        nome = nome_file_output(dati, percorso)
+        if _progressivi is not None:
+            params["ProgressivoInvio"] = _progressivi.prossimo()
+            nome = _progressivi.nome_file(params["ProgressivoInvio"])
+        root = costruisci_fattura_elettronica(dati, params, cedente=_cedente)
+        return _scrivi_fattura(root, _output_dir / nome)
+    except Exception as e:
+        return None, str(e)
+
+
+def _converti_lotto(fatture, percorso):
+    """Converte un gruppo di fatture dello stesso cessionario in un unico file."""
+    try:
+        for dati in fatture:
+            _aggiungi_allegati(dati)
+        profilo = _profilo
+        nome = nome_file_lotto(fatture, percorso)
+        if _progressivi is not None:
+            profilo = {**_profilo, "ProgressivoInvio": _progressivi.prossimo()}
+            nome = _progressivi.nome_file(profilo["ProgressivoInvio"])
+        root = costruisci_lotto(fatture, profilo, _registro, _cedente)
+        return _scrivi_fattura(root, _output_dir / nome)
+    except Exception as e:
+        return None, str(e)
+
+
+def _converti_file(percorso):
+    """Converte tutte le fatture di un file; eseguita nei processi worker.
+
+    Ogni fattura viene convertita appena letta, senza caricare l'intero file.
+    Con il registro clienti ogni fattura fa solo una ricerca: i destinatari
+    del file vengono registrati alla fine, in un'unica transazione.
+
+    Returns:
+        tuple: (percorso input, lista di (numero fattura, output o None, errore o None))
+    """
+    risultati = []
+    destinatari = []
+    try:
+        for dati in iter_fatture_access(percorso):
+            risultati.append((dati["Numero"], *_converti_fattura(dati, percorso)))
+            destinatari.append(dati.get("Destinatario", {}))
+    except Exception as e:
+        # Errore di lettura del file: le fatture già convertite restano valide
+        risultati.append((None, None, str(e)))
+    _registra_destinatari(destinatari, risultati)
+    return str(percorso), risultati
+
+
+def _registra_destinatari(destinatari, risultati):
+    """Aggiunge al registro clienti i destinatari di un file, in una sola transazione."""
+    if _registro is None or not destinatari:
+        return
+    try:
+        _registro.registra_molti(destinatari)
+    except Exception as e:
+        risultati.append((None, None, f"registro clienti non aggiornato: {e}"))
+
+
+def _converti_file_incrementale(voce):
+    """Come _converti_file, ma salta il file se il contenuto non è cambiato.
+
+    Args:
+        voce (tuple): (percorso, hash registrato nel manifesto o None)
+
+    Returns:
+        tuple: (percorso input, risultati come _converti_file o None se il
+            file è invariato, hash del contenuto o None se illeggibile)
+    """
+    percorso, hash_registrato = voce
+    try:
+        hash_input = hash_file(percorso)
+    except OSError as e:
+        return str(percorso), [(None, None, str(e))], None
+    if hash_input == hash_registrato:
+        return str(percorso), None, hash_input
+    return (*_converti_file(percorso), hash_input)
+
+
+def _leggi_file(voce):
+    """Legge tutte le fatture di un file, per raggrupparle con quelle degli altri file (--lotto).
+
+    Args:
+        voce (tuple): (percorso, hash registrato nel manifesto o None, True
+            per calcolare l'hash del contenuto)
+
+    Returns:
+        tuple: (percorso input, fatture o None se il file è invariato, hash
+            del contenuto o None, errore o None). Se il file non si legge per
+            intero nessuna sua fattura viene convertita
+    """
+    percorso, hash_registrato, calcola_hash = voce
+    try:
+        hash_input = hash_file(percorso) if calcola_hash else None
+        if hash_input is not None and hash_input == hash_registrato:
+            return str(percorso), None, hash_input, None
+        fatture = list(iter_fatture_access(percorso))
+        if _registro is not None:
+            _registro.registra_fatture(fatture)
+        return str(percorso), fatture, hash_input, None
+    except Exception as e:
+        return str(percorso), [], None, str(e)
+
+
+def _converti_gruppo(gruppo):
+    """Converte in un lotto le fatture di un cessionario, lette da uno o più file.
+
+    Args:
+        gruppo (list): Coppie (percorso input, dati fattura) nell'ordine di lettura
+
+    Returns:
+        tuple: (percorsi input, numeri delle fatture, output o None, errore o None)
+    """
+    percorsi = list(dict.fromkeys(percorso for percorso, _ in gruppo))
+    fatture = [dati for _, dati in gruppo]
+    numeri = ", ".join(dati["Numero"] for dati in fatture)
+    return (percorsi, numeri, *_converti_lotto(fatture, percorsi[0]))
+
+
+def _riporta(stampa, origine, output, errore, output_scritti):
+    """Stampa l'esito di una conversione; restituisce True se è riuscita."""
+    if errore is not None:
+        stampa(f"ERRORE {origine}: {errore}")
+        return False
+    if output in output_scritti:
+        stampa(f"ATTENZIONE {origine}: {output} sovrascrive l'output di {output_scritti[output]}")
+    output_scritti[output] = origine
+    stampa(f"OK     {origine} -> {output}")
+    return True
+
+
+def _rimuovi_superati(manifesto, conversioni, stampa):
+    """Rimuove i file generati per la versione precedente degli input e non riscritti.
+
+    Va chiamata dopo aver registrato le nuove conversioni: un file ancora
+    registrato per un altro input non viene rimosso, ma segnalato.
+
+    Args:
+        conversioni (dict): {percorso input: (output registrati prima, output nuovi)}
+    """
+    superati = {}
+    for percorso, (precedenti, nuovi) in conversioni.items():
+        nuovi = {chiave_output(p) for p in nuovi}
+        for uscita in precedenti:
+            if uscita not in nuovi:
+                superati[uscita] = percorso
+    in_uso = manifesto.output_in_uso(superati)
+    for uscita, percorso in superati.items():
+        if uscita in in_uso:
+            stampa(f"ATTENZIONE {percorso}: {uscita} non rimosso, contiene fatture di altri file non riconvertiti")
+            continue
+        try:
+            os.unlink(uscita)
+        except FileNotFoundError:
+            continue
+        stampa(f"RIMOSSO {uscita}: sostituito dalla nuova conversione di {percorso}")
+
+
+def _output_registrati(manifesto, percorso):
+    voce = manifesto.cerca(percorso)
+    return voce["output"] if voce else []
+
+
+def _registra_conversione(manifesto, percorso, hash_input, configurazione, output, riuscito, stat, stampa,
+                          conversioni=None):
+    """Registra nel manifesto i file generati per un input.
+
+    Un file convertito solo in parte viene registrato senza hash, così alla
+    prossima esecuzione viene riconvertito e i file generati ora vengono
+    rimossi come superati invece di restare accanto ai nuovi. Se non è stato
+    generato nessun file resta registrata la conversione precedente.
+
+    Args:
+        output (list): File generati, None per le conversioni non riuscite
+        riuscito (bool): True se tutte le fatture del file sono state convertite
+        conversioni (dict): Opzionale, raccoglie {percorso: (output precedenti,
+            output nuovi)} per chiamare _rimuovi_superati una volta sola;
+            se None i file superati vengono rimossi subito
+    """
+    nuovi = [uscita for uscita in output if uscita is not None]
+    if not nuovi:
+        return
+    precedenti = _output_registrati(manifesto, percorso)
+    manifesto.registra(percorso, hash_input if riuscito else None, configurazione, nuovi, stat)
+    if conversioni is None:
+        _rimuovi_superati(manifesto, {percorso: (precedenti, nuovi)}, stampa)
+    else:
+        conversioni[percorso] = (precedenti, nuovi)
+
+
+def _converti_lotti(pool, voci, chunksize, stampa, manifesto=None, configurazione=None, stat_input=None,
+                    file_input=()):
+    """--lotto: legge le fatture di tutti i file, le raggruppa per cessionario
+    anche tra file diversi e converte ogni gruppo in un lotto.
+
+    Con il manifesto, se un file modificato aveva fatture in lotti comuni con
+    altri file di file_input (vedi ManifestoConversioni.collegati), anche
+    questi vengono riletti per ricostruire i lotti per intero. Un file con
+    lotti non scritti viene registrato senza hash (vedi _registra_conversione)
+    e sarà riconvertito.
+
+    Returns:
+        tuple: (numero di lotti convertiti, numero di errori)
+    """
+    convertiti = errori = 0
+    output_scritti = {}
+    gruppi = {}
+    # Hash, output e riuscita dei file letti, per il manifesto
+    letti = {}
+    per_chiave = {chiave_input(percorso): percorso for percorso in file_input}
+    da_leggere = voci
+    while da_leggere:
+        voci = [(percorso, hash_registrato, manifesto is not None) for percorso, hash_registrato in da_leggere]
+        # imap (ordinato) perché i lotti seguano l'ordine dei file in input
+        for percorso, fatture, hash_input, errore in pool.imap(_leggi_file, voci, chunksize):
+            if errore is not None:
+                errori += 1
+                stampa(f"ERRORE {percorso}: {errore}")
+                continue
+            if fatture is None:
+                manifesto.aggiorna_stat(percorso, stat_input[percorso])
+                stampa(f"INVARIATO {percorso}")
+                continue
+            letti[percorso] = {"hash": hash_input, "output": [], "riuscito": True}
+            for dati in fatture:
+                gruppi.setdefault(chiave_cessionario(dati), []).append((percorso, dati))
+        if manifesto is None:
+            break
+        letti_chiavi = {chiave_input(percorso) for percorso in letti}
+        da_leggere = [(per_chiave[chiave], None) for chiave in sorted(manifesto.collegati(letti))
+                      if chiave in per_chiave and chiave not in letti_chiavi]
+        for percorso, _ in da_leggere:
+            stat_input[str(percorso)] = os.stat(percorso)
+
+    for percorsi, numeri, output, errore in pool.imap_unordered(_converti_gruppo, gruppi.values()):
+        if _riporta(stampa, f"{', '.join(percorsi)} [{numeri}]", output, errore, output_scritti):
+            convertiti += 1
+        else:
+            errori += 1
+        for percorso in percorsi:
+            letti[percorso]["output"].append(output)
+            letti[percorso]["riuscito"] &= errore is None
+
+    if manifesto is not None:
+        conversioni = {}
+        for percorso, esito in letti.items():
+            _registra_conversione(manifesto, percorso, esito["hash"], configurazione, esito["output"],
+                                  esito["riuscito"], stat_input[percorso], stampa, conversioni)
+        _rimuovi_superati(manifesto, conversioni, stampa)
+    return convertiti, errori
+
+
+def numero_processi_disponibili():
+    """Numero di core utilizzabili dal processo corrente."""
+    if hasattr(os, "sched_getaffinity"):
+        return len(os.sched_getaffinity(0))
+    return os.cpu_count() or 1
+
+
+def converti_in_blocco(file_input, profilo, output_dir, processi=None, stampa=print, valida=False,
+                       lotto=False, registro=None, allegati_dir=None, progressivi=None, manifesto=None,
+                       forza=False):
+    """Converte una lista di file Access usando un pool di processi.
+
+    Args:
+        file_input (list): Percorsi dei file XML esportati da Access
+        profilo (dict): Parametri comuni a tutte le fatture
+        output_dir (str | Path): Directory in cui scrivere i file generati
+        processi (int): Numero di processi worker (default: core disponibili)
+        stampa (callable): Funzione usata per lo stato di ogni file
+        valida (bool): Se True, le fatture non conformi allo schema XSD locale
+            vengono segnalate come errore e non scritte
+        lotto (bool): Se True, le fatture di tutti i file vengono raggruppate
+            per cessionario in file con più FatturaElettronicaBody
+        registro (str | Path): Opzionale, file SQLite dell'anagrafica clienti
+        allegati_dir (str | Path): Opzionale, directory dei file da allegare
+            (vedi trova_allegati)
+        progressivi (str | Path): Opzionale, file SQLite dei progressivi di
+            invio; se indicato ogni file riceve un ProgressivoInvio univoco e
+            il nome SdI IT<IdCodice>_<progressivo>.xml
+        manifesto (str | Path): Opzionale, file SQLite del manifesto delle
+            conversioni: i file invariati dall'ultima esecuzione con la stessa
+            configurazione vengono saltati
+        forza (bool): Se True, con manifesto riconverte comunque tutti i file
+
+    Returns:
+        tuple: (numero di fatture convertite, numero di errori)
+
+    Raises:
+        ValueError, KeyError: Se i dati del cedente nel profilo non sono validi
+        NotADirectoryError: Se allegati_dir non è una directory
+    """
+    # Verifica il profilo prima di avviare i worker, che lo ricostruiscono
+    ProfiloCedente(profilo)
+    if allegati_dir and not Path(allegati_dir).is_dir():
+        # Altrimenti tutte le fatture verrebbero scritte senza allegati
+        raise NotADirectoryError(f"Directory degli allegati non trovata: {allegati_dir}")
+    output_dir = Path(output_dir)
+    output_dir.mkdir(parents=True, exist_ok=True)
+    if registro:
+        # Crea il database (e il suo schema) prima di avviare i worker
+        RegistroClienti(registro).close()
+    if progressivi:
+        AllocatoreProgressivi(progressivi, profilo["IdPaeseMittente"], profilo["IdCodiceMittente"]).close()
+    if manifesto:
+        manifesto = ManifestoConversioni(manifesto)
+        configurazione = hash_configurazione(
+            profilo, output_dir=output_dir.resolve(), valida=valida, lotto=lotto,
+            registro=registro and Path(registro).resolve(),
+            allegati_dir=allegati_dir and Path(allegati_dir).resolve(),
+            allegati=allegati_dir and elenco_directory(allegati_dir),
+            progressivi=progressivi and Path(progressivi).resolve())
+        if forza:
+            voci, invariati = [(percorso, None) for percorso in file_input], 0
+        else:
+            voci, invariati = manifesto.da_convertire(file_input, configurazione)
+        # Stat letta prima della conversione, registrata insieme all'hash
+        stat_input = {str(percorso): os.stat(percorso) for percorso, _ in voci}
+        if invariati:
+            stampa(f"Invariati dall'ultima conversione: {invariati} file")
+    else:
+        manifesto, configurazione, stat_input = None, None, None
+        voci = [(percorso, None) for percorso in file_input] if lotto else file_input
+
+    convertiti = errori = 0
+    if not voci:
+        if manifesto is not None:
+            manifesto.close()
+        return convertiti, errori
+
+    processi = processi or numero_processi_disponibili()
+    processi = max(1, min(processi, len(voci)))
+    chunksize = max(1, min(32, len(voci) // (processi * 4)))
+
+    output_scritti = {}
+    initargs = (profilo, output_dir, valida, registro, allegati_dir, progressivi)
+    try:
+        with Pool(processi, initializer=_init_worker, initargs=initargs) as pool:
+            if lotto:
+                return _converti_lotti(pool, voci, chunksize, stampa, manifesto, configurazione, stat_input,
+                                       file_input)
+            if manifesto is not None:
+                esiti = pool.imap_unordered(_converti_file_incrementale, voci, chunksize)
+            else:
+                esiti = ((percorso, risultati, None)
+                         for percorso, risultati in pool.imap_unordered(_converti_file, voci, chunksize))
+            for percorso, risultati, hash_input in esiti:
+                if risultati is None:
+                    # Solo mtime o dimensione cambiati, contenuto identico
+                    manifesto.aggiorna_stat(percorso, stat_input[percorso])
+                    stampa(f"INVARIATO {percorso}")
+                    continue
+                for numero, output, errore in risultati:
+                    origine = f"{percorso} [{numero}]" if numero else percorso
+                    if _riporta(stampa, origine, output, errore, output_scritti):
+                        convertiti += 1
+                    else:
+                        errori += 1
+                if manifesto is not None:
+                    _registra_conversione(manifesto, percorso, hash_input, configurazione,
+                                          [output for _, output, _ in risultati],
+                                          all(errore is None for _, _, errore in risultati),
+                                          stat_input[percorso], stampa)
+    finally:
+        if manifesto is not None:
+            manifesto.close()
+
+    return convertiti, errori
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(
+        description="Converte in parallelo file XML esportati da Access in fatture elettroniche FatturaPA")
+    parser.add_argument("input", nargs="+", help="Directory o pattern glob dei file XML da convertire")
+    parser.add_argument("--profilo", required=True, help="File JSON con i parametri comuni delle fatture")
+    parser.add_argument("--output-dir", required=True, help="Directory di destinazione dei file generati")
+    parser.add_argument("--processi", type=int, default=None,
+                        help="Numero di processi worker (default: numero di core disponibili)")
+    parser.add_argument("--valida", action="store_true",
+                        help="Valida ogni fattura con lo schema XSD locale prima di scriverla")
+    parser.add_argument("--lotto", action="store_true",
+                        help="Raggruppa per cessionario le fatture di tutti i file in input in un unico file FatturaPA")
+    parser.add_argument("--registro",
+                        help="Database SQLite dell'anagrafica clienti da aggiornare e consultare")
+    parser.add_argument("--allegati",
+                        help="Directory con i file da allegare, chiamati <numero fattura>.* o <numero fattura>_*")
+    parser.add_argument("--progressivi",
+                        help="Database SQLite dei ProgressivoInvio: assegna progressivi univoci e nomi file SdI")
+    parser.add_argument("--manifesto",
+                        help="Database SQLite delle conversioni eseguite: converte solo i file nuovi o modificati")
+    parser.add_argument("--forza", action="store_true",
+                        help="Con --manifesto, riconverte anche i file invariati")
+    args = parser.parse_args(argv)
+    if args.allegati and not Path(args.allegati).is_dir():
+        parser.error(f"--allegati: directory non trovata: {args.allegati}")
+
+    with open(args.profilo, encoding="utf-8") as f:
+        profilo = json.load(f)
+
+    file_input = trova_file_input(args.input)
+    if not file_input:
+        print("Nessun file XML trovato", file=sys.stderr)
+        return 1
+
+    try:
+        convertiti, errori = converti_in_blocco(file_input, profilo, args.output_dir, args.processi,
+                                                valida=args.valida, lotto=args.lotto,
+                                                registro=args.registro, allegati_dir=args.allegati,
+                                                progressivi=args.progressivi, manifesto=args.manifesto,
+                                                forza=args.forza)
+    except (ValueError, KeyError) as e:
+        print(f"Profilo non valido: {e}", file=sys.stderr)
+        return 1
+    print(f"Convertiti: {convertiti}, errori: {errori}")
+    return 1 if errori else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,269 @@
+# benchmark.py
+"""
+Benchmark riproducibile della conversione delle fatture e dei calcoli fiscali.
+
+Uso:
+    python benchmark.py [--json risultati.json] [--confronta precedente.json] [--rapido]
+
+Genera export Access sintetici (1, 100 e 1000 righe per fattura; 1 e 10.000
+fatture per file) e misura separatamente parsing, costruzione dell'albero e
+serializzazione, più i calcoli fiscali su 1k, 100k e 1M redditi. Per ogni
+scenario riporta il tempo migliore su più ripetizioni e il picco di memoria
+(tracemalloc, misurato in un'esecuzione separata per non falsare i tempi).
+
+Con --json i risultati vengono salvati insieme al commit git corrente, così
+due esecuzioni su commit diversi possono essere confrontate con --confronta.
+"""
+import argparse
+import json
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import time
+import tracemalloc
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+
+import funzioni_fiscali
+import funzioni_fiscali_vettoriali
+from xml_invoice_backend import (
+    iter_fatture_access, costruisci_fattura_elettronica, compila_params, iter_xml_bytes
+)
+
+RIGHE_PER_FATTURA = (1, 100, 1000)
+FATTURE_PER_FILE = (1, 10000)
+REDDITI = (1000, 100000, 1000000)
+
+# Scenari con più righe in totale vengono saltati (10.000 fatture da 1000 righe
+# sono 10 milioni di righe); si possono includere con --max-righe
+MAX_RIGHE = 1000000
+# Il ciclo sulle funzioni scalari viene misurato solo fino a questa dimensione
+MAX_REDDITI_SCALARI = 100000
+
+# Parametri comuni del cedente, come il profilo di batch_converter
+PROFILO = {
+    "IdPaeseMittente": "IT", "IdCodiceMittente": "01036270096", "ProgressivoInvio": "00001",
+    "FormatoTrasmissione": "FPR12", "CodiceDestinatario": "0000000",
+    "CodiceFiscaleMittente": "01036270096", "DenominazioneMittente": "CEDENTE DI PROVA SRL",
+    "RegimeFiscale": "RF01", "IndirizzoMittente": "VIA ROMA 1", "CAPMittente": "17100",
+    "ComuneMittente": "Savona", "ProvinciaMittente": "SV", "NazioneMittente": "IT",
+    "TipoDocumento": "TD01", "Divisa": "EUR", "CondizioniPagamento": "TP02",
+    "ModalitaPagamento": "MP05", "IBAN": "IT06G0538749530000047355346",
+}
+
+
+def commit_git():
+    """Hash del commit corrente e presenza di modifiche non committate (None fuori da git)."""
+    cartella = Path(__file__).parent
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], cwd=cartella, capture_output=True,
+                                text=True, check=True).stdout.strip()
+        modifiche = subprocess.run(["git", "status", "--porcelain", "--untracked-files=no"], cwd=cartella,
+                                   capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None, None
+    return commit, bool(modifiche)
+
+
+def scrivi_export_access(percorso, fatture, righe, seme=0):
+    """Scrive un export Access sintetico con il numero indicato di fatture e righe.
+
+    Il file viene scritto una fattura alla volta, quindi anche gli scenari più
+    grandi non richiedono di tenere il documento in memoria.
+    """
+    casuale = random.Random(seme)
+    with open(percorso, "w", encoding="utf-8") as f:
+        f.write('<?xml version="1.0" encoding="UTF-8"?>\n')
+        f.write('<dataroot xmlns:od="urn:schemas-microsoft-com:officedata" generated="2025-07-21T10:00:00">\n')
+        for n in range(fatture):
+            piva = f"{casuale.randrange(10 ** 11):011d}"
+            f.write(
+                "<Fattura>\n"
+                f"<FatturaNum>{n + 1}FE25</FatturaNum>\n"
+                "<Data>2025-07-21T00:00:00</Data>\n"
+                f"<Cliente>CLIENTE {n} SPA - PI- {piva} - CF - {piva} - VIA BOSSO {n % 100 + 1} - "
+                "TORRE MONDOVI&apos; - 12080 - CN</Cliente>\n"
+                "<Note>Fattura generata per il benchmark</Note>\n"
+                "<Iva>22.00</Iva>\n"
+                "<ModoPag>BON.BANC</ModoPag>\n"
+                "<Scad>2025-08-21T00:00:00</Scad>\n"
+            )
+            for r in range(righe):
+                quantita = casuale.randint(1, 50)
+                prezzo = casuale.randint(100, 100000) / 100
+                # Access può esportare i numeri senza decimali ("22", "2")
+                aliquota = casuale.choice(("22", "10.00", "4"))
+                f.write(
+                    f"<Righe><Descrizione>ARTICOLO {r + 1} DDT {n + 1}</Descrizione><Qta>{quantita}</Qta>"
+                    f"<UM>PZ</UM><Prezzo>{prezzo:.2f}</Prezzo><Importo>{quantita * prezzo:.2f}</Importo>"
+                    f"<Iva>{aliquota}</Iva></Righe>\n"
+                )
+            f.write("</Fattura>\n")
+        f.write("</dataroot>\n")
+
+
+def _converti(percorso):
+    """Converte tutte le fatture del file, misurando separatamente le tre fasi.
+
+    Returns:
+        dict: Secondi di parsing, costruzione e serializzazione, byte prodotti
+    """
+    tempi = {"parsing": 0.0, "costruzione": 0.0, "serializzazione": 0.0}
+    prodotti = 0
+    fatture = iter_fatture_access(percorso)
+    while True:
+        inizio = time.perf_counter()
+        dati = next(fatture, None)
+        letto = time.perf_counter()
+        tempi["parsing"] += letto - inizio
+        if dati is None:
+            break
+        root = costruisci_fattura_elettronica(dati, compila_params(PROFILO, dati))
+        costruito = time.perf_counter()
+        prodotti += sum(len(blocco) for blocco in iter_xml_bytes(root))
+        tempi["costruzione"] += costruito - letto
+        tempi["serializzazione"] += time.perf_counter() - costruito
+    return tempi, prodotti
+
+
+def _picco_memoria(funzione, *args):
+    """Picco di memoria allocata da Python durante la chiamata, in byte."""
+    tracemalloc.start()
+    try:
+        funzione(*args)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def benchmark_fatture(ripetizioni, max_righe, stampa):
+    risultati = []
+    with tempfile.TemporaryDirectory() as cartella:
+        for fatture in FATTURE_PER_FILE:
+            for righe in RIGHE_PER_FATTURA:
+                nome = f"fatture={fatture} righe={righe}"
+                if fatture * righe > max_righe:
+                    stampa(f"{nome:<32} saltato (oltre --max-righe)")
+                    continue
+
+                percorso = Path(cartella) / f"access_{fatture}_{righe}.xml"
+                scrivi_export_access(percorso, fatture, righe)
+
+                migliori = None
+                for _ in range(ripetizioni):
+                    tempi, prodotti = _converti(percorso)
+                    migliori = tempi if migliori is None else {k: min(v, tempi[k]) for k, v in migliori.items()}
+                picco = _picco_memoria(_converti, percorso)
+
+                risultato = {
+                    "scenario": nome, "fatture": fatture, "righe": righe,
+                    "byte_input": percorso.stat().st_size, "byte_output": prodotti,
+                    "secondi": migliori, "picco_memoria_byte": picco,
+                }
+                risultati.append(risultato)
+                stampa(f"{nome:<32} " + "  ".join(f"{k} {v * 1000:9.2f} ms" for k, v in migliori.items())
+                       + f"  picco {picco / 2 ** 20:8.2f} MiB")
+                percorso.unlink()
+    return risultati
+
+
+def _cedolini_scalari(redditi):
+    for reddito in redditi:
+        (reddito - funzioni_fiscali.contr_inps(reddito, 0.0919) - funzioni_fiscali.irpef_con_addiz(reddito)
+         + funzioni_fiscali.detr_lav_dip(reddito, 220, 0) + funzioni_fiscali.bonus_redditi(reddito)
+         + funzioni_fiscali.taglio_cun_fisc(reddito, True))
+
+
+def _migliore(ripetizioni, funzione, *args):
+    migliore = None
+    for _ in range(ripetizioni):
+        inizio = time.perf_counter()
+        funzione(*args)
+        durata = time.perf_counter() - inizio
+        migliore = durata if migliore is None else min(migliore, durata)
+    return migliore
+
+
+def benchmark_fiscali(ripetizioni, stampa):
+    risultati = []
+    casuale = np.random.default_rng(0)
+    for n in REDDITI:
+        redditi = casuale.uniform(0, 120000, n)
+        netti = funzioni_fiscali_vettoriali.calcola_cedolini(redditi, 0.0919, 220, True)["netto"]
+        prove = {
+            "irpef_con_addiz": (funzioni_fiscali_vettoriali.irpef_con_addiz, redditi),
+            "calcola_cedolini": (funzioni_fiscali_vettoriali.calcola_cedolini, redditi, 0.0919, 220, True),
+            "lordo_da_netto": (funzioni_fiscali_vettoriali.lordo_da_netto, netti, 0.0919, 220, True),
+        }
+        if n <= MAX_REDDITI_SCALARI:
+            prove["cedolini_scalari"] = (_cedolini_scalari, redditi.tolist())
+
+        for nome, (funzione, *args) in prove.items():
+            secondi = _migliore(ripetizioni, funzione, *args)
+            picco = _picco_memoria(funzione, *args)
+            risultati.append({"scenario": f"{nome} n={n}", "funzione": nome, "redditi": n,
+                              "secondi": secondi, "picco_memoria_byte": picco})
+            stampa(f"{nome + ' n=' + str(n):<32} {secondi * 1000:10.2f} ms  picco {picco / 2 ** 20:8.2f} MiB")
+    return risultati
+
+
+def _durata(risultato):
+    secondi = risultato["secondi"]
+    return sum(secondi.values()) if isinstance(secondi, dict) else secondi
+
+
+def confronta(attuali, precedenti, stampa):
+    """Stampa il rapporto tra i tempi di due esecuzioni per gli scenari comuni."""
+    vecchi = {r["scenario"]: r for r in precedenti["fatture"] + precedenti["fiscali"]}
+    stampa(f"\nConfronto con {precedenti.get('commit') or 'esecuzione precedente'}:")
+    for risultato in attuali["fatture"] + attuali["fiscali"]:
+        vecchio = vecchi.get(risultato["scenario"])
+        if vecchio:
+            rapporto = _durata(risultato) / _durata(vecchio)
+            stampa(f"{risultato['scenario']:<32} x{rapporto:6.2f} tempo  "
+                   f"x{risultato['picco_memoria_byte'] / max(vecchio['picco_memoria_byte'], 1):6.2f} memoria")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark di conversione fatture e funzioni fiscali")
+    parser.add_argument("--json", help="File in cui salvare i risultati")
+    parser.add_argument("--confronta", help="File JSON di un'esecuzione precedente da confrontare")
+    parser.add_argument("--ripetizioni", type=int, default=3, help="Ripetizioni per scenario (default: 3)")
+    parser.add_argument("--max-righe", type=int, default=MAX_RIGHE,
+                        help=f"Righe totali massime per scenario di conversione (default: {MAX_RIGHE})")
+    parser.add_argument("--rapido", action="store_true",
+                        help="Una sola ripetizione e al massimo 100.000 righe per scenario")
+    args = parser.parse_args(argv)
+
+    ripetizioni, max_righe = args.ripetizioni, args.max_righe
+    if args.rapido:
+        ripetizioni, max_righe = 1, min(max_righe, 100000)
+
+    commit, modifiche = commit_git()
+    risultati = {
+        "commit": commit,
+        "modifiche_non_committate": modifiche,
+        "data": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+        "python": sys.version.split()[0],
+        "numpy": np.__version__,
+        "piattaforma": platform.platform(),
+        "ripetizioni": ripetizioni,
+        "fatture": benchmark_fatture(ripetizioni, max_righe, print),
+        "fiscali": benchmark_fiscali(ripetizioni, print),
+    }
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(risultati, f, indent=1)
+    if args.confronta:
+        with open(args.confronta, encoding="utf-8") as f:
+            confronta(risultati, json.load(f), print)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
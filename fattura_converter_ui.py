@@ -1,16 +1,175 @@
 # app.py
+import os
+import re
+import tempfile
+import zipfile
+from pathlib import Path
+
 import streamlit as st
 from xml_invoice_backend import (
-    parse_access_xml, crea_fattura_elettronica,
+    parse_access_xml_cached, numero_fatture_cached, costruisci_fattura_elettronica, iter_xml, iter_xml_bytes,
+    iter_fatture_access, compila_params,
+    CollettoreIstogramma, raccogli_metriche, Allegato,
     VALID_COUNTRIES, VALID_REGIMI_FISCALI,
     VALID_FORMATI_TRASMISSIONE, VALID_TIPI_DOCUMENTO,
-    VALID_MODALITA_PAGAMENTO, XML_SCHEMA_NAMESPACE
+    VALID_MODALITA_PAGAMENTO, XML_SCHEMA_NAMESPACE, DESCRIZIONI_XSD
 )
+from progressivi import AllocatoreProgressivi, nome_file_sdi
+from registro_clienti import RegistroClienti
+from xsd_validator import errori_fattura
+
+# Contatore dei ProgressivoInvio assegnati automaticamente dalla UI, fuori
+# dai sorgenti; FISCO_ITA_PROGRESSIVI_DB permette di condividerlo con
+# batch_converter --progressivi
+PROGRESSIVI_DB = Path(os.environ.get("FISCO_ITA_PROGRESSIVI_DB",
+                                     Path.home() / ".fisco-ita" / "progressivi.sqlite"))
+
+
+def apri_progressivi(id_paese, id_codice, blocco):
+    """Allocatore dei progressivi della UI, creando la directory di PROGRESSIVI_DB se manca."""
+    PROGRESSIVI_DB.parent.mkdir(parents=True, exist_ok=True)
+    return AllocatoreProgressivi(PROGRESSIVI_DB, id_paese, id_codice, blocco=blocco)
+
+
+# Anagrafica clienti (vedi registro_clienti) da cui una conversione multipla
+# prende CodiceDestinatario e PEC di ogni destinatario; opzionale
+REGISTRO_DB = os.environ.get("FISCO_ITA_REGISTRO_DB")
+
+
+def apri_registro():
+    """Il registro clienti di REGISTRO_DB, o None se non è configurato."""
+    return RegistroClienti(REGISTRO_DB) if REGISTRO_DB else None
+
+# Parametri del form comuni a tutte le fatture di una conversione multipla:
+# destinatario, numero, data, righe e importi vengono da ogni singolo file.
+# Il CodiceDestinatario del form vale solo per il suo destinatario: nella
+# conversione multipla si usa CODICE_DESTINATARIO_PREDEFINITO, salvo i
+# clienti con un recapito nel registro
+CHIAVI_PROFILO = (
+    "UseLocalSchema", "IdPaeseMittente", "IdCodiceMittente", "FormatoTrasmissione",
+    "TelefonoTrasmittente", "EmailTrasmittente", "CodiceFiscaleMittente", "DenominazioneMittente",
+    "RegimeFiscale", "IndirizzoMittente", "CAPMittente", "ComuneMittente", "ProvinciaMittente",
+    "NazioneMittente", "UfficioREA", "NumeroREA", "CapitaleSociale", "SocioUnico", "StatoLiquidazione",
+    "TelefonoCedente", "EmailCedente", "TipoDocumento", "Divisa", "Riepilogo_Riferimento",
+    "CondizioniPagamento", "ModalitaPagamento", "IBAN",
+)
+CODICE_DESTINATARIO_PREDEFINITO = "0000000"
+# Oltre questa dimensione l'archivio ZIP passa dalla memoria a un file temporaneo
+ZIP_MAX_MEMORIA = 16 * 1024 * 1024
+
+def con_descrizione(tipo_xsd):
+    """format_func per le selectbox: mostra il codice con la descrizione dello schema XSD."""
+    descrizioni = DESCRIZIONI_XSD[tipo_xsd]
+    return lambda codice: f"{codice} - {descrizioni[codice]}" if descrizioni.get(codice) else codice
+
+
+def allegati_fattura(file_allegati, numero):
+    """Allegati caricati per la fattura numero: <numero>.* e <numero>_*, come in batch_converter."""
+    numero = re.sub(r"[^\w.-]", "_", numero or "")
+    if not numero:
+        return []
+    trovati = [f for f in file_allegati
+               if Path(f.name).stem == numero or f.name.startswith(numero + "_")]
+    for f in trovati:
+        f.seek(0)
+    return trovati
+
+
+def scrivi_zip_fatture(file_caricati, profilo, archivio, valida=True, avanzamento=None, file_allegati=(),
+                       registro=None):
+    """Converte più export Access scrivendo ogni fattura generata in un archivio ZIP.
+
+    Ogni fattura viene serializzata direttamente nel suo membro dell'archivio,
+    senza costruire la stringa XML completa. Il ProgressivoInvio di ogni
+    fattura viene assegnato da PROGRESSIVI_DB e dà il nome al file.
+
+    Args:
+        file_caricati (list): File caricati con st.file_uploader
+        profilo (dict): Parametri comuni (vedi CHIAVI_PROFILO)
+        archivio (file): File binario in cui scrivere lo ZIP
+        valida (bool): Se True, le fatture non conformi allo schema XSD
+            vengono segnalate come errore e non aggiunte all'archivio
+        avanzamento (callable): Opzionale, chiamata con (file elaborati, totale)
+        file_allegati (list): Allegati caricati, assegnati a ogni fattura in
+            base al numero (vedi allegati_fattura)
+        registro (RegistroClienti): Opzionale, anagrafica da cui prendere
+            CodiceDestinatario e PEC dei destinatari
+
+    Returns:
+        tuple: (nomi dei file nell'archivio, lista di (file, numero fattura,
+            errore), nomi degli allegati non assegnati a nessuna fattura)
+    """
+    scritti, errori = [], []
+    usati = set()
+    with apri_progressivi(profilo["IdPaeseMittente"], profilo["IdCodiceMittente"],
+                          blocco=max(1, len(file_caricati))) as allocatore, \
+            zipfile.ZipFile(archivio, "w", zipfile.ZIP_DEFLATED) as zf:
+        for n, file_caricato in enumerate(file_caricati, 1):
+            numero = None
+            try:
+                file_caricato.seek(0)
+                for dati in iter_fatture_access(file_caricato):
+                    numero = dati.get("Numero")
+                    try:
+                        params = compila_params(profilo, dati, registro)
+                        params["ProgressivoInvio"] = allocatore.prossimo()
+                        allegati = allegati_fattura(file_allegati, numero)
+                        root = costruisci_fattura_elettronica(dati, params, allegati=[Allegato(f) for f in allegati])
+                        errori_xsd = errori_fattura(root) if valida else []
+                        if errori_xsd:
+                            dettagli = "; ".join(f"{e['percorso']}: {e['messaggio']}" for e in errori_xsd)
+                            raise ValueError(f"schema XSD non rispettato: {dettagli}")
+                        nome = allocatore.nome_file(params["ProgressivoInvio"])
+                        with zf.open(nome, "w") as membro:
+                            for blocco in iter_xml_bytes(root):
+                                membro.write(blocco)
+                        scritti.append(nome)
+                        usati.update(f.name for f in allegati)
+                    except Exception as e:
+                        errori.append((file_caricato.name, numero, str(e)))
+            except Exception as e:
+                # Errore di lettura del file: le fatture già convertite restano nell'archivio
+                errori.append((file_caricato.name, None, str(e)))
+            if avanzamento:
+                avanzamento(n, len(file_caricati))
+    return scritti, errori, [f.name for f in file_allegati if f.name not in usati]
+
 
 st.set_page_config(page_title="Converti Fattura Access → XML PA")
 st.title("Convertitore XML Fattura Elettronica")
 
-uploaded_file = st.file_uploader("Carica file XML da Access", type=["xml"])
+uploaded_files = st.file_uploader("Carica file XML da Access", type=["xml"], accept_multiple_files=True,
+                                  help="Con più file, o più fatture in un file, le fatture generate "
+                                       "vengono scaricate in un archivio ZIP")
+# Con un solo file il form viene precompilato con i suoi dati
+uploaded_file = uploaded_files[0] if len(uploaded_files) == 1 else None
+
+# Tempi e byte delle fasi di conversione di questo rerun
+metriche = CollettoreIstogramma()
+
+# Analizza il file caricato una sola volta per rerun: tutte le schede
+# leggono i valori predefiniti da questo dizionario
+dati_upload = None
+fatture_upload = 0
+if uploaded_file:
+    try:
+        with raccogli_metriche(metriche):
+            dati_upload = parse_access_xml_cached(uploaded_file.getvalue())
+            fatture_upload = numero_fatture_cached(uploaded_file.getvalue())
+    except:
+        dati_upload = None
+    if fatture_upload > 1:
+        # Un export con più fatture si converte come più file, nell'archivio ZIP
+        uploaded_file, dati_upload = None, None
+
+if len(uploaded_files) > 1 or fatture_upload > 1:
+    caricati = (f"{len(uploaded_files)} file caricati" if len(uploaded_files) > 1
+                else f"Il file contiene {fatture_upload} fatture")
+    st.info(f"{caricati}: dal form vengono usati solo trasmittente, cedente e "
+            "pagamento; destinatario, dati fattura e righe sono presi da ogni fattura. "
+            f"Il Codice Destinatario è {CODICE_DESTINATARIO_PREDEFINITO} (salvo i clienti nel registro "
+            "FISCO_ITA_REGISTRO_DB), gli allegati vanno a ogni fattura in base al nome "
+            "(<numero>.* o <numero>_*) e il Progressivo Invio viene assegnato automaticamente.")
 
 with st.form("config_form"):
     tabs = st.tabs(["Dati Trasmissione", "Cedente/Prestatore", "Destinatario", "Dati Fattura", "Beni e Servizi", "Pagamenti"])
@@ -24,8 +183,9 @@ with st.form("config_form"):
                                    help="Codice ISO della nazione a 2 caratteri")
             id_codice = st.text_input("Id Codice Mittente", value="01036270096", 
                                      help="Identificativo fiscale (es. Partita IVA)")
-            progressivo = st.text_input("Progressivo Invio", value="tPpUu",
-                                       help="Identificativo univoco del file")
+            progressivo = st.text_input("Progressivo Invio", value="",
+                                       help="Identificativo univoco del file; se vuoto viene assegnato "
+                                            f"automaticamente il prossimo progressivo del mittente ({PROGRESSIVI_DB})")
             
         with col2:
             formato = st.selectbox("Formato Trasmissione", VALID_FORMATI_TRASMISSIONE, 
@@ -54,6 +214,7 @@ with st.form("config_form"):
                                          help="Denominazione o ragione sociale")
             regime = st.selectbox("Regime Fiscale", VALID_REGIMI_FISCALI, 
                                  index=VALID_REGIMI_FISCALI.index("RF01") if "RF01" in VALID_REGIMI_FISCALI else 0,
+                                 format_func=con_descrizione("RegimeFiscaleType"),
                                  help="Regime fiscale del mittente")
         with col2:
             indirizzo = st.text_input("Indirizzo", value="VIA RIO GALLETTO 17",
@@ -92,13 +253,8 @@ with st.form("config_form"):
         
         # Estrai i dati del destinatario dal file XML se presente
         default_dest = {}
-        if uploaded_file:
-            try:
-                dati_tmp = parse_access_xml(uploaded_file.read())
-                uploaded_file.seek(0)
-                default_dest = dati_tmp.get("Destinatario", {})
-            except:
-                default_dest = {}
+        if dati_upload:
+            default_dest = dati_upload.get("Destinatario", {})
         
         with col1:
             id_paese_dest = st.selectbox("Id Paese Destinatario", VALID_COUNTRIES, 
@@ -138,6 +294,7 @@ with st.form("config_form"):
             # Usa TD01 come default per fattura normake
             tipo_documento = st.selectbox("Tipo Documento", VALID_TIPI_DOCUMENTO, 
                                          index=VALID_TIPI_DOCUMENTO.index("TD01") if "TD01" in VALID_TIPI_DOCUMENTO else 0,
+                                         format_func=con_descrizione("TipoDocumentoType"),
                                          help="Tipologia di documento")
             divisa = st.text_input("Divisa", value="EUR", help="Valuta del documento")
         
@@ -145,15 +302,9 @@ with st.form("config_form"):
             # Usa FatturaNum dal file Fattura.xml se presente, altrimenti default
             default_numero = ""
             default_data = ""
-            if uploaded_file:
-                try:
-                    dati_tmp = parse_access_xml(uploaded_file.read())
-                    uploaded_file.seek(0)  # Reimposta il puntatore del file per successive letture
-                    default_numero = dati_tmp.get("Numero", "255FE25")
-                    default_data = dati_tmp.get("Data", "2025-07-21")
-                except:
-                    default_numero = "255FE25"
-                    default_data = "2025-07-21"
+            if dati_upload:
+                default_numero = dati_upload.get("Numero", "255FE25")
+                default_data = dati_upload.get("Data", "2025-07-21")
             else:
                 default_numero = "255FE25"
                 default_data = "2025-07-21"
@@ -166,13 +317,8 @@ with st.form("config_form"):
             
             # Usa Note dal file Fattura.xml se presente, altrimenti default
             default_causale = ""
-            if uploaded_file:
-                try:
-                    dati_tmp = parse_access_xml(uploaded_file.read())
-                    uploaded_file.seek(0)
-                    default_causale = dati_tmp.get("Causale", "Applicato sconto 2% per pagamento immediato")
-                except:
-                    default_causale = "Applicato sconto 2% per pagamento immediato"
+            if dati_upload:
+                default_causale = dati_upload.get("Causale", "Applicato sconto 2% per pagamento immediato")
             else:
                 default_causale = "Applicato sconto 2% per pagamento immediato"
                 
@@ -180,7 +326,13 @@ with st.form("config_form"):
     
     with tabs[4]:  # Beni e Servizi
         st.subheader("Dettaglio Linee")
-        st.caption("Per semplicità, vengono inclusi due dettagli linea fissi. In un'implementazione completa, questi dovrebbero essere dinamici.")
+        linee_upload = dati_upload.get("Linee") if dati_upload else None
+        if linee_upload:
+            st.caption(f"Vengono usate le {len(linee_upload)} righe lette dal file Access; "
+                       "i campi Linea 1/Linea 2 vengono ignorati e il riepilogo viene calcolato dalle righe.")
+            st.dataframe(linee_upload)
+        else:
+            st.caption("Per semplicità, vengono inclusi due dettagli linea fissi. In un'implementazione completa, questi dovrebbero essere dinamici.")
         
         st.markdown("**Linea 1**")
         col1, col2 = st.columns(2)
@@ -215,17 +367,14 @@ with st.form("config_form"):
         # Estrai i dati IVA dal file XML se presente
         default_iva = "0.00"
         default_note_iva = ""
-        if uploaded_file:
-            try:
-                dati_tmp = parse_access_xml(uploaded_file.read())
-                uploaded_file.seek(0)
-                default_iva = dati_tmp.get("IVA", "0.00")
-                # Tronca NoteIVA a 100 caratteri come richiesto dallo schema XML
-                note_iva_tmp = dati_tmp.get("NoteIVA", "Art 74 Reverse Charge")
-                default_note_iva = note_iva_tmp[:100] if note_iva_tmp else "Art 74 Reverse Charge"
-            except:
-                default_iva = "0.00"
-                default_note_iva = "Art 74 Reverse Charge"
+        if dati_upload:
+            default_iva = dati_upload.get("IVA", "0.00")
+            # Tronca NoteIVA a 100 caratteri come richiesto dallo schema XML
+            note_iva_tmp = dati_upload.get("NoteIVA", "Art 74 Reverse Charge")
+            default_note_iva = note_iva_tmp[:100] if note_iva_tmp else "Art 74 Reverse Charge"
+        elif uploaded_file:
+            default_iva = "0.00"
+            default_note_iva = "Art 74 Reverse Charge"
                 
         col1, col2 = st.columns(2)
         with col1:
@@ -243,15 +392,9 @@ with st.form("config_form"):
         # Estrai i dati di pagamento dal file XML se presente
         default_modo_pag = ""
         default_tempo_pag = ""
-        if uploaded_file:
-            try:
-                dati_tmp = parse_access_xml(uploaded_file.read())
-                uploaded_file.seek(0)
-                default_modo_pag = dati_tmp.get("ModoPagamento", "")
-                default_tempo_pag = dati_tmp.get("TempoPagamento", "")
-            except:
-                default_modo_pag = ""
-                default_tempo_pag = ""
+        if dati_upload:
+            default_modo_pag = dati_upload.get("ModoPagamento", "")
+            default_tempo_pag = dati_upload.get("TempoPagamento", "")
         
         # Mappa tra i modi di pagamento in Access e i codici ModalitaPagamento
         modo_pag_map = {
@@ -282,6 +425,7 @@ with st.form("config_form"):
                                             index=VALID_MODALITA_PAGAMENTO.index(default_modalita) 
                                                   if default_modalita in VALID_MODALITA_PAGAMENTO 
                                                   else VALID_MODALITA_PAGAMENTO.index("MP05"),
+                                            format_func=con_descrizione("ModalitaPagamentoType"),
                                             help="Modalità di pagamento")
             
         col1, col2 = st.columns(2)
@@ -290,128 +434,162 @@ with st.form("config_form"):
         with col2:
             iban = st.text_input("IBAN", value="IT06G0538749530000047355346", help="IBAN per il pagamento")
 
+    file_allegati = st.file_uploader("Allegati (DDT, PDF, ...)", accept_multiple_files=True,
+                                     help="File inseriti nel blocco Allegati della fattura; con più fatture "
+                                          "ogni allegato va alla fattura il cui numero ne inizia il nome")
+
     st.subheader("Opzioni")
     use_local_schema = st.checkbox("Usa schema locale", value=False, 
                                  help="Utilizza lo schema XSD locale anziché quello online")
+    valida_xsd = st.checkbox("Valida con lo schema XSD", value=True,
+                             help="Controlla la fattura generata con Schema_VFPR12.xsd prima del download")
 
     submitted = st.form_submit_button("Genera XML valido")
 
+# Parametri della fattura dal form
+params = {
+    # Opzioni generali
+    "UseLocalSchema": use_local_schema,
+
+    # Dati Trasmissione
+    "IdPaeseMittente": id_paese,
+    "IdCodiceMittente": id_codice,
+    "ProgressivoInvio": progressivo,
+    "FormatoTrasmissione": formato,
+    "CodiceDestinatario": codice_dest,
+    "TelefonoTrasmittente": telefono_trasmittente,
+    "EmailTrasmittente": email_trasmittente,
+
+    # Cedente/Prestatore
+    "CodiceFiscaleMittente": codice_fiscale,
+    "DenominazioneMittente": denominazione,
+    "RegimeFiscale": regime,
+    "IndirizzoMittente": indirizzo,
+    "CAPMittente": cap,
+    "ComuneMittente": comune,
+    "ProvinciaMittente": provincia,
+    "NazioneMittente": nazione,
+
+    # REA
+    "UfficioREA": rea_ufficio,
+    "NumeroREA": rea_numero,
+    "CapitaleSociale": rea_capitale,
+    "SocioUnico": rea_socio_unico,
+    "StatoLiquidazione": rea_liquidazione,
+
+    # Contatti
+    "TelefonoCedente": telefono_cedente,
+    "EmailCedente": email_cedente,
+
+    # Destinatario
+    "IdPaeseDestinatario": id_paese_dest,
+    "IdCodiceDestinatario": id_codice_dest,
+    "CodiceFiscaleDestinatario": cf_dest,
+    "DenominazioneDestinatario": denominazione_dest,
+    "IndirizzoDestinatario": indirizzo_dest,
+    "CAPDestinatario": cap_dest,
+    "ComuneDestinatario": comune_dest,
+    "ProvinciaDestinatario": provincia_dest,
+    "NazioneDestinatario": nazione_dest,
+
+    # Dati Fattura
+    "TipoDocumento": tipo_documento,
+    "Divisa": divisa,
+    "NumeroFattura": numero_fattura,
+    "DataFattura": data_fattura,
+    "ImportoTotale": importo_totale,
+    "Causale": causale,
+
+    # Dettaglio Linee 1
+    "L1_Descrizione": l1_descrizione,
+    "L1_Quantita": l1_quantita,
+    "L1_UnitaMisura": l1_unita,
+    "L1_PrezzoUnitario": l1_prezzo,
+    "L1_Sconto": l1_sconto,
+    "L1_PrezzoTotale": l1_prezzo_totale,
+    "L1_AliquotaIVA": l1_aliquota_iva,
+    "L1_Natura": l1_natura,
+
+    # Dettaglio Linee 2
+    "L2_Descrizione": l2_descrizione,
+    "L2_Quantita": l2_quantita,
+    "L2_UnitaMisura": l2_unita,
+    "L2_PrezzoUnitario": l2_prezzo,
+    "L2_Sconto": l2_sconto,
+    "L2_PrezzoTotale": l2_prezzo_totale,
+    "L2_AliquotaIVA": l2_aliquota_iva,
+    "L2_Natura": l2_natura,
+
+    # Dati Riepilogo
+    "Riepilogo_AliquotaIVA": riepilogo_aliquota,
+    "Riepilogo_Natura": riepilogo_natura,
+    "Riepilogo_Imponibile": riepilogo_imponibile,
+    "Riepilogo_Imposta": riepilogo_imposta,
+    "Riepilogo_Riferimento": riepilogo_riferimento,
+
+    # Dati Pagamento
+    "CondizioniPagamento": condizioni_pagamento,
+    "ModalitaPagamento": modalita_pagamento,
+    "ImportoPagamento": importo_pagamento,
+    "IBAN": iban
+}
+if linee_upload:
+    # Con le righe del file Access totale documento e importo del pagamento
+    # vengono calcolati dai riepiloghi, non presi dal form
+    del params["ImportoTotale"], params["ImportoPagamento"]
+
+
 if uploaded_file and submitted:
     try:
         # Convert to string for better error handling
-        content = uploaded_file.read()
+        content = uploaded_file.getvalue()
         content_str = content.decode('utf-8')
         
         # Debug information in an expander to save screen space
         with st.expander("Debug - XML Contenuto"):
             st.code(content_str[:1000] + "..." if len(content_str) > 1000 else content_str)
         
-        # Parse the input XML
-        dati = parse_access_xml(content)
-        
-        # Prepare parameters for fattura elettronica
-        params = {
-            # Opzioni generali
-            "UseLocalSchema": use_local_schema,
-            
-            # Dati Trasmissione
-            "IdPaeseMittente": id_paese,
-            "IdCodiceMittente": id_codice,
-            "ProgressivoInvio": progressivo,
-            "FormatoTrasmissione": formato,
-            "CodiceDestinatario": codice_dest,
-            "TelefonoTrasmittente": telefono_trasmittente,
-            "EmailTrasmittente": email_trasmittente,
-            
-            # Cedente/Prestatore
-            "CodiceFiscaleMittente": codice_fiscale,
-            "DenominazioneMittente": denominazione,
-            "RegimeFiscale": regime,
-            "IndirizzoMittente": indirizzo,
-            "CAPMittente": cap,
-            "ComuneMittente": comune,
-            "ProvinciaMittente": provincia,
-            "NazioneMittente": nazione,
-            
-            # REA
-            "UfficioREA": rea_ufficio,
-            "NumeroREA": rea_numero,
-            "CapitaleSociale": rea_capitale,
-            "SocioUnico": rea_socio_unico,
-            "StatoLiquidazione": rea_liquidazione,
-            
-            # Contatti
-            "TelefonoCedente": telefono_cedente,
-            "EmailCedente": email_cedente,
-            
-            # Destinatario
-            "IdPaeseDestinatario": id_paese_dest,
-            "IdCodiceDestinatario": id_codice_dest,
-            "CodiceFiscaleDestinatario": cf_dest,
-            "DenominazioneDestinatario": denominazione_dest,
-            "IndirizzoDestinatario": indirizzo_dest,
-            "CAPDestinatario": cap_dest,
-            "ComuneDestinatario": comune_dest,
-            "ProvinciaDestinatario": provincia_dest,
-            "NazioneDestinatario": nazione_dest,
-            
-            # Dati Fattura
-            "TipoDocumento": tipo_documento,
-            "Divisa": divisa,
-            "NumeroFattura": numero_fattura,
-            "DataFattura": data_fattura,
-            "ImportoTotale": importo_totale,
-            "Causale": causale,
-            
-            # Dettaglio Linee 1
-            "L1_Descrizione": l1_descrizione,
-            "L1_Quantita": l1_quantita,
-            "L1_UnitaMisura": l1_unita,
-            "L1_PrezzoUnitario": l1_prezzo,
-            "L1_Sconto": l1_sconto,
-            "L1_PrezzoTotale": l1_prezzo_totale,
-            "L1_AliquotaIVA": l1_aliquota_iva,
-            "L1_Natura": l1_natura,
-            
-            # Dettaglio Linee 2
-            "L2_Descrizione": l2_descrizione,
-            "L2_Quantita": l2_quantita,
-            "L2_UnitaMisura": l2_unita,
-            "L2_PrezzoUnitario": l2_prezzo,
-            "L2_Sconto": l2_sconto,
-            "L2_PrezzoTotale": l2_prezzo_totale,
-            "L2_AliquotaIVA": l2_aliquota_iva,
-            "L2_Natura": l2_natura,
-            
-            # Dati Riepilogo
-            "Riepilogo_AliquotaIVA": riepilogo_aliquota,
-            "Riepilogo_Natura": riepilogo_natura,
-            "Riepilogo_Imponibile": riepilogo_imponibile,
-            "Riepilogo_Imposta": riepilogo_imposta,
-            "Riepilogo_Riferimento": riepilogo_riferimento,
-            
-            # Dati Pagamento
-            "CondizioniPagamento": condizioni_pagamento,
-            "ModalitaPagamento": modalita_pagamento,
-            "ImportoPagamento": importo_pagamento,
-            "IBAN": iban
-        }
+        # Parse the input XML (già in cache dal rerun corrente)
+        dati = parse_access_xml_cached(content)
+
+        if not progressivo:
+            # Un progressivo alla volta: la UI genera una fattura per click
+            with apri_progressivi(id_paese, id_codice, blocco=1) as allocatore:
+                progressivo = allocatore.prossimo()
+            params["ProgressivoInvio"] = progressivo
+            st.info(f"Progressivo Invio assegnato: {progressivo}")
         
         # Generate the XML
-        xml_output = crea_fattura_elettronica(dati, params)
+        with raccogli_metriche(metriche):
+            allegati = [Allegato(f) for f in file_allegati or []]
+            root = costruisci_fattura_elettronica(dati, params, allegati=allegati)
+            errori_xsd = errori_fattura(root) if valida_xsd else []
+            xml_output = "".join(iter_xml(root))
+        st.session_state["metriche_ultima_conversione"] = metriche.riepilogo()
         
         # Display success and preview
-        st.success("✅ XML generato correttamente!")
+        if errori_xsd:
+            st.warning(f"⚠️ XML generato, ma non conforme allo schema XSD ({len(errori_xsd)} errori)")
+            for errore in errori_xsd:
+                st.markdown(f"- `{errore['percorso']}`: {errore['messaggio']}")
+        else:
+            st.success("✅ XML generato correttamente!")
         
         # Show XML preview
         with st.expander("Anteprima XML"):
             st.code(xml_output[:1000] + "..." if len(xml_output) > 1000 else xml_output, language="xml")
         
+        # Nome SdI IT<IdCodice>_<progressivo>.xml, se il progressivo lo consente
+        try:
+            nome_file = nome_file_sdi(id_paese, id_codice, progressivo)
+        except ValueError:
+            nome_file = f"Fattura_Elettronica_{dati.get('Numero', 'nuovo')}.xml"
+
         # Download button for the XML file
         st.download_button(
             "📥 Scarica XML", 
             xml_output, 
-            file_name=f"Fattura_Elettronica_{dati.get('Numero', 'nuovo')}.xml",
+            file_name=nome_file,
             mime="application/xml"
         )
     except Exception as e:
@@ -419,3 +597,56 @@ if uploaded_file and submitted:
         st.error("Controlla che il file XML sia un valido file XML Access con i campi corretti.")
         import traceback
         st.expander("Dettagli errore").code(traceback.format_exc())
+elif uploaded_files and submitted:
+    profilo = {chiave: params[chiave] for chiave in CHIAVI_PROFILO}
+    profilo["CodiceDestinatario"] = CODICE_DESTINATARIO_PREDEFINITO
+    barra = st.progress(0.0, text="Conversione in corso...")
+
+    def aggiorna_barra(elaborati, totale):
+        barra.progress(elaborati / totale, text=f"Elaborati {elaborati} file su {totale}")
+
+    # L'archivio viene scritto una fattura alla volta, in memoria fino a
+    # ZIP_MAX_MEMORIA e poi su un file temporaneo
+    with tempfile.SpooledTemporaryFile(max_size=ZIP_MAX_MEMORIA) as archivio:
+        registro = apri_registro()
+        try:
+            with raccogli_metriche(metriche):
+                scritti, errori, allegati_esclusi = scrivi_zip_fatture(
+                    uploaded_files, profilo, archivio, valida_xsd, aggiorna_barra,
+                    file_allegati or [], registro)
+        finally:
+            if registro is not None:
+                registro.close()
+        st.session_state["metriche_ultima_conversione"] = metriche.riepilogo()
+
+        if allegati_esclusi:
+            st.warning("⚠️ Allegati non associati a nessuna fattura (il nome deve iniziare con il numero "
+                       f"della fattura): {', '.join(allegati_esclusi)}")
+
+        if errori:
+            st.warning(f"⚠️ {len(errori)} fatture non convertite")
+            for nome, numero, errore in errori:
+                origine = f"{nome} [{numero}]" if numero else nome
+                st.markdown(f"- `{origine}`: {errore}")
+        if scritti:
+            st.success(f"✅ {len(scritti)} fatture generate")
+            archivio.seek(0)
+            st.download_button(
+                "📥 Scarica ZIP",
+                archivio.read(),
+                file_name="Fatture_Elettroniche.zip",
+                mime="application/zip"
+            )
+
+# Tempi dell'ultima conversione, conservati tra un rerun e l'altro
+if "metriche_ultima_conversione" in st.session_state:
+    riepilogo = st.session_state["metriche_ultima_conversione"]
+    with st.expander("Tempi dell'ultima conversione"):
+        st.table([
+            {"Fase": fase, "Chiamate": statistiche["chiamate"],
+             "Totale (ms)": round(statistiche["totale"] * 1000, 3),
+             "Max (ms)": round(statistiche["max"] * 1000, 3)}
+            for fase, statistiche in riepilogo["fasi"].items()
+        ])
+        st.caption("Le fasi possono essere annidate (ad esempio cliente dentro estrazione). "
+                   + ", ".join(f"{nome}: {valore}" for nome, valore in riepilogo["contatori"].items()))
@@ -3,18 +3,137 @@
 Module funzioni_fiscali.py
 
 Contiene funzioni equivalenti alle LAMBDA di Excel per calcoli fiscali.
+
+Le aliquote di IRPEF e addizionale regionale sono descritte da tabelle di
+scaglioni (TabellaScaglioni) registrate per anno d'imposta e regione: una
+riforma si gestisce aggiungendo una tabella, ad esempio da un file JSON con
+carica_tabelle, senza modificare il codice.
+
+CacheFiscale è una memoizzazione opzionale, con dimensione limitata, per i
+fogli di calcolo che ripetono molte volte gli stessi redditi.
 """
+import json
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
 
-def add_reg(reddito):
-    """Calcola l'addizionale regionale IRPEF"""
-    if reddito <= 15000:
-        return reddito * 0.0123
-    elif reddito <= 28000:
-        return reddito * 0.0318
-    elif reddito <= 50000:
-        return reddito * 0.0323
+
+class TabellaScaglioni:
+    """Tabella di scaglioni di reddito con le relative aliquote.
+
+    Le soglie sono i limiti superiori degli scaglioni e sono incluse nello
+    scaglione inferiore (reddito <= soglia); l'ultima aliquota vale oltre
+    l'ultima soglia, quindi le aliquote sono una in più delle soglie.
+
+    Con progressiva=True ogni aliquota si applica alla sola parte di reddito
+    che cade nel proprio scaglione (IRPEF); con progressiva=False l'aliquota
+    dello scaglione raggiunto si applica all'intero reddito (addizionale
+    regionale). L'imposta cumulata all'inizio di ogni scaglione viene
+    calcolata una sola volta, quindi il calcolo costa una ricerca binaria.
+    """
+
+    def __init__(self, soglie, aliquote, progressiva=True):
+        soglie = tuple(soglie)
+        aliquote = tuple(aliquote)
+        if len(aliquote) != len(soglie) + 1:
+            raise ValueError(f"Servono {len(soglie) + 1} aliquote per {len(soglie)} soglie, trovate {len(aliquote)}")
+        if any(a >= b for a, b in zip(soglie, soglie[1:])):
+            raise ValueError(f"Le soglie devono essere strettamente crescenti: {soglie}")
+
+        self.soglie = soglie
+        self.aliquote = aliquote
+        self.progressiva = progressiva
+        self.inizi = (0,) + soglie
+
+        cumulate = [0.0]
+        for i, soglia in enumerate(soglie):
+            cumulate.append(cumulate[-1] + (soglia - self.inizi[i]) * aliquote[i])
+        self.cumulate = tuple(cumulate)
+
+    @classmethod
+    def da_dict(cls, dati, progressiva=True):
+        """Crea una tabella da {"soglie": [...], "aliquote": [...], "progressiva": bool}."""
+        return cls(dati["soglie"], dati["aliquote"], dati.get("progressiva", progressiva))
+
+    def scaglione(self, reddito):
+        """Indice dello scaglione in cui cade il reddito."""
+        return bisect_left(self.soglie, reddito)
+
+    def imposta(self, reddito):
+        """Calcola l'imposta dovuta sul reddito."""
+        i = self.scaglione(reddito)
+        if not self.progressiva:
+            return reddito * self.aliquote[i]
+        return self.cumulate[i] + (reddito - self.inizi[i]) * self.aliquote[i]
+
+    def __repr__(self):
+        tipo = "progressiva" if self.progressiva else "per scaglione"
+        return f"TabellaScaglioni(soglie={self.soglie}, aliquote={self.aliquote}, {tipo})"
+
+
+# Tabelle registrate: l'anno (e la regione) None indica la tabella predefinita,
+# usata quando il chiamante non specifica anno d'imposta o regione
+TABELLE_IRPEF = {
+    None: TabellaScaglioni((15000, 28000, 55000), (0.23, 0.27, 0.38, 0.41)),
+}
+TABELLE_ADD_REG = {
+    (None, None): TabellaScaglioni((15000, 28000, 50000), (0.0123, 0.0318, 0.0323, 0.0333), progressiva=False),
+}
+
+
+def tabella_irpef(anno=None):
+    """Restituisce la tabella IRPEF dell'anno indicato (None: tabella predefinita)."""
+    try:
+        return TABELLE_IRPEF[anno]
+    except KeyError:
+        raise ValueError(f"Nessuna tabella IRPEF per l'anno {anno}") from None
+
+
+def tabella_add_reg(anno=None, regione=None):
+    """Restituisce la tabella dell'addizionale regionale per anno e regione."""
+    try:
+        return TABELLE_ADD_REG[(anno, regione)]
+    except KeyError:
+        raise ValueError(f"Nessuna tabella di addizionale regionale per anno {anno}, regione {regione}") from None
+
+
+def carica_tabelle(sorgente):
+    """Registra le tabelle lette da un file JSON (o da un dizionario già caricato).
+
+    Formato:
+        {
+            "irpef": {"2024": {"soglie": [...], "aliquote": [...]}},
+            "add_reg": {"2024": {"Lombardia": {"soglie": [...], "aliquote": [...], "progressiva": true}}}
+        }
+
+    Le tabelle IRPEF sono progressive, quelle dell'addizionale regionale per
+    scaglione, salvo diversa indicazione con la chiave "progressiva". Le
+    tabelle già registrate con lo stesso anno/regione vengono sostituite.
+
+    Returns:
+        int: Numero di tabelle registrate
+    """
+    if isinstance(sorgente, dict):
+        dati = sorgente
     else:
-        return reddito * 0.0333
+        with open(sorgente, encoding="utf-8") as f:
+            dati = json.load(f)
+
+    nuove_irpef = {int(anno): TabellaScaglioni.da_dict(tabella)
+                   for anno, tabella in dati.get("irpef", {}).items()}
+    nuove_add_reg = {(int(anno), regione): TabellaScaglioni.da_dict(tabella, progressiva=False)
+                     for anno, regioni in dati.get("add_reg", {}).items()
+                     for regione, tabella in regioni.items()}
+
+    # Registrate solo dopo aver validato tutto il file
+    TABELLE_IRPEF.update(nuove_irpef)
+    TABELLE_ADD_REG.update(nuove_add_reg)
+    return len(nuove_irpef) + len(nuove_add_reg)
+
+
+def add_reg(reddito, anno=None, regione=None):
+    """Calcola l'addizionale regionale IRPEF"""
+    return tabella_add_reg(anno, regione).imposta(reddito)
 
 
 def bonus_redditi(reddito):
@@ -46,26 +165,19 @@ def ex_bonus_renzi(reddito):
     return 1200 if reddito < 15000 else 0
 
 
-def irpef(reddito):
+def irpef(reddito, anno=None):
     """Calcola l'IRPEF progressiva"""
-    if reddito <= 15000:
-        return reddito * 0.23
-    elif reddito <= 28000:
-        return (15000 * 0.23) + ((reddito - 15000) * 0.27)
-    elif reddito <= 55000:
-        return (15000 * 0.23) + (13000 * 0.27) + ((reddito - 28000) * 0.38)
-    else:
-        return (15000 * 0.23) + (13000 * 0.27) + (27000 * 0.38) + ((reddito - 55000) * 0.41)
+    return tabella_irpef(anno).imposta(reddito)
 
 
-def irpef_mensile(reddito):
+def irpef_mensile(reddito, anno=None):
     """Calcola l'IRPEF mensile"""
-    return irpef(reddito) / 12
+    return irpef(reddito, anno) / 12
 
 
-def irpef_con_addiz(reddito):
+def irpef_con_addiz(reddito, anno=None, regione=None):
     """Calcola l'IRPEF con le addizionali regionali incluse"""
-    return irpef(reddito) + add_reg(reddito)
+    return irpef(reddito, anno) + add_reg(reddito, anno, regione)
 
 
 def taglio_cun_fisc(reddito, lavoratore_dipendente):
@@ -73,6 +185,76 @@ def taglio_cun_fisc(reddito, lavoratore_dipendente):
     # esempio semplificato: applica 10% di taglio se dipendente
     return reddito * 0.1 if lavoratore_dipendente else 0
 
+class CacheFiscale:
+    """Memoizzazione LRU di irpef, add_reg, contr_inps e irpef_con_addiz.
+
+    Da usare al posto delle funzioni del modulo quando gli stessi redditi
+    vengono calcolati molte volte:
+
+        cache = CacheFiscale(maxsize=10000)
+        cache.irpef(30000)
+        cache.statistiche()
+
+    La chiave comprende la tabella di scaglioni usata, quindi le tabelle
+    sostituite da carica_tabelle non restituiscono risultati vecchi. Oltre
+    maxsize voci viene scartata quella usata meno di recente.
+    """
+
+    def __init__(self, maxsize=4096):
+        if maxsize < 1:
+            raise ValueError("maxsize deve essere almeno 1")
+        self.maxsize = maxsize
+        self.hits = 0
+        self.misses = 0
+        self._voci = OrderedDict()
+        self._lock = threading.Lock()
+
+    def _calcola(self, chiave, funzione, *args):
+        with self._lock:
+            if chiave in self._voci:
+                self._voci.move_to_end(chiave)
+                self.hits += 1
+                return self._voci[chiave]
+            self.misses += 1
+
+        risultato = funzione(*args)
+        with self._lock:
+            self._voci[chiave] = risultato
+            while len(self._voci) > self.maxsize:
+                self._voci.popitem(last=False)
+        return risultato
+
+    def irpef(self, reddito, anno=None):
+        """Come irpef, memoizzata."""
+        tabella = tabella_irpef(anno)
+        return self._calcola(("irpef", tabella, reddito), tabella.imposta, reddito)
+
+    def add_reg(self, reddito, anno=None, regione=None):
+        """Come add_reg, memoizzata."""
+        tabella = tabella_add_reg(anno, regione)
+        return self._calcola(("add_reg", tabella, reddito), tabella.imposta, reddito)
+
+    def contr_inps(self, reddito, aliquota):
+        """Come contr_inps, memoizzata."""
+        return self._calcola(("contr_inps", None, reddito, aliquota), contr_inps, reddito, aliquota)
+
+    def irpef_con_addiz(self, reddito, anno=None, regione=None):
+        """Come irpef_con_addiz, memoizzata."""
+        tabelle = (tabella_irpef(anno), tabella_add_reg(anno, regione))
+        return self._calcola(("irpef_con_addiz", tabelle, reddito), irpef_con_addiz, reddito, anno, regione)
+
+    def statistiche(self):
+        """Restituisce hits, misses, voci memorizzate e dimensione massima."""
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "voci": len(self._voci), "maxsize": self.maxsize}
+
+    def svuota(self):
+        """Elimina le voci memorizzate e azzera le statistiche."""
+        with self._lock:
+            self._voci.clear()
+            self.hits = self.misses = 0
+
+
 # Sezione di test (può essere rimossa per il deployment)
 if __name__ == "__main__":
     # Esempi di utilizzo delle funzioni
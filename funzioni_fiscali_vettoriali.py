@@ -0,0 +1,325 @@
+
+"""
+Module funzioni_fiscali_vettoriali.py
+
+Versioni vettoriali (NumPy) delle funzioni di funzioni_fiscali.
+Accettano uno scalare o un array di redditi e restituiscono un array con gli
+stessi risultati, elemento per elemento, delle versioni scalari: IRPEF e
+addizionale regionale usano le stesse TabellaScaglioni (con le imposte
+cumulate già calcolate), così anche gli arrotondamenti in virgola mobile
+coincidono.
+
+calcola_cedolini calcola in un solo passaggio tutte le componenti del
+cedolino (contributi, imposte, detrazioni, bonus e netto) per un'intera
+popolazione di dipendenti, letta anche da file CSV o Parquet;
+lordo_da_netto risolve il problema inverso (quale lordo dà un certo netto).
+"""
+import csv
+from pathlib import Path
+
+import numpy as np
+
+from funzioni_fiscali import tabella_add_reg, tabella_irpef
+
+
+def _redditi(reddito):
+    return np.asarray(reddito, dtype=float)
+
+
+def imposta(tabella, reddito):
+    """Applica una TabellaScaglioni a un array di redditi.
+
+    np.searchsorted con side="left" include le soglie nello scaglione
+    inferiore, come bisect_left in TabellaScaglioni.scaglione.
+    """
+    reddito = _redditi(reddito)
+    i = np.searchsorted(np.asarray(tabella.soglie, dtype=float), reddito, side="left")
+    return _imposta_scaglioni(tabella, reddito, i)
+
+
+def _imposta_scaglioni(tabella, reddito, i):
+    """Come imposta, con l'indice di scaglione i di ogni reddito già calcolato."""
+    aliquote = np.asarray(tabella.aliquote)[i]
+    if not tabella.progressiva:
+        return reddito * aliquote
+    return np.asarray(tabella.cumulate)[i] + (reddito - np.asarray(tabella.inizi, dtype=float)[i]) * aliquote
+
+
+def add_reg(reddito, anno=None, regione=None):
+    """Calcola l'addizionale regionale IRPEF"""
+    return imposta(tabella_add_reg(anno, regione), reddito)
+
+
+def bonus_redditi(reddito):
+    """Attribuisce un bonus fiscale basato sul reddito"""
+    reddito = _redditi(reddito)
+    return np.select([reddito < 15000, reddito <= 20000], [reddito * 0.053, reddito * 0.048], 0.0)
+
+
+def contr_inps(reddito, aliquota):
+    """Calcola i contributi INPS con maggiorazione sopra i 55.000€"""
+    reddito = _redditi(reddito)
+    base = reddito * aliquota
+    return np.where(reddito > 55000, base + (reddito - 55000) * 0.01, base)
+
+
+def detr_lav_dip(reddito, giorni, mese):
+    """Detrazioni per lavoro dipendente semplificate"""
+    detrazione = _redditi(reddito) * 0.2
+    return np.where(detrazione > 0, detrazione, 0.0) + (np.asarray(giorni) / 365.0 * mese)
+
+
+def ex_bonus_renzi(reddito):
+    """Bonus Renzi per i redditi inferiori a 15.000€"""
+    return np.where(_redditi(reddito) < 15000, 1200.0, 0.0)
+
+
+def irpef(reddito, anno=None):
+    """Calcola l'IRPEF progressiva"""
+    return imposta(tabella_irpef(anno), reddito)
+
+
+def irpef_mensile(reddito, anno=None):
+    """Calcola l'IRPEF mensile"""
+    return irpef(reddito, anno) / 12
+
+
+def irpef_con_addiz(reddito, anno=None, regione=None):
+    """Calcola l'IRPEF con le addizionali regionali incluse"""
+    return irpef(reddito, anno) + add_reg(reddito, anno, regione)
+
+
+def taglio_cun_fisc(reddito, lavoratore_dipendente):
+    """Calcola il taglio del cuneo fiscale"""
+    return np.where(np.asarray(lavoratore_dipendente, dtype=bool), _redditi(reddito) * 0.1, 0.0)
+
+
+COLONNE_DIPENDENTI = ("reddito", "aliquota_inps", "giorni", "dipendente")
+
+# Soglie fisse di bonus_redditi e contr_inps, dove il netto cambia pendenza o salta
+_SOGLIE_FISSE = (0.0, 15000.0, 20000.0, 55000.0)
+
+# Tolleranza (in euro) con cui un lordo candidato deve riprodurre il netto richiesto
+TOLLERANZA_NETTO = 1e-6
+
+_VALORI_VERI = {"1", "true", "vero", "si", "sì", "s", "x", "yes", "y"}
+
+
+def _indici_scaglioni(reddito, tabelle):
+    """Indice di scaglione dei redditi per più tabelle con una sola ricerca.
+
+    I redditi vengono collocati una volta tra le soglie di tutte le tabelle;
+    per ogni tabella basta poi una lettura dell'indice corrispondente, che dà
+    lo stesso risultato di np.searchsorted sulle sole soglie di quella tabella.
+    """
+    soglie = np.unique(np.concatenate([np.asarray(t.soglie, dtype=float) for t in tabelle]))
+    j = np.searchsorted(soglie, reddito, side="left")
+    # Un reddito nell'intervallo (soglie[j-1], soglie[j]] supera tutte le
+    # soglie della tabella minori o uguali a soglie[j-1]
+    precedenti = np.concatenate([[-np.inf], soglie])
+    return [np.searchsorted(np.asarray(t.soglie, dtype=float), precedenti, side="right")[j] for t in tabelle]
+
+
+def calcola_cedolini(reddito, aliquota_inps, giorni, dipendente, mese=0, anno=None, regione=None):
+    """Calcola tutte le componenti del cedolino per una popolazione di dipendenti.
+
+    Gli argomenti sono colonne (array o scalari, con broadcasting); ogni
+    componente coincide con la corrispondente funzione scalare di
+    funzioni_fiscali. Gli scaglioni di IRPEF e addizionale regionale vengono
+    cercati una sola volta per reddito.
+
+    Args:
+        reddito: Reddito annuo lordo
+        aliquota_inps: Aliquota dei contributi INPS a carico del dipendente
+        giorni: Giorni di lavoro per le detrazioni
+        dipendente: True per i lavoratori dipendenti (taglio del cuneo fiscale)
+        mese: Parametro mese di detr_lav_dip
+        anno (int): Anno d'imposta delle tabelle (None: tabelle predefinite)
+        regione (str): Regione per l'addizionale regionale
+
+    Returns:
+        dict: Array "inps", "irpef", "add_reg", "irpef_con_addiz",
+            "irpef_mensile", "detrazioni", "bonus", "taglio", "netto" e
+            "netto_mensile", dove netto = reddito - inps - irpef - add_reg
+            + detrazioni + bonus + taglio
+    """
+    reddito = _redditi(reddito)
+    tab_irpef = tabella_irpef(anno)
+    tab_add_reg = tabella_add_reg(anno, regione)
+    i_irpef, i_add_reg = _indici_scaglioni(reddito, (tab_irpef, tab_add_reg))
+
+    imposta_irpef = _imposta_scaglioni(tab_irpef, reddito, i_irpef)
+    imposta_add_reg = _imposta_scaglioni(tab_add_reg, reddito, i_add_reg)
+    inps = contr_inps(reddito, aliquota_inps)
+    detrazioni = detr_lav_dip(reddito, giorni, mese)
+    bonus = bonus_redditi(reddito)
+    taglio = taglio_cun_fisc(reddito, dipendente)
+    netto = reddito - inps - imposta_irpef - imposta_add_reg + detrazioni + bonus + taglio
+
+    return {
+        "inps": inps,
+        "irpef": imposta_irpef,
+        "add_reg": imposta_add_reg,
+        "irpef_con_addiz": imposta_irpef + imposta_add_reg,
+        "irpef_mensile": imposta_irpef / 12,
+        "detrazioni": detrazioni,
+        "bonus": bonus,
+        "taglio": taglio,
+        "netto": netto,
+        "netto_mensile": netto / 12,
+    }
+
+
+def _bisezione(netto_di, obiettivo, basso, alto, iterazioni=200):
+    """Ricerca per bisezione, elemento per elemento, di un lordo con netto >= obiettivo.
+
+    Richiede netto_di(basso) < obiettivo <= netto_di(alto); si ferma quando gli
+    intervalli non si restringono più.
+    """
+    for _ in range(iterazioni):
+        medio = basso + (alto - basso) / 2
+        raggiunto = netto_di(medio) >= obiettivo
+        nuovo_basso = np.where(raggiunto, basso, medio)
+        nuovo_alto = np.where(raggiunto, medio, alto)
+        if np.array_equal(nuovo_basso, basso) and np.array_equal(nuovo_alto, alto):
+            break
+        basso, alto = nuovo_basso, nuovo_alto
+    return alto
+
+
+def lordo_da_netto(netto, aliquota_inps, giorni=0, dipendente=True, mese=0, anno=None, regione=None):
+    """Calcola il reddito lordo annuo minimo che dà almeno il netto indicato.
+
+    Il netto di calcola_cedolini è lineare a tratti nel reddito: tra due soglie
+    consecutive (di IRPEF, addizionale regionale, bonus e contributi) vale
+    alfa + beta * reddito. Per ogni tratto i coefficienti vengono ricavati da
+    due valutazioni e l'equazione viene risolta esattamente; le soglie stesse
+    sono valutate a parte perché il netto può avere salti. Ogni candidato
+    viene verificato ricalcolando il netto e si sceglie il lordo più basso.
+    Gli elementi per cui nessun candidato è verificato vengono risolti per
+    bisezione.
+
+    Tutti gli argomenti possono essere array (con broadcasting), come in
+    calcola_cedolini.
+
+    Returns:
+        Array dei lordi annui; NaN dove il netto non è raggiungibile
+    """
+    obiettivo, aliquota_inps, giorni, dipendente = np.broadcast_arrays(
+        _redditi(netto), _redditi(aliquota_inps), _redditi(giorni), np.asarray(dipendente, dtype=bool))
+    minimo = obiettivo - TOLLERANZA_NETTO
+
+    def netto_di(lordo):
+        return calcola_cedolini(lordo, aliquota_inps, giorni, dipendente, mese, anno, regione)["netto"]
+
+    soglie = np.unique(np.concatenate([
+        _SOGLIE_FISSE, tabella_irpef(anno).soglie, tabella_add_reg(anno, regione).soglie]).astype(float))
+    soglie = soglie[soglie >= 0]
+
+    migliore = np.full(obiettivo.shape, np.inf)
+    for k, inizio in enumerate(soglie):
+        # La soglia stessa
+        candidato = np.full(obiettivo.shape, inizio)
+        migliore = np.where((netto_di(candidato) >= minimo) & (inizio < migliore), inizio, migliore)
+
+        # L'interno del tratto (inizio, fine): netto = alfa + beta * lordo
+        fine = soglie[k + 1] if k + 1 < len(soglie) else np.inf
+        ampiezza = fine - inizio if np.isfinite(fine) else max(inizio, 1.0)
+        x1 = np.full(obiettivo.shape, inizio + ampiezza / 3)
+        x2 = np.full(obiettivo.shape, inizio + ampiezza * 2 / 3)
+        n1 = netto_di(x1)
+        beta = (netto_di(x2) - n1) / (x2 - x1)
+        alfa = n1 - beta * x1
+
+        primo = np.nextafter(inizio, np.inf)
+        with np.errstate(divide="ignore", invalid="ignore"):
+            radice = (obiettivo - alfa) / beta
+        candidato = np.where(beta > 0, np.maximum(radice, primo), primo)
+        candidato = np.where(np.isfinite(candidato) & (candidato < fine), candidato, np.inf)
+        verificato = netto_di(np.where(np.isfinite(candidato), candidato, inizio)) >= minimo
+        migliore = np.where(verificato & (candidato < migliore), candidato, migliore)
+
+    # Ricerca per bisezione per gli elementi non risolti analiticamente
+    irrisolti = np.isinf(migliore)
+    if irrisolti.any():
+        basso = np.zeros(obiettivo.shape)
+        alto = np.full(obiettivo.shape, max(soglie[-1], 1.0))
+        for _ in range(64):
+            sotto = irrisolti & (netto_di(alto) < minimo)
+            if not sotto.any():
+                break
+            alto = np.where(sotto, alto * 2, alto)
+        raggiungibile = irrisolti & (netto_di(alto) >= minimo)
+        if raggiungibile.any():
+            trovato = _bisezione(netto_di, minimo, basso, alto)
+            migliore = np.where(raggiungibile, trovato, migliore)
+        migliore = np.where(irrisolti & ~raggiungibile, np.nan, migliore)
+
+    return migliore
+
+
+def _booleani(valori):
+    return np.array([str(v).strip().lower() in _VALORI_VERI for v in valori], dtype=bool)
+
+
+def carica_dipendenti(percorso):
+    """Legge le colonne dei dipendenti da un file CSV o Parquet.
+
+    Il file deve avere le colonne reddito, aliquota_inps, giorni e
+    dipendente (1/0, true/false, si/no). La lettura dei file .parquet
+    richiede pandas con pyarrow o fastparquet.
+
+    Returns:
+        dict: {colonna: array NumPy}
+    """
+    percorso = Path(percorso)
+    if percorso.suffix.lower() == ".parquet":
+        try:
+            import pandas as pd
+        except ImportError as e:
+            raise ImportError("La lettura dei file Parquet richiede il pacchetto 'pandas' (pip install pandas pyarrow)") from e
+        tabella = pd.read_parquet(percorso)
+        mancanti = [c for c in COLONNE_DIPENDENTI if c not in tabella.columns]
+        colonne = {c: tabella[c].to_numpy() for c in COLONNE_DIPENDENTI if c in tabella.columns}
+    else:
+        with open(percorso, newline="", encoding="utf-8-sig") as f:
+            reader = csv.DictReader(f)
+            mancanti = [c for c in COLONNE_DIPENDENTI if c not in (reader.fieldnames or ())]
+            righe = {c: [] for c in COLONNE_DIPENDENTI}
+            if not mancanti:
+                for riga in reader:
+                    for c in COLONNE_DIPENDENTI:
+                        righe[c].append(riga[c])
+        colonne = righe
+
+    if mancanti:
+        raise ValueError(f"Colonne mancanti in {percorso}: {', '.join(mancanti)}")
+
+    dipendente = colonne["dipendente"]
+    return {
+        "reddito": np.asarray(colonne["reddito"], dtype=float),
+        "aliquota_inps": np.asarray(colonne["aliquota_inps"], dtype=float),
+        "giorni": np.asarray(colonne["giorni"], dtype=float),
+        "dipendente": dipendente.astype(bool) if getattr(dipendente, "dtype", None) == bool else _booleani(dipendente),
+    }
+
+
+def cedolini_da_file(percorso, mese=0, anno=None, regione=None):
+    """Legge i dipendenti da un file CSV o Parquet e ne calcola i cedolini.
+
+    Returns:
+        dict: Le colonne lette da carica_dipendenti più quelle di calcola_cedolini
+    """
+    colonne = carica_dipendenti(percorso)
+    return {**colonne, **calcola_cedolini(**colonne, mese=mese, anno=anno, regione=regione)}
+
+
+# Sezione di test (può essere rimossa per il deployment)
+if __name__ == "__main__":
+    import time
+
+    redditi = np.random.default_rng(0).uniform(0, 120000, 500_000)
+    inizio = time.perf_counter()
+    imposte = irpef_con_addiz(redditi)
+    print(f"IRPEF con addiz per {redditi.size} redditi: {(time.perf_counter() - inizio) * 1000:.1f} ms")
+    print("IRPEF per reddito 30000:", irpef(30000))
@@ -0,0 +1,233 @@
+# manifesto.py
+"""
+Manifesto delle conversioni già eseguite, per rielaborare solo i file nuovi
+o modificati.
+
+Per ogni file Access convertito senza errori il manifesto (un database
+SQLite) registra dimensione e mtime, hash SHA-256 del contenuto, hash della
+configurazione usata (profilo e opzioni di conversione) e i file generati.
+Alla riesecuzione un file viene saltato se:
+
+- dimensione e mtime coincidono con quelli registrati, senza rileggerlo;
+- oppure, se sono cambiati (es. file ricopiato), il contenuto ha lo stesso hash;
+
+e in entrambi i casi la configurazione è la stessa e i file generati
+esistono ancora. Input e output sono registrati con il percorso assoluto,
+quindi il manifesto vale da qualunque directory venga eseguito.
+
+Quando un file modificato viene riconvertito, i file generati la volta
+precedente e non riscritti (es. con un altro ProgressivoInvio) vengono
+rimossi da batch_converter, perché non vengano trasmessi due volte. Per
+questo anche un file convertito solo in parte viene registrato, senza hash
+del contenuto: i suoi file generati sono noti e il file viene comunque
+riconvertito alla prossima esecuzione.
+
+Con --allegati l'elenco dei file della directory (nome, dimensione e mtime)
+fa parte della configurazione: aggiungere o modificare un allegato fa
+riconvertire tutti i file. Le modifiche all'anagrafica clienti non sono
+rilevate: per riconvertire comunque si usa --forza in batch_converter.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+from pathlib import Path
+
+# Dimensione dei blocchi letti per calcolare l'hash di un file
+BLOCCO_HASH = 1024 * 1024
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS conversioni (
+    input TEXT PRIMARY KEY,
+    dimensione INTEGER NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    hash_input TEXT NOT NULL,
+    hash_configurazione TEXT NOT NULL,
+    output TEXT NOT NULL,
+    convertito TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+def hash_file(percorso):
+    """Hash SHA-256 (esadecimale) del contenuto del file, letto a blocchi."""
+    h = hashlib.sha256()
+    with open(percorso, "rb") as f:
+        for blocco in iter(lambda: f.read(BLOCCO_HASH), b""):
+            h.update(blocco)
+    return h.hexdigest()
+
+
+def hash_configurazione(profilo, **opzioni):
+    """Hash del profilo e delle opzioni di conversione che determinano l'output.
+
+    I valori non serializzabili in JSON (es. Path) vengono convertiti in stringa.
+    """
+    testo = json.dumps({"profilo": profilo, "opzioni": opzioni}, sort_keys=True, default=str)
+    return hashlib.sha256(testo.encode("utf-8")).hexdigest()
+
+
+def elenco_directory(cartella):
+    """Nome, dimensione e mtime dei file di una directory, da includere in hash_configurazione."""
+    elenco = []
+    for voce in os.scandir(cartella):
+        if voce.is_file():
+            stat = voce.stat()
+            elenco.append((voce.name, stat.st_size, stat.st_mtime_ns))
+    return sorted(elenco)
+
+
+def chiave_input(percorso):
+    """Chiave di un file di input nel manifesto: il percorso assoluto."""
+    return str(Path(percorso).resolve())
+
+
+# Anche i file generati sono registrati con il percorso assoluto
+chiave_output = chiave_input
+
+
+class ManifestoConversioni:
+    """Manifesto su SQLite, usato dal solo processo principale."""
+
+    def __init__(self, percorso, timeout=30.0):
+        self.percorso = str(percorso)
+        self._conn = sqlite3.connect(self.percorso, timeout=timeout)
+        self._conn.row_factory = sqlite3.Row
+        with self._conn:
+            if self.percorso != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+                # Dopo un crash si perdono al più le ultime registrazioni,
+                # che vengono semplicemente riconvertite
+                self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        return self._conn.execute("SELECT COUNT(*) FROM conversioni").fetchone()[0]
+
+    def cerca(self, percorso_input):
+        """La conversione registrata per il file, come dizionario, o None."""
+        riga = self._conn.execute(
+            "SELECT * FROM conversioni WHERE input = ?", (chiave_input(percorso_input),)).fetchone()
+        if riga is None:
+            return None
+        voce = dict(riga)
+        voce["output"] = json.loads(voce["output"])
+        return voce
+
+    def da_convertire(self, file_input, configurazione):
+        """Separa i file da convertire da quelli invariati in base a stat e configurazione.
+
+        Args:
+            file_input (list): Percorsi dei file di input
+            configurazione (str): Valore di hash_configurazione per questa esecuzione
+
+        Returns:
+            tuple: (lista di (percorso, hash registrato o None), numero di file
+                invariati). L'hash registrato viene restituito quando la
+                configurazione è la stessa ma dimensione o mtime sono cambiati:
+                chi converte può confrontarlo con l'hash del contenuto attuale
+                e saltare il file se coincidono
+        """
+        registrate = {
+            riga["input"]: riga for riga in self._conn.execute(
+                "SELECT input, dimensione, mtime_ns, hash_input, output FROM conversioni"
+                " WHERE hash_configurazione = ?", (configurazione,))
+        }
+        candidati = []
+        invariati = 0
+        for percorso in file_input:
+            riga = registrate.get(chiave_input(percorso))
+            # Senza hash la conversione precedente non era completa
+            if (riga is None or not riga["hash_input"]
+                    or not all(os.path.exists(p) for p in json.loads(riga["output"]))):
+                candidati.append((percorso, None))
+                continue
+            stat = os.stat(percorso)
+            if stat.st_size == riga["dimensione"] and stat.st_mtime_ns == riga["mtime_ns"]:
+                invariati += 1
+            else:
+                candidati.append((percorso, riga["hash_input"]))
+        return candidati, invariati
+
+    def registra(self, percorso_input, hash_input, configurazione, output, stat=None):
+        """Registra (o aggiorna) la conversione di un file.
+
+        Args:
+            percorso_input (str | Path): File di input
+            hash_input (str): Valore di hash_file del contenuto convertito, o
+                None se alcune fatture non sono state convertite: il file
+                verrà riconvertito alla prossima esecuzione
+            configurazione (str): Valore di hash_configurazione
+            output (list): Percorsi dei file generati
+            stat (os.stat_result): Opzionale, stat del file letta prima della
+                conversione; se il file cambia nel frattempo la stat non
+                corrisponde più e alla prossima esecuzione viene ricontrollato
+        """
+        stat = stat or os.stat(percorso_input)
+        with self._conn:
+            self._conn.execute(
+                "INSERT INTO conversioni (input, dimensione, mtime_ns, hash_input, hash_configurazione, output)"
+                " VALUES (?, ?, ?, ?, ?, ?)"
+                " ON CONFLICT (input) DO UPDATE SET dimensione = excluded.dimensione,"
+                " mtime_ns = excluded.mtime_ns, hash_input = excluded.hash_input,"
+                " hash_configurazione = excluded.hash_configurazione, output = excluded.output,"
+                " convertito = CURRENT_TIMESTAMP",
+                (chiave_input(percorso_input), stat.st_size, stat.st_mtime_ns, hash_input or "", configurazione,
+                 json.dumps([chiave_output(p) for p in output])),
+            )
+
+    def output_in_uso(self, percorsi_output):
+        """Quali dei file generati indicati compaiono ancora nel manifesto."""
+        cercati = {chiave_output(p) for p in percorsi_output}
+        if not cercati:
+            return set()
+        segnaposto = ", ".join("?" * len(cercati))
+        return {riga[0] for riga in self._conn.execute(
+            f"SELECT DISTINCT uscita.value FROM conversioni, json_each(conversioni.output) AS uscita"
+            f" WHERE uscita.value IN ({segnaposto})", tuple(cercati))}
+
+    def collegati(self, percorsi_input):
+        """File registrati i cui output contengono anche fatture dei file indicati.
+
+        Con --lotto un file generato può raccogliere fatture di più input:
+        quando uno di questi cambia, il lotto va ricostruito e con lui gli
+        altri lotti dei file coinvolti, fino a chiudere l'insieme.
+
+        Returns:
+            set: Chiavi (percorsi assoluti) dei file collegati, esclusi quelli indicati
+        """
+        output_di = {riga["input"]: set(json.loads(riga["output"]))
+                     for riga in self._conn.execute("SELECT input, output FROM conversioni")}
+        input_di = {}
+        for chiave, output in output_di.items():
+            for uscita in output:
+                input_di.setdefault(uscita, set()).add(chiave)
+
+        iniziali = {chiave_input(p) for p in percorsi_input}
+        trovati = set(iniziali)
+        da_esaminare = list(iniziali)
+        while da_esaminare:
+            for uscita in output_di.get(da_esaminare.pop(), ()):
+                for chiave in input_di[uscita] - trovati:
+                    trovati.add(chiave)
+                    da_esaminare.append(chiave)
+        return trovati - iniziali
+
+    def aggiorna_stat(self, percorso_input, stat=None):
+        """Aggiorna dimensione e mtime di un file il cui contenuto non è cambiato."""
+        stat = stat or os.stat(percorso_input)
+        with self._conn:
+            self._conn.execute(
+                "UPDATE conversioni SET dimensione = ?, mtime_ns = ? WHERE input = ?",
+                (stat.st_size, stat.st_mtime_ns, chiave_input(percorso_input)),
+            )
@@ -0,0 +1,145 @@
+# progressivi.py
+"""
+Assegnazione dei ProgressivoInvio e nomi dei file secondo le regole SdI.
+
+Il nome di un file trasmesso allo SdI è <IdPaese><IdCodice>_<progressivo>.xml,
+dove il progressivo è una stringa alfanumerica di al massimo 5 caratteri che
+non deve ripetersi per lo stesso trasmittente. I progressivi vengono generati
+da un contatore per trasmittente in un database SQLite e scritti in base 36
+(00001, 00002, ..., 0000Z, 00010, ...): lo stesso valore è usato come
+ProgressivoInvio nell'header della fattura.
+
+Per non contendersi il database a ogni fattura, ogni processo riserva un
+blocco di progressivi consecutivi in un'unica transazione e li assegna poi
+in memoria. Il blocco è registrato prima di usarne il primo valore: se il
+processo termina a metà, i progressivi rimasti inutilizzati vengono persi
+(la numerazione ha dei buchi) ma non saranno mai assegnati a un altro file.
+
+    with AllocatoreProgressivi("progressivi.sqlite", "IT", "01036270096") as allocatore:
+        progressivo = allocatore.prossimo()      # "00001"
+        allocatore.nome_file(progressivo)        # "IT01036270096_00001.xml"
+"""
+import re
+import sqlite3
+import threading
+
+ALFABETO_BASE36 = "0123456789ABCDEFGHIJKLMNOPQRSTUVWXYZ"
+LUNGHEZZA_PROGRESSIVO = 5
+MASSIMO_PROGRESSIVO = 36 ** LUNGHEZZA_PROGRESSIVO - 1
+# Progressivi riservati da un processo a ogni accesso al database
+BLOCCO_PREDEFINITO = 100
+
+_RE_PROGRESSIVO = re.compile(r"[A-Za-z0-9]{1,%d}" % LUNGHEZZA_PROGRESSIVO)
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS contatori (
+    trasmittente TEXT PRIMARY KEY,
+    prossimo INTEGER NOT NULL,
+    aggiornato TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+"""
+
+
+def in_base36(numero, lunghezza=LUNGHEZZA_PROGRESSIVO):
+    """Scrive numero in base 36 (cifre e lettere maiuscole), completato a sinistra con zeri."""
+    if numero < 0:
+        raise ValueError(f"Numero negativo: {numero}")
+    cifre = []
+    while numero:
+        numero, resto = divmod(numero, 36)
+        cifre.append(ALFABETO_BASE36[resto])
+    return "".join(reversed(cifre)).rjust(lunghezza, "0")
+
+
+def da_base36(testo):
+    """Valore numerico di un progressivo in base 36."""
+    return int(testo, 36)
+
+
+def nome_file_sdi(id_paese, id_codice, progressivo, estensione=".xml"):
+    """Nome del file da trasmettere allo SdI: <IdPaese><IdCodice>_<progressivo>.xml
+
+    Raises:
+        ValueError: Se il progressivo non è alfanumerico o supera i 5 caratteri
+    """
+    if not _RE_PROGRESSIVO.fullmatch(progressivo or ""):
+        raise ValueError(f"Progressivo non valido per il nome del file SdI: {progressivo!r}")
+    return f"{id_paese}{id_codice}_{progressivo}{estensione}"
+
+
+class AllocatoreProgressivi:
+    """Assegna progressivi univoci per un trasmittente, a blocchi.
+
+    Ogni processo deve usare un proprio allocatore (e quindi una propria
+    connessione); all'interno del processo l'allocatore può essere condiviso
+    tra thread. Più processi che usano lo stesso file ricevono blocchi
+    disgiunti: la riserva avviene in una transazione BEGIN IMMEDIATE, che
+    attende fino a timeout secondi se un altro processo sta riservando.
+    """
+
+    def __init__(self, percorso, id_paese, id_codice, blocco=BLOCCO_PREDEFINITO, timeout=30.0):
+        if blocco < 1:
+            raise ValueError(f"Dimensione del blocco non valida: {blocco}")
+        self.percorso = str(percorso)
+        self.id_paese = id_paese
+        self.id_codice = id_codice
+        self.blocco = blocco
+        self._trasmittente = f"{id_paese}{id_codice}"
+        # Le transazioni sono gestite esplicitamente in _riserva
+        self._conn = sqlite3.connect(self.percorso, timeout=timeout, isolation_level=None,
+                                     check_same_thread=False)
+        self._lock = threading.Lock()
+        self._prossimo = self._fine = 0
+        with self._lock:
+            if self.percorso != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def _riserva(self):
+        """Riserva nel database il prossimo blocco di progressivi per il trasmittente."""
+        self._conn.execute("BEGIN IMMEDIATE")
+        try:
+            riga = self._conn.execute(
+                "SELECT prossimo FROM contatori WHERE trasmittente = ?", (self._trasmittente,)).fetchone()
+            inizio = riga[0] if riga else 1
+            if inizio > MASSIMO_PROGRESSIVO:
+                raise ValueError(f"Progressivi esauriti per il trasmittente {self._trasmittente}")
+            fine = min(inizio + self.blocco, MASSIMO_PROGRESSIVO + 1)
+            self._conn.execute(
+                "INSERT INTO contatori (trasmittente, prossimo) VALUES (?, ?)"
+                " ON CONFLICT (trasmittente) DO UPDATE SET"
+                " prossimo = excluded.prossimo, aggiornato = CURRENT_TIMESTAMP",
+                (self._trasmittente, fine),
+            )
+            self._conn.execute("COMMIT")
+        except BaseException:
+            self._conn.execute("ROLLBACK")
+            raise
+        self._prossimo, self._fine = inizio, fine
+
+    def prossimo(self):
+        """Il prossimo progressivo libero, es. "0000A".
+
+        Raises:
+            ValueError: Se i 36^5 - 1 progressivi del trasmittente sono esauriti
+        """
+        with self._lock:
+            if self._prossimo >= self._fine:
+                self._riserva()
+            numero = self._prossimo
+            self._prossimo += 1
+        return in_base36(numero)
+
+    def nome_file(self, progressivo):
+        """Nome del file SdI del trasmittente per il progressivo (vedi nome_file_sdi)."""
+        return nome_file_sdi(self.id_paese, self.id_codice, progressivo)
@@ -0,0 +1,182 @@
+# registro_clienti.py
+"""
+Anagrafica locale dei clienti (cessionari) in un database SQLite.
+
+Il registro viene popolato con i dati del destinatario estratti dagli export
+Access (campo Cliente) e completato a mano con quello che l'export non
+contiene: CodiceDestinatario SdI e PEC. Durante la conversione compila_params
+cerca il cliente per partita IVA o codice fiscale (entrambi indicizzati) e
+usa i dati del registro al posto di quelli ricavati dal testo libero.
+
+    with RegistroClienti("clienti.sqlite") as registro:
+        registro.imposta_recapito("00267740108", codice_destinatario="X2PH38J")
+        params = compila_params(profilo, dati, registro)
+"""
+import sqlite3
+import threading
+
+# Colonne del registro e corrispondenti chiavi del dizionario Destinatario
+# prodotto da parse_cliente_field
+COLONNE_ANAGRAFICA = {
+    "partita_iva": "PartitaIVA",
+    "codice_fiscale": "CodiceFiscale",
+    "denominazione": "Denominazione",
+    "indirizzo": "Indirizzo",
+    "cap": "CAP",
+    "comune": "Comune",
+    "provincia": "Provincia",
+}
+COLONNE_RECAPITO = {
+    "codice_destinatario": "CodiceDestinatario",
+    "pec": "PEC",
+}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS clienti (
+    chiave TEXT PRIMARY KEY,
+    partita_iva TEXT,
+    codice_fiscale TEXT,
+    denominazione TEXT,
+    indirizzo TEXT,
+    cap TEXT,
+    comune TEXT,
+    provincia TEXT,
+    codice_destinatario TEXT,
+    pec TEXT,
+    aggiornato TEXT NOT NULL DEFAULT CURRENT_TIMESTAMP
+);
+CREATE INDEX IF NOT EXISTS clienti_partita_iva ON clienti (partita_iva);
+CREATE INDEX IF NOT EXISTS clienti_codice_fiscale ON clienti (codice_fiscale);
+"""
+
+# Un cliente già registrato mantiene i valori presenti (eventualmente corretti
+# a mano): i dati dell'export riempiono solo i campi vuoti
+_REGISTRA = """
+INSERT INTO clienti (chiave, {colonne}) VALUES (:chiave, {valori})
+ON CONFLICT (chiave) DO UPDATE SET {aggiorna}, aggiornato = CURRENT_TIMESTAMP
+""".format(
+    colonne=", ".join(COLONNE_ANAGRAFICA),
+    valori=", ".join(f":{c}" for c in COLONNE_ANAGRAFICA),
+    aggiorna=", ".join(f"{c} = COALESCE(clienti.{c}, excluded.{c})" for c in COLONNE_ANAGRAFICA),
+)
+
+
+def _chiave(partita_iva, codice_fiscale):
+    """Chiave primaria: la partita IVA, oppure il codice fiscale per i clienti privati."""
+    if partita_iva:
+        return f"PI:{partita_iva}"
+    if codice_fiscale:
+        return f"CF:{codice_fiscale}"
+    return None
+
+
+def _valore(testo):
+    testo = (testo or "").strip()
+    return testo or None
+
+
+class RegistroClienti:
+    """Registro dei clienti su SQLite, utilizzabile da più thread.
+
+    Più processi possono aprire lo stesso file: il database usa il journal
+    WAL e attende fino a timeout secondi se un altro processo sta scrivendo.
+    """
+
+    def __init__(self, percorso=":memory:", timeout=30.0):
+        self.percorso = str(percorso)
+        self._conn = sqlite3.connect(self.percorso, timeout=timeout, check_same_thread=False)
+        self._conn.row_factory = sqlite3.Row
+        self._lock = threading.Lock()
+        with self._lock, self._conn:
+            if self.percorso != ":memory:":
+                self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.executescript(_SCHEMA)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+        return False
+
+    def close(self):
+        self._conn.close()
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute("SELECT COUNT(*) FROM clienti").fetchone()[0]
+
+    def _parametri(self, destinatario):
+        valori = {colonna: _valore(destinatario.get(campo)) for colonna, campo in COLONNE_ANAGRAFICA.items()}
+        valori["chiave"] = _chiave(valori["partita_iva"], valori["codice_fiscale"])
+        return valori
+
+    def registra(self, destinatario):
+        """Aggiunge o completa un cliente dai dati estratti dal campo Cliente.
+
+        Args:
+            destinatario (dict): Dizionario come quello di parse_cliente_field
+
+        Returns:
+            bool: False se il destinatario non ha né partita IVA né codice fiscale
+        """
+        return self.registra_molti([destinatario]) == 1
+
+    def registra_molti(self, destinatari):
+        """Come registra per molti destinatari, in una sola transazione.
+
+        Returns:
+            int: Numero di destinatari registrati
+        """
+        righe = [r for r in map(self._parametri, destinatari) if r["chiave"]]
+        with self._lock, self._conn:
+            self._conn.executemany(_REGISTRA, righe)
+        return len(righe)
+
+    def registra_fatture(self, fatture):
+        """Registra i destinatari di fatture restituite da parse_access_xml / iter_fatture_access."""
+        return self.registra_molti(dati.get("Destinatario", {}) for dati in fatture)
+
+    def imposta_recapito(self, partita_iva=None, codice_fiscale=None, codice_destinatario=None, pec=None):
+        """Imposta CodiceDestinatario SdI e/o PEC di un cliente, creandolo se manca.
+
+        I valori None lasciano invariato il campo corrispondente.
+        """
+        chiave = _chiave(_valore(partita_iva), _valore(codice_fiscale))
+        if chiave is None:
+            raise ValueError("Serve la partita IVA o il codice fiscale del cliente")
+        with self._lock, self._conn:
+            self._conn.execute(
+                "INSERT INTO clienti (chiave, partita_iva, codice_fiscale, codice_destinatario, pec)"
+                " VALUES (?, ?, ?, ?, ?)"
+                " ON CONFLICT (chiave) DO UPDATE SET"
+                " codice_destinatario = COALESCE(excluded.codice_destinatario, clienti.codice_destinatario),"
+                " pec = COALESCE(excluded.pec, clienti.pec), aggiornato = CURRENT_TIMESTAMP",
+                (chiave, _valore(partita_iva), _valore(codice_fiscale), _valore(codice_destinatario), _valore(pec)),
+            )
+
+    def cerca(self, partita_iva=None, codice_fiscale=None):
+        """Cerca un cliente per partita IVA e, in mancanza, per codice fiscale.
+
+        Returns:
+            dict | None: I campi del cliente con le chiavi di parse_cliente_field
+                più "CodiceDestinatario" e "PEC"; solo i campi valorizzati
+        """
+        with self._lock:
+            riga = None
+            if partita_iva:
+                riga = self._conn.execute(
+                    "SELECT * FROM clienti WHERE partita_iva = ? LIMIT 1", (partita_iva,)).fetchone()
+            if riga is None and codice_fiscale:
+                riga = self._conn.execute(
+                    "SELECT * FROM clienti WHERE codice_fiscale = ? ORDER BY partita_iva IS NOT NULL LIMIT 1",
+                    (codice_fiscale,)).fetchone()
+        if riga is None:
+            return None
+        campi = {**COLONNE_ANAGRAFICA, **COLONNE_RECAPITO}
+        return {campo: riga[colonna] for colonna, campo in campi.items() if riga[colonna]}
+
+    def cerca_destinatario(self, dati_access):
+        """Cerca il cessionario di una fattura restituita da parse_access_xml."""
+        destinatario = dati_access.get("Destinatario", {})
+        return self.cerca(destinatario.get("PartitaIVA"), destinatario.get("CodiceFiscale"))
@@ -0,0 +1,300 @@
+# servizio_conversione.py
+"""
+Servizio HTTP asincrono di conversione degli export Access in FatturaPA,
+per i gestionali che inviano i file in modo automatico.
+
+Uso:
+    python servizio_conversione.py --profilo profilo.json [--port 8080]
+
+Il profilo è lo stesso file JSON di batch_converter; con --registro
+clienti.sqlite, come in batch_converter, i destinatari vengono aggiunti
+all'anagrafica clienti e CodiceDestinatario e PEC dei clienti registrati
+vengono presi dal registro. Endpoint:
+
+    POST /fattura   corpo: un export Access con una fattura.
+                    Risposta: l'XML FatturaPA (application/xml), oppure
+                    422 con {"numero": ..., "errore": ...}
+    POST /fatture   corpo: un export Access con più fatture, oppure più file
+                    in multipart/form-data. Risposta JSON:
+                    {"fatture": [{"file", "numero", "nome_file", "xml"} o
+                    {"file", "numero", "errore"}], "convertite": n, "errori": n}
+    GET  /salute    {"stato": "ok"}
+
+La conversione gira in un pool di processi: il ciclo di eventi si occupa
+solo di ricevere e inviare i dati. Al massimo max_concorrenti conversioni
+sono affidate al pool contemporaneamente, le altre richieste attendono il
+proprio turno; i corpi più grandi di max_dimensione ricevono 413. Ogni
+export (o ogni file di una richiesta multipart) è convertito da un solo
+processo: per distribuire un lotto grande su tutti i core conviene inviarlo
+come più file in un'unica richiesta multipart.
+
+Per i test l'applicazione si usa senza aprire porte con aiohttp.test_utils:
+
+    async with TestClient(TestServer(crea_app(profilo))) as client:
+        risposta = await client.post("/fattura", data=export)
+"""
+import argparse
+import asyncio
+import json
+import sys
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+
+from aiohttp import web
+
+from batch_converter import nome_file_output, numero_processi_disponibili
+from progressivi import AllocatoreProgressivi
+from registro_clienti import RegistroClienti
+from xml_invoice_backend import (
+    iter_fatture_access, costruisci_fattura_elettronica, compila_params, iter_xml_bytes, ProfiloCedente
+)
+from xsd_validator import carica_schema, errori_fattura
+
+# Dimensione massima del corpo di una richiesta, in byte
+MAX_DIMENSIONE = 32 * 1024 * 1024
+
+CHIAVE_POOL = web.AppKey("pool", ProcessPoolExecutor)
+CHIAVE_SEMAFORO = web.AppKey("semaforo", asyncio.Semaphore)
+CHIAVE_MAX_DIMENSIONE = web.AppKey("max_dimensione", int)
+
+# Stato del processo worker, impostato una sola volta da _init_worker
+_profilo = None
+_cedente = None
+_valida = False
+_progressivi = None
+_registro = None
+
+
+def _init_worker(profilo, valida=False, progressivi=None, registro=None):
+    global _profilo, _cedente, _valida, _progressivi, _registro
+    _profilo = profilo
+    _cedente = ProfiloCedente(profilo)
+    _valida = valida
+    # Ogni processo apre una propria connessione al registro
+    _registro = RegistroClienti(registro) if registro else None
+    _progressivi = (AllocatoreProgressivi(progressivi, profilo["IdPaeseMittente"], profilo["IdCodiceMittente"])
+                    if progressivi else None)
+    if valida:
+        carica_schema()
+
+
+def _converti_fattura(dati):
+    numero = dati.get("Numero")
+    try:
+        params = compila_params(_profilo, dati, _registro)
+        nome = nome_file_output(dati, "fattura")
+        if _progressivi is not None:
+            params["ProgressivoInvio"] = _progressivi.prossimo()
+            nome = _progressivi.nome_file(params["ProgressivoInvio"])
+        root = costruisci_fattura_elettronica(dati, params, cedente=_cedente)
+        if _valida:
+            errori = errori_fattura(root)
+            if errori:
+                dettagli = "; ".join(f"{e['percorso']}: {e['messaggio']}" for e in errori)
+                return {"numero": numero, "errore": f"schema XSD non rispettato: {dettagli}"}
+        return {"numero": numero, "nome_file": nome, "xml": b"".join(iter_xml_bytes(root))}
+    except Exception as e:
+        return {"numero": numero, "errore": str(e)}
+
+
+def _converti(contenuto, massimo=None):
+    """Converte tutte le fatture di un export Access; eseguita nei processi worker.
+
+    Con il registro clienti i destinatari dell'export vengono registrati alla
+    fine, in un'unica transazione, come in batch_converter.
+
+    Args:
+        contenuto (bytes): L'export Access
+        massimo (int): Opzionale, numero massimo di fatture: se l'export ne
+            contiene di più la lettura si ferma alla prima in eccesso e non
+            viene convertito né registrato nulla, senza consumare progressivi
+
+    Returns:
+        tuple: (per ogni fattura {"numero", "nome_file", "xml" (bytes)} oppure
+            {"numero", "errore"}; errori dell'export, come lettura del file o
+            aggiornamento del registro)
+    """
+    risultati = []
+    errori = []
+    destinatari = []
+    fatture = iter_fatture_access(contenuto)
+    if massimo is not None:
+        try:
+            fatture = list(islice(fatture, massimo + 1))
+        except Exception as e:
+            return risultati, [str(e)]
+        if len(fatture) > massimo:
+            return risultati, [f"L'export contiene più fatture del massimo consentito ({massimo}): usare /fatture"]
+    try:
+        for dati in fatture:
+            risultati.append(_converti_fattura(dati))
+            destinatari.append(dati.get("Destinatario", {}))
+    except Exception as e:
+        errori.append(str(e))
+    if _registro is not None and destinatari:
+        try:
+            _registro.registra_molti(destinatari)
+        except Exception as e:
+            errori.append(f"registro clienti non aggiornato: {e}")
+    return risultati, errori
+
+
+async def _converti_nel_pool(app, contenuto, massimo=None):
+    async with app[CHIAVE_SEMAFORO]:
+        return await asyncio.get_running_loop().run_in_executor(app[CHIAVE_POOL], _converti, contenuto, massimo)
+
+
+async def _leggi_corpo(request):
+    contenuto = await request.read()
+    if not contenuto:
+        raise web.HTTPBadRequest(text="Corpo della richiesta vuoto")
+    return contenuto
+
+
+async def _leggi_multipart(request):
+    """File di una richiesta multipart come lista di (nome, contenuto).
+
+    client_max_size non si applica alla lettura a blocchi delle parti: il
+    limite sulla dimensione totale viene controllato qui.
+    """
+    massimo = request.app[CHIAVE_MAX_DIMENSIONE]
+    totale = 0
+    sorgenti = []
+    reader = await request.multipart()
+    async for parte in reader:
+        blocchi = []
+        while blocco := await parte.read_chunk():
+            totale += len(blocco)
+            if totale > massimo:
+                raise web.HTTPRequestEntityTooLarge(max_size=massimo, actual_size=totale)
+            blocchi.append(blocco)
+        sorgenti.append((parte.filename or parte.name, b"".join(blocchi)))
+    if not sorgenti:
+        raise web.HTTPBadRequest(text="Nessun file nella richiesta")
+    return sorgenti
+
+
+async def converti_fattura(request):
+    """POST /fattura: l'XML FatturaPA dell'unica fattura dell'export."""
+    risultati, errori = await _converti_nel_pool(request.app, await _leggi_corpo(request), massimo=1)
+    if errori:
+        numero = risultati[0]["numero"] if risultati else None
+        return web.json_response({"numero": numero, "errore": "; ".join(errori)}, status=422)
+    risultato = risultati[0]
+    if "errore" in risultato:
+        return web.json_response(risultato, status=422)
+    return web.Response(
+        body=risultato["xml"], content_type="application/xml", charset="utf-8",
+        headers={"Content-Disposition": f'attachment; filename="{risultato["nome_file"]}"'},
+    )
+
+
+async def converti_fatture(request):
+    """POST /fatture: tutte le fatture di uno o più export, in JSON."""
+    if request.content_type.startswith("multipart/"):
+        sorgenti = await _leggi_multipart(request)
+    else:
+        sorgenti = [(None, await _leggi_corpo(request))]
+    esiti = await asyncio.gather(*(_converti_nel_pool(request.app, contenuto) for _, contenuto in sorgenti))
+
+    fatture = []
+    for (nome, _), (risultati, errori) in zip(sorgenti, esiti):
+        for risultato in risultati:
+            if "xml" in risultato:
+                risultato["xml"] = risultato["xml"].decode("utf-8")
+            fatture.append({"file": nome, **risultato})
+        fatture.extend({"file": nome, "numero": None, "errore": errore} for errore in errori)
+    errori = sum("errore" in fattura for fattura in fatture)
+    return web.json_response({"fatture": fatture, "convertite": len(fatture) - errori, "errori": errori})
+
+
+async def salute(request):
+    return web.json_response({"stato": "ok"})
+
+
+def crea_app(profilo, processi=None, max_concorrenti=None, max_dimensione=MAX_DIMENSIONE, valida=False,
+             progressivi=None, registro=None):
+    """Crea l'applicazione aiohttp del servizio.
+
+    Args:
+        profilo (dict): Parametri comuni a tutte le fatture, come in batch_converter
+        processi (int): Processi del pool di conversione (default: core disponibili)
+        max_concorrenti (int): Conversioni affidate al pool contemporaneamente
+            (default: il doppio dei processi, per non lasciarli mai senza lavoro)
+        max_dimensione (int): Dimensione massima del corpo di una richiesta, in byte
+        valida (bool): Se True, le fatture non conformi allo schema XSD
+            locale vengono restituite come errore
+        progressivi (str | Path): Opzionale, file SQLite dei progressivi di
+            invio (vedi progressivi)
+        registro (str | Path): Opzionale, file SQLite dell'anagrafica clienti:
+            i destinatari vengono registrati e CodiceDestinatario e PEC dei
+            clienti registrati vengono presi dal registro (vedi registro_clienti)
+
+    Returns:
+        aiohttp.web.Application: Il pool viene avviato e chiuso insieme all'applicazione
+
+    Raises:
+        ValueError, KeyError: Se i dati del cedente nel profilo non sono validi
+    """
+    # Verifica il profilo prima di avviare i worker, che lo ricostruiscono
+    ProfiloCedente(profilo)
+    if progressivi:
+        AllocatoreProgressivi(progressivi, profilo["IdPaeseMittente"], profilo["IdCodiceMittente"]).close()
+    if registro:
+        # Crea il database (e il suo schema) prima di avviare i worker
+        RegistroClienti(registro).close()
+    processi = processi or numero_processi_disponibili()
+    max_concorrenti = max_concorrenti or 2 * processi
+
+    async def pool_conversione(app):
+        with ProcessPoolExecutor(processi, initializer=_init_worker,
+                                 initargs=(profilo, valida, progressivi, registro)) as pool:
+            app[CHIAVE_POOL] = pool
+            app[CHIAVE_SEMAFORO] = asyncio.Semaphore(max_concorrenti)
+            yield
+
+    app = web.Application(client_max_size=max_dimensione)
+    app[CHIAVE_MAX_DIMENSIONE] = max_dimensione
+    app.cleanup_ctx.append(pool_conversione)
+    app.add_routes([
+        web.post("/fattura", converti_fattura),
+        web.post("/fatture", converti_fatture),
+        web.get("/salute", salute),
+    ])
+    return app
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Servizio HTTP di conversione degli export Access in FatturaPA")
+    parser.add_argument("--profilo", required=True, help="File JSON con i parametri comuni delle fatture")
+    parser.add_argument("--host", default="127.0.0.1", help="Indirizzo di ascolto (default: 127.0.0.1)")
+    parser.add_argument("--port", type=int, default=8080, help="Porta di ascolto (default: 8080)")
+    parser.add_argument("--processi", type=int, default=None,
+                        help="Processi di conversione (default: numero di core disponibili)")
+    parser.add_argument("--max-concorrenti", type=int, default=None,
+                        help="Conversioni in corso contemporaneamente (default: il doppio dei processi)")
+    parser.add_argument("--max-dimensione", type=int, default=MAX_DIMENSIONE // 2 ** 20,
+                        help=f"Dimensione massima di una richiesta in MiB (default: {MAX_DIMENSIONE // 2 ** 20})")
+    parser.add_argument("--valida", action="store_true",
+                        help="Valida ogni fattura con lo schema XSD locale prima di restituirla")
+    parser.add_argument("--progressivi",
+                        help="Database SQLite dei ProgressivoInvio: assegna progressivi univoci e nomi file SdI")
+    parser.add_argument("--registro",
+                        help="Database SQLite dell'anagrafica clienti da aggiornare e consultare")
+    args = parser.parse_args(argv)
+
+    with open(args.profilo, encoding="utf-8") as f:
+        profilo = json.load(f)
+
+    try:
+        app = crea_app(profilo, args.processi, args.max_concorrenti, args.max_dimensione * 2 ** 20,
+                       valida=args.valida, progressivi=args.progressivi, registro=args.registro)
+    except (ValueError, KeyError) as e:
+        print(f"Profilo non valido: {e}", file=sys.stderr)
+        return 1
+    web.run_app(app, host=args.host, port=args.port)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -1,92 +1,210 @@
 # backend.py
+import base64
+import codecs
+import contextvars
+import copy
+import hashlib
+import io
+from contextlib import contextmanager, nullcontext
+from decimal import Decimal, InvalidOperation, ROUND_HALF_UP
+from functools import lru_cache
+import re
+import threading
+import time
+from collections import OrderedDict, defaultdict
 from pathlib import Path
 import xml.etree.ElementTree as ET
-from xml.dom import minidom
 
-# Valid countries according to NazioneType in the XSD schema
-VALID_COUNTRIES = [
+SCHEMA_XSD_PATH = Path(__file__).with_name("Schema_VFPR12.xsd")
+XS_NAMESPACE = "http://www.w3.org/2001/XMLSchema"
+
+
+class Enumerazione(tuple):
+    """Valori ammessi di un campo: tupla ordinata (per le selectbox della UI)
+    con test di appartenenza O(1) tramite un frozenset."""
+
+    def __new__(cls, valori):
+        # dict.fromkeys rimuove i duplicati mantenendo l'ordine
+        self = super().__new__(cls, dict.fromkeys(valori))
+        self.insieme = frozenset(self)
+        return self
+
+    def __contains__(self, valore):
+        return valore in self.insieme
+
+
+def carica_enumerazioni_xsd(percorso=SCHEMA_XSD_PATH):
+    """Estrae dallo schema XSD i valori ammessi di ogni simpleType enumerato.
+
+    Returns:
+        tuple: (enumerazioni, descrizioni), dove enumerazioni è un dizionario
+            {nome tipo: Enumerazione} e descrizioni {nome tipo: {valore: testo}}
+            con la documentazione di ogni valore riportata nello schema
+    """
+    ns = {"xs": XS_NAMESPACE}
+    enumerazioni = {}
+    descrizioni = {}
+    for tipo in ET.parse(percorso).getroot().iterfind("xs:simpleType", ns):
+        valori = tipo.findall("xs:restriction/xs:enumeration", ns)
+        if not valori:
+            continue
+        nome = tipo.get("name")
+        enumerazioni[nome] = Enumerazione(v.get("value") for v in valori)
+        descrizioni[nome] = {
+            v.get("value"): " ".join(v.findtext("xs:annotation/xs:documentation", "", ns).split())
+            for v in valori
+        }
+    return enumerazioni, descrizioni
+
+
+# Valori ammessi letti da Schema_VFPR12.xsd: restano allineati allo schema
+# quando questo viene aggiornato
+ENUMERAZIONI_XSD, DESCRIZIONI_XSD = carica_enumerazioni_xsd()
+
+# Valid countries: NazioneType nello schema è solo un pattern [A-Z]{2},
+# quindi la lista dei paesi proposti resta mantenuta a mano
+VALID_COUNTRIES = Enumerazione([
     "IT", "FR", "DE", "ES", "PT", "GB", "US", "NL", "BE", "CH", "AT", "DK", 
     "FI", "GR", "IE", "LU", "NO", "SE", "PL", "RO", "RU", "BR", "CA", "CN", 
-    "JP", "IN", "AU", "NZ", "MX", "ZA", "AR", "IL", "CH", "TR"
-    # Pattern: [A-Z]{2} - Any two uppercase letters
-]
-
-# Valid regime fiscale types according to RegimeFiscaleType in the XSD schema
-VALID_REGIMI_FISCALI = [
-    "RF01", # Regime ordinario
-    "RF02", # Regime dei contribuenti minimi
-    "RF04", # Agricoltura e attività connesse e pesca
-    "RF05", # Vendita sali e tabacchi
-    "RF06", # Commercio dei fiammiferi
-    "RF07", # Editoria
-    "RF08", # Gestione di servizi di telefonia pubblica
-    "RF09", # Rivendita di documenti di trasporto pubblico e di sosta
-    "RF10", # Intrattenimenti, giochi e altre attività
-    "RF11", # Agenzie di viaggi e turismo
-    "RF12", # Agriturismo
-    "RF13", # Vendite a domicilio
-    "RF14", # Rivendita di beni usati, di oggetti d'arte
-    "RF15", # Agenzie di vendite all'asta di oggetti d'arte
-    "RF16", # IVA per cassa P.A.
-    "RF17", # IVA per cassa
-    "RF18", # Altro
-    "RF19"  # Regime forfettario
-]
-
-# Valid formati trasmissione according to FormatoTrasmissioneType in the XSD schema
-VALID_FORMATI_TRASMISSIONE = ["FPR12", "FPA12"]
-
-# Valid tipi documento according to TipoDocumentoType in the XSD schema
-VALID_TIPI_DOCUMENTO = [
-    "TD01", # Fattura
-    "TD02", # Acconto / anticipo su fattura
-    "TD03", # Acconto / anticipo su parcella
-    "TD04", # Nota di credito
-    "TD05", # Nota di debito
-    "TD06", # Parcella
-    "TD16", # Integrazione fattura reverse charge interno
-    "TD17", # Integrazione/autofattura per acquisto servizi dall'estero
-    "TD18", # Integrazione per acquisto di beni intracomunitari
-    "TD19", # Integrazione/autofattura per acquisto di beni ex art.17 c.2 DPR 633/72
-    "TD20", # Autofattura per regolarizzazione e integrazione delle fatture
-    "TD21", # Autofattura per splafonamento
-    "TD22", # Estrazione beni da Deposito IVA
-    "TD23", # Estrazione beni da Deposito IVA con versamento dell'IVA
-    "TD24", # Fattura differita di cui all'art.21, comma 4, lett. a)
-    "TD25", # Fattura differita di cui all'art.21, comma 4, terzo periodo lett. b)
-    "TD26", # Cessione di beni ammortizzabili e per passaggi interni
-    "TD27"  # Fattura per autoconsumo o per cessioni gratuite senza rivalsa
-]
-
-# Valid modalita pagamento according to the XSD schema
-VALID_MODALITA_PAGAMENTO = [
-    "MP01", # Contanti
-    "MP02", # Assegno
-    "MP03", # Assegno circolare
-    "MP04", # Contanti presso Tesoreria
-    "MP05", # Bonifico
-    "MP06", # Vaglia cambiario
-    "MP07", # Bollettino bancario
-    "MP08", # Carta di pagamento
-    "MP09", # RID
-    "MP10", # RID utenze
-    "MP11", # RID veloce
-    "MP12", # RIBA
-    "MP13", # MAV
-    "MP14", # Quietanza erario
-    "MP15", # Giroconto su conti di contabilità speciale
-    "MP16", # Domiciliazione bancaria
-    "MP17", # Domiciliazione postale
-    "MP18", # Bollettino di c/c postale
-    "MP19", # SEPA Direct Debit
-    "MP20", # SEPA Direct Debit CORE
-    "MP21", # SEPA Direct Debit B2B
-    "MP22", # Trattenuta su somme già riscosse
-    "MP23"  # PagoPA
-]
+    "JP", "IN", "AU", "NZ", "MX", "ZA", "AR", "IL", "TR"
+])
+
+VALID_REGIMI_FISCALI = ENUMERAZIONI_XSD["RegimeFiscaleType"]
+VALID_FORMATI_TRASMISSIONE = ENUMERAZIONI_XSD["FormatoTrasmissioneType"]
+VALID_TIPI_DOCUMENTO = ENUMERAZIONI_XSD["TipoDocumentoType"]
+VALID_MODALITA_PAGAMENTO = ENUMERAZIONI_XSD["ModalitaPagamentoType"]
+VALID_CONDIZIONI_PAGAMENTO = ENUMERAZIONI_XSD["CondizioniPagamentoType"]
+VALID_NATURE = ENUMERAZIONI_XSD["NaturaType"]
 
 # XML Schema namespace
 XML_SCHEMA_NAMESPACE = "http://ivaservizi.agenziaentrate.gov.it/docs/xsd/fatture/v1.2"
+DS_NAMESPACE = "http://www.w3.org/2000/09/xmldsig#"
+XSI_NAMESPACE = "http://www.w3.org/2001/XMLSchema-instance"
+
+# Prefissi dichiarati sull'elemento radice, nell'ordine in cui vengono scritti
+NAMESPACE_PREFISSI = {
+    XML_SCHEMA_NAMESPACE: "p",
+    DS_NAMESPACE: "ds",
+    XSI_NAMESPACE: "xsi",
+}
+
+# Register namespaces - this ensures proper prefixes are used by ET.tostring
+for _uri, _prefisso in NAMESPACE_PREFISSI.items():
+    ET.register_namespace(_prefisso, _uri)
+
+
+# Strumentazione della pipeline: le fasi (decodifica, parsing, estrazione,
+# cliente, costruzione, serializzazione, scrittura, validazione) vengono
+# misurate con misura() e i byte letti/prodotti con conta(). Le misure vanno
+# al collettore attivo nel contesto corrente; senza collettore (default) non
+# viene misurato nulla.
+class Collettore:
+    """Riceve le misure della pipeline. L'implementazione base le ignora."""
+
+    def durata(self, fase, secondi):
+        pass
+
+    def conteggio(self, nome, valore):
+        pass
+
+
+class CollettoreIstogramma(Collettore):
+    """Collettore in memoria: tutte le durate per fase e la somma dei contatori.
+
+    Le fasi possono essere annidate (ad esempio "cliente" dentro
+    "estrazione"), quindi i totali delle fasi non vanno sommati tra loro.
+    """
+
+    def __init__(self):
+        self.durate = defaultdict(list)
+        self.contatori = defaultdict(int)
+        self._lock = threading.Lock()
+
+    def durata(self, fase, secondi):
+        with self._lock:
+            self.durate[fase].append(secondi)
+
+    def conteggio(self, nome, valore):
+        with self._lock:
+            self.contatori[nome] += valore
+
+    def riepilogo(self):
+        """Restituisce {"fasi": {fase: statistiche in secondi}, "contatori": {nome: totale}}."""
+        with self._lock:
+            fasi = {}
+            for fase, durate in self.durate.items():
+                ordinate = sorted(durate)
+                fasi[fase] = {
+                    "chiamate": len(ordinate),
+                    "totale": sum(ordinate),
+                    "media": sum(ordinate) / len(ordinate),
+                    "min": ordinate[0],
+                    "p50": ordinate[len(ordinate) // 2],
+                    "p95": ordinate[min(len(ordinate) - 1, int(len(ordinate) * 0.95))],
+                    "max": ordinate[-1],
+                }
+            return {"fasi": fasi, "contatori": dict(self.contatori)}
+
+
+_collettore = contextvars.ContextVar("collettore_metriche", default=None)
+_NESSUNA_MISURA = nullcontext()
+
+
+@contextmanager
+def raccogli_metriche(collettore=None):
+    """Attiva un collettore per il codice eseguito nel blocco with.
+
+        with raccogli_metriche() as metriche:
+            xml = crea_fattura_elettronica(dati, params)
+        print(metriche.riepilogo())
+
+    Args:
+        collettore (Collettore): Il collettore da usare (default: un nuovo
+            CollettoreIstogramma)
+    """
+    if collettore is None:
+        collettore = CollettoreIstogramma()
+    token = _collettore.set(collettore)
+    try:
+        yield collettore
+    finally:
+        _collettore.reset(token)
+
+
+class _Misura:
+    __slots__ = ("collettore", "fase", "inizio")
+
+    def __init__(self, collettore, fase):
+        self.collettore = collettore
+        self.fase = fase
+
+    def __enter__(self):
+        self.inizio = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.collettore.durata(self.fase, time.perf_counter() - self.inizio)
+        return False
+
+
+def misura(fase):
+    """Context manager che misura la durata di una fase della pipeline."""
+    collettore = _collettore.get()
+    if collettore is None:
+        return _NESSUNA_MISURA
+    return _Misura(collettore, fase)
+
+
+def conta(nome, valore):
+    """Aggiunge valore al contatore nome del collettore attivo."""
+    collettore = _collettore.get()
+    if collettore is not None:
+        collettore.conteggio(nome, valore)
+
+
+def metriche_attive():
+    """True se nel contesto corrente è attivo un collettore."""
+    return _collettore.get() is not None
 
 
 def validate_param(value, valid_values, field_name):
@@ -95,6 +213,57 @@ def validate_param(value, valid_values, field_name):
     return value
 
 
+# Marcatori che nel campo Cliente precedono partita IVA e codice fiscale.
+# Il confronto è sull'intero token tra due "-", non su una sottostringa:
+# nomi come "PISA" o "CFM" non sono marcatori.
+_RE_MARCATORE = re.compile(r"(?P<PartitaIVA>P\.?\s*I(?:VA)?\.?)|(?P<CodiceFiscale>C\.?\s*F\.?)", re.IGNORECASE)
+# Nessun marcatore è più lungo di così: i token più lunghi non vengono confrontati
+_LUNGHEZZA_MAX_MARCATORE = 8
+
+# Stringhe Cliente distinte memorizzate (una per cliente dell'anagrafica)
+CLIENTE_CACHE_MAXSIZE = 8192
+
+
+@lru_cache(maxsize=CLIENTE_CACHE_MAXSIZE)
+def _parse_cliente(cliente_text):
+    """Analizza il campo Cliente; restituisce una tupla di coppie (immutabile, per la cache)."""
+    # Sostituisci le apostrofi codificate
+    cliente_text = cliente_text.replace("&apos;", "'")
+    grezze = cliente_text.split("-")
+    parts = [part.strip() for part in grezze]
+
+    info = {}
+    primo_marcatore = None
+    fine_marcatori = 1
+    # Un marcatore è seguito dal suo valore, quindi non può essere l'ultimo token
+    for i in range(1, len(parts) - 1):
+        if len(parts[i]) > _LUNGHEZZA_MAX_MARCATORE:
+            continue
+        marcatore = _RE_MARCATORE.fullmatch(parts[i])
+        if marcatore is not None:
+            info[marcatore.lastgroup] = parts[i + 1]
+            if primo_marcatore is None:
+                primo_marcatore = i
+            fine_marcatori = i + 2
+
+    # La denominazione è tutto il testo prima del primo marcatore, anche se
+    # contiene dei "-" (es. "ALFA-BETA SRL - PI- ...")
+    if primo_marcatore is None:
+        denominazione = parts[0]
+    else:
+        fine = sum(len(parte) + 1 for parte in grezze[:primo_marcatore]) - 1
+        denominazione = cliente_text[:fine].strip()
+
+    # Indirizzo, comune, CAP e provincia sono gli ultimi quattro token dopo
+    # la partita IVA / codice fiscale
+    coda = parts[fine_marcatori:]
+    indirizzo = {}
+    if len(coda) >= 4:
+        indirizzo = {"Indirizzo": coda[-4], "Comune": coda[-3], "CAP": coda[-2], "Provincia": coda[-1]}
+
+    return (("Denominazione", denominazione),) + tuple(info.items()) + tuple(indirizzo.items())
+
+
 def parse_cliente_field(cliente_text):
     """Estrae le informazioni del destinatario dal campo Cliente.
     
@@ -103,129 +272,250 @@ def parse_cliente_field(cliente_text):
             "NOME - PI- PARTITA_IVA - CF - CODICE_FISCALE - INDIRIZZO - COMUNE - CAP - PROVINCIA"
     
     Returns:
-        dict: Un dizionario con le informazioni estratte
+        dict: Un dizionario con le informazioni estratte (una copia nuova a
+            ogni chiamata: il risultato è memorizzato per testo del campo)
     """
-    info = {}
     if not cliente_text:
-        return info
+        return {}
+    return dict(_parse_cliente(cliente_text))
+
+
+def parse_cliente_fields(clienti):
+    """Come parse_cliente_field per una lista di campi Cliente.
+
+    I testi ripetuti vengono analizzati una sola volta.
+
+    Returns:
+        list: Un dizionario per ogni elemento di clienti, nello stesso ordine
+    """
+    return [parse_cliente_field(cliente_text) for cliente_text in clienti]
+
+
+# Righe fattura nell'export Access: esportando una tabella con le tabelle
+# collegate, Access annida i record figli dentro il record padre <Fattura>
+ACCESS_TAG_RIGA = "Righe"
+
+# Campi di una riga nell'export Access -> campi di CAMPI_LINEA
+ACCESS_CAMPI_RIGA = {
+    "Descrizione": "Descrizione",
+    "Qta": "Quantita",
+    "UM": "UnitaMisura",
+    "Prezzo": "PrezzoUnitario",
+    "Sconto": "Sconto",
+    "Importo": "PrezzoTotale",
+    "Iva": "AliquotaIVA",
+    "Natura": "Natura",
+}
+
+# Dimensione dei blocchi letti dal file durante il parsing incrementale
+ACCESS_CHUNK_SIZE = 64 * 1024
+
+
+def _estrai_riga(elem):
+    """Converte un record <Righe> dell'export Access in una riga per costruisci_fattura_elettronica.
+
+    I numeri restano come nel file (es. "2", "22"): vengono portati al formato
+    dello schema da _aggiungi_linea.
+    """
+    riga = {}
+    for figlio in elem:
+        campo = ACCESS_CAMPI_RIGA.get(figlio.tag)
+        if campo and figlio.text and figlio.text.strip():
+            riga[campo] = figlio.text.strip()
+    return riga
+
+
+def _estrai_dati_fattura(dati, linee):
+    """Estrae i campi di un elemento <Fattura> già completo (senza le righe)."""
+    # Extract date in correct format (YYYY-MM-DD)
+    data_elem = dati.find("Data")
+    if data_elem is None:
+        data_formatted = ""
+    else:
+        data_text = data_elem.text
+        data_formatted = data_text[:10] if data_text else ""
     
-    # Sostituisci le apostrofi codificate
-    cliente_text = cliente_text.replace("&apos;", "'")
+    # Extract causale from Note field
+    note_elem = dati.find("Note")
+    causale = note_elem.text if note_elem is not None and note_elem.text else ""
+    
+    # Extract other fields with error handling
+    fattura_num_elem = dati.find("FatturaNum")
+    numero = fattura_num_elem.text if fattura_num_elem is not None and fattura_num_elem.text else ""
+    
+    cliente_elem = dati.find("Cliente")
+    cliente = cliente_elem.text if cliente_elem is not None and cliente_elem.text else ""
+    
+    # Extract IVA information
+    iva_elem = dati.find("Iva")
+    iva = iva_elem.text if iva_elem is not None and iva_elem.text else "0"
+    
+    # Extract Note IVA
+    note_iva_elem = dati.find("NoteIva")
+    note_iva = note_iva_elem.text if note_iva_elem is not None and note_iva_elem.text else ""
+    
+    # Extract Modo Pagamento
+    modo_pag_elem = dati.find("ModoPag")
+    modo_pagamento = modo_pag_elem.text if modo_pag_elem is not None and modo_pag_elem.text else ""
+    
+    # Extract Tempo Pagamento
+    tempo_pag_elem = dati.find("TempoPag")
+    tempo_pagamento = tempo_pag_elem.text if tempo_pag_elem is not None and tempo_pag_elem.text else ""
+    
+    # Extract Scadenza
+    scad_elem = dati.find("Scad")
+    scadenza = scad_elem.text[:10] if scad_elem is not None and scad_elem.text else ""
+    
+    # Extract Sconto
+    sconto_elem = dati.find("Sconto")
+    sconto = sconto_elem.text if sconto_elem is not None and sconto_elem.text else "0"
+    
+    # Parse cliente field to extract destinatario information
+    with misura("cliente"):
+        destinatario_info = parse_cliente_field(cliente) if cliente else {}
     
-    # Prova a estrarre le parti dalla stringa
-    parts = [part.strip() for part in cliente_text.split("-")]
-    
-    # Estrai le informazioni in base al formato atteso
-    if len(parts) >= 1:
-        info["Denominazione"] = parts[0].strip()
-    
-    for i, part in enumerate(parts):
-        part = part.strip()
-        if i > 0 and i < len(parts) - 1:
-            if "PI" in part:
-                # Il prossimo elemento dovrebbe essere la partita IVA
-                if i + 1 < len(parts):
-                    info["PartitaIVA"] = parts[i + 1].strip()
-            elif "CF" in part:
-                # Il prossimo elemento dovrebbe essere il codice fiscale
-                if i + 1 < len(parts):
-                    info["CodiceFiscale"] = parts[i + 1].strip()
-    
-    # Estrai indirizzo, città, CAP e provincia
-    # Sono solitamente gli ultimi elementi
-    if len(parts) >= 4:
-        info["Indirizzo"] = parts[-4].strip() if len(parts) >= 4 else ""
-        info["Comune"] = parts[-3].strip() if len(parts) >= 3 else ""
-        cap_provincia = parts[-2].strip() if len(parts) >= 2 else ""
-        info["CAP"] = cap_provincia.split("-")[0].strip() if "-" in cap_provincia else cap_provincia
-        info["Provincia"] = parts[-1].strip() if len(parts) >= 1 else ""
-    
-    return info
+    return {
+        "Numero": numero,
+        "Data": data_formatted,
+        "Cliente": cliente,
+        "Causale": causale,
+        "ImportoTotale": "0.00",  # Placeholder
+        "IVA": iva,
+        "NoteIVA": note_iva,
+        "ModoPagamento": modo_pagamento,
+        "TempoPagamento": tempo_pagamento,
+        "Scadenza": scadenza,
+        "Sconto": sconto,
+        "Destinatario": destinatario_info,
+        "Linee": linee
+    }
+
+
+def _iter_testo(stream, encoding):
+    """Legge il file a blocchi e li decodifica in modo incrementale."""
+    decoder = codecs.getincrementaldecoder(encoding)()
+    while True:
+        blocco = stream.read(ACCESS_CHUNK_SIZE)
+        if not blocco:
+            break
+        conta("byte_input", len(blocco))
+        with misura("decodifica"):
+            testo = decoder.decode(blocco)
+        yield testo
+    yield decoder.decode(b"", final=True)
+
+
+def _iter_fatture_testo(blocchi):
+    """
+    Analizza con un XMLPullParser i blocchi di testo di un export Access e
+    produce i dati di ogni <Fattura> figlia della radice appena viene chiusa.
+
+    Le righe vengono convertite e rimosse dall'albero man mano che vengono
+    lette e ogni <Fattura> viene rimossa dopo l'estrazione, quindi la memoria
+    occupata non cresce con la dimensione del file.
+    """
+    parser = ET.XMLPullParser(("start", "end"))
+    livello = 0
+    radice = fattura = None
+    linee = []
+
+    def eventi():
+        nonlocal livello, radice, fattura, linee
+        for evento, elem in parser.read_events():
+            if evento == "start":
+                livello += 1
+                if livello == 1:
+                    radice = elem
+                elif livello == 2 and elem.tag == "Fattura":
+                    fattura, linee = elem, []
+                continue
+
+            if livello == 3 and fattura is not None and elem.tag == ACCESS_TAG_RIGA:
+                with misura("estrazione"):
+                    linee.append(_estrai_riga(elem))
+                fattura.remove(elem)
+            elif livello == 2:
+                if elem is fattura:
+                    with misura("estrazione"):
+                        dati = _estrai_dati_fattura(fattura, linee)
+                    yield dati
+                    fattura = None
+                radice.remove(elem)
+            livello -= 1
+
+    for testo in blocchi:
+        with misura("parsing"):
+            parser.feed(testo)
+        yield from eventi()
+    with misura("parsing"):
+        parser.close()
+    yield from eventi()
+
+
+def _iter_fatture_stream(stream):
+    """
+    Come _iter_fatture_testo, leggendo byte da uno stream binario.
+
+    Il contenuto viene decodificato come UTF-8; se non è UTF-8 valido e lo
+    stream consente il seek, viene riletto come latin-1 saltando le fatture
+    già prodotte.
+    """
+    inizio = stream.tell() if stream.seekable() else None
+    prodotte = 0
+    try:
+        for dati in _iter_fatture_testo(_iter_testo(stream, "utf-8")):
+            prodotte += 1
+            yield dati
+        return
+    except UnicodeDecodeError:
+        if inizio is None:
+            raise
+    stream.seek(inizio)
+    for indice, dati in enumerate(_iter_fatture_testo(_iter_testo(stream, "latin-1"))):
+        if indice >= prodotte:
+            yield dati
+
+
+_FATTURA_NON_TROVATA = "Tag 'Fattura' non trovato nel file XML. Verifica che il file sia nel formato corretto."
+
+
+def _prima_fattura(fatture):
+    """Restituisce la prima fattura, consumando il resto del documento per verificarne la correttezza."""
+    return _prima_fattura_e_numero(fatture)[0]
+
+
+def _prima_fattura_e_numero(fatture):
+    """Come _prima_fattura, ma restituisce anche il numero di fatture del documento."""
+    dati = None
+    numero = 0
+    for fattura in fatture:
+        if dati is None:
+            dati = fattura
+        numero += 1
+    if dati is None:
+        raise ValueError(_FATTURA_NON_TROVATA)
+    return dati, numero
 
 
 def parse_access_xml(content):
+    """Estrae i dati della prima fattura da un file XML esportato da Access.
+
+    Args:
+        content (bytes | str): Il contenuto del file
+
+    Returns:
+        dict: I dati della fattura, con le righe nella chiave "Linee"
+    """
+    return _parse_access_xml(content)[0]
+
+
+def _parse_access_xml(content):
+    """Come parse_access_xml, ma restituisce (dati della prima fattura, numero di fatture)."""
     try:
         # Handle both bytes and string input
         if isinstance(content, bytes):
-            try:
-                # Try UTF-8 first
-                content_str = content.decode('utf-8')
-            except UnicodeDecodeError:
-                # Fall back to latin-1 or other encodings if UTF-8 fails
-                content_str = content.decode('latin-1')
-        else:
-            content_str = content
-            
-        # Fix common XML special characters that might be incorrectly escaped
-        content_str = content_str.replace("&apos;", "'")
-        
-        # Parse the XML
-        root = ET.fromstring(content_str)
-        dati = root.find("Fattura")
-        
-        if dati is None:
-            raise ValueError("Tag 'Fattura' non trovato nel file XML. Verifica che il file sia nel formato corretto.")
-        
-        # Extract date in correct format (YYYY-MM-DD)
-        data_elem = dati.find("Data")
-        if data_elem is None:
-            data_formatted = ""
-        else:
-            data_text = data_elem.text
-            data_formatted = data_text[:10] if data_text else ""
-        
-        # Extract causale from Note field
-        note_elem = dati.find("Note")
-        causale = note_elem.text if note_elem is not None and note_elem.text else ""
-        
-        # Extract other fields with error handling
-        fattura_num_elem = dati.find("FatturaNum")
-        numero = fattura_num_elem.text if fattura_num_elem is not None and fattura_num_elem.text else ""
-        
-        cliente_elem = dati.find("Cliente")
-        cliente = cliente_elem.text if cliente_elem is not None and cliente_elem.text else ""
-        
-        # Extract IVA information
-        iva_elem = dati.find("Iva")
-        iva = iva_elem.text if iva_elem is not None and iva_elem.text else "0"
-        
-        # Extract Note IVA
-        note_iva_elem = dati.find("NoteIva")
-        note_iva = note_iva_elem.text if note_iva_elem is not None and note_iva_elem.text else ""
-        
-        # Extract Modo Pagamento
-        modo_pag_elem = dati.find("ModoPag")
-        modo_pagamento = modo_pag_elem.text if modo_pag_elem is not None and modo_pag_elem.text else ""
-        
-        # Extract Tempo Pagamento
-        tempo_pag_elem = dati.find("TempoPag")
-        tempo_pagamento = tempo_pag_elem.text if tempo_pag_elem is not None and tempo_pag_elem.text else ""
-        
-        # Extract Scadenza
-        scad_elem = dati.find("Scad")
-        scadenza = scad_elem.text[:10] if scad_elem is not None and scad_elem.text else ""
-        
-        # Extract Sconto
-        sconto_elem = dati.find("Sconto")
-        sconto = sconto_elem.text if sconto_elem is not None and sconto_elem.text else "0"
-        
-        # Parse cliente field to extract destinatario information
-        destinatario_info = parse_cliente_field(cliente) if cliente else {}
-        
-        return {
-            "Numero": numero,
-            "Data": data_formatted,
-            "Cliente": cliente,
-            "Causale": causale,
-            "ImportoTotale": "0.00",  # Placeholder
-            "IVA": iva,
-            "NoteIVA": note_iva,
-            "ModoPagamento": modo_pagamento,
-            "TempoPagamento": tempo_pagamento,
-            "Scadenza": scadenza,
-            "Sconto": sconto,
-            "Destinatario": destinatario_info
-        }
+            return _prima_fattura_e_numero(_iter_fatture_stream(io.BytesIO(content)))
+        return _prima_fattura_e_numero(_iter_fatture_testo([content]))
     except Exception as e:
         # Add detailed error information
         error_msg = f"Errore nel parsing XML: {str(e)}"
@@ -233,25 +523,308 @@ def parse_access_xml(content):
         raise ValueError(error_msg)
 
 
-def crea_fattura_elettronica(dati_access, params):
+def _iter_fatture_sorgente(source):
+    if isinstance(source, bytes):
+        yield from _iter_fatture_stream(io.BytesIO(source))
+    elif hasattr(source, "read"):
+        yield from _iter_fatture_stream(source)
+    else:
+        with open(source, "rb") as f:
+            yield from _iter_fatture_stream(f)
+
+
+def parse_access_file(source):
+    """Come parse_access_xml, ma legge il file a blocchi da un percorso o da uno stream binario."""
+    try:
+        return _prima_fattura(_iter_fatture_sorgente(source))
+    except Exception as e:
+        # Il messaggio viene stampato solo dal vecchio parse_access_xml: qui
+        # è chi chiama a riportare l'errore
+        raise ValueError(f"Errore nel parsing XML: {str(e)}")
+
+
+def iter_fatture_access(source):
+    """Produce i dati di ogni <Fattura> di un export Access, una alla volta.
+
+    Ogni fattura viene restituita appena il suo elemento è stato letto, quindi
+    può essere convertita mentre il resto del file è ancora da analizzare:
+
+        for dati in iter_fatture_access("export.xml"):
+            xml = crea_fattura_elettronica(dati, compila_params(profilo, dati))
+
+    Args:
+        source: Contenuto del file (bytes), percorso o stream binario
+
+    Yields:
+        dict: I dati di una fattura, nello stesso formato di parse_access_xml
+
+    Raises:
+        ValueError: Se il file non è valido o non contiene nessuna <Fattura>
+    """
+    try:
+        trovate = False
+        for dati in _iter_fatture_sorgente(source):
+            trovate = True
+            yield dati
+        if not trovate:
+            raise ValueError(_FATTURA_NON_TROVATA)
+    except Exception as e:
+        raise ValueError(f"Errore nel parsing XML: {str(e)}")
+
+
+# Corrispondenza tra i campi estratti dal campo Cliente e i parametri
+# del destinatario usati da crea_fattura_elettronica
+PARAMS_DESTINATARIO = {
+    "Denominazione": "DenominazioneDestinatario",
+    "PartitaIVA": "IdCodiceDestinatario",
+    "CodiceFiscale": "CodiceFiscaleDestinatario",
+    "Indirizzo": "IndirizzoDestinatario",
+    "CAP": "CAPDestinatario",
+    "Comune": "ComuneDestinatario",
+    "Provincia": "ProvinciaDestinatario",
+}
+
+
+def compila_params(profilo, dati_access, registro=None):
+    """Completa un profilo di parametri con i dati del destinatario di una fattura.
+
+    Args:
+        profilo (dict): Parametri comuni a tutte le fatture (trasmissione,
+            cedente, pagamento, ...)
+        dati_access (dict): Dati della fattura restituiti da parse_access_xml
+        registro (RegistroClienti): Opzionale, anagrafica clienti in cui
+            cercare il destinatario per partita IVA o codice fiscale
+
+    Returns:
+        dict: Nuovo dizionario di parametri per crea_fattura_elettronica; i
+            valori estratti dal file Access prevalgono su quelli del profilo
+            e quelli del registro, se il cliente è registrato, su entrambi
+            (compresi CodiceDestinatario e PECDestinatario)
+    """
+    params = dict(profilo)
+    params.setdefault("IdPaeseDestinatario", "IT")
+    params.setdefault("NazioneDestinatario", "IT")
+
+    destinatario = dati_access.get("Destinatario", {})
+    if registro is not None:
+        cliente = registro.cerca_destinatario(dati_access)
+        if cliente:
+            destinatario = {**destinatario, **cliente}
+            if cliente.get("CodiceDestinatario"):
+                params["CodiceDestinatario"] = cliente["CodiceDestinatario"]
+            if cliente.get("PEC"):
+                params["PECDestinatario"] = cliente["PEC"]
+
+    for campo, chiave in PARAMS_DESTINATARIO.items():
+        if destinatario.get(campo):
+            params[chiave] = destinatario[campo]
+
+    return params
+
+
+# Cache dei file Access già analizzati, indicizzata per hash del contenuto.
+# Streamlit riesegue lo script a ogni modifica di un widget: senza cache lo
+# stesso upload verrebbe decodificato e analizzato a ogni rerun.
+PARSE_CACHE_MAXSIZE = 32
+_parse_cache = OrderedDict()
+_parse_cache_lock = threading.Lock()
+
+
+def parse_access_xml_cached(content):
+    """Come parse_access_xml, ma memorizza il risultato per hash del contenuto.
+
+    Args:
+        content (bytes | str): Il contenuto del file XML esportato da Access
+
+    Returns:
+        dict: Una copia dei dati estratti, modificabile dal chiamante
+    """
+    return copy.deepcopy(_parse_cached(content)[0])
+
+
+def numero_fatture_cached(content):
+    """Numero di <Fattura> dell'export, dalla stessa cache di parse_access_xml_cached.
+
+    parse_access_xml restituisce solo la prima fattura: chi mostra i dati
+    dell'export lo usa per accorgersi che ne contiene altre.
+    """
+    return _parse_cached(content)[1]
+
+
+def _parse_cached(content):
+    """(dati della prima fattura, numero di fatture) dell'export, dalla cache o analizzandolo."""
+    content_bytes = content.encode("utf-8") if isinstance(content, str) else content
+    key = hashlib.sha256(content_bytes).digest()
+
+    with _parse_cache_lock:
+        voce = _parse_cache.get(key)
+        if voce is not None:
+            _parse_cache.move_to_end(key)
+
+    conta("cache_parsing_hit" if voce is not None else "cache_parsing_miss", 1)
+    if voce is None:
+        voce = _parse_access_xml(content)
+        with _parse_cache_lock:
+            _parse_cache[key] = voce
+            while len(_parse_cache) > PARSE_CACHE_MAXSIZE:
+                _parse_cache.popitem(last=False)
+
+    return voce
+
+
+def _scrivi_debug(debug_sink, xml_bytes):
+    """Scrive una copia dell'XML generato su debug_sink (percorso, file binario o None)."""
+    if debug_sink is None:
+        return
+    with misura("scrittura"):
+        if hasattr(debug_sink, "write"):
+            debug_sink.write(xml_bytes)
+            return
+        debug_path = Path(debug_sink)
+        debug_path.parent.mkdir(parents=True, exist_ok=True)
+        debug_path.write_bytes(xml_bytes)
+
+
+def crea_fattura_elettronica(dati_access, params, debug_sink=None, linee=None, cedente=None, allegati=None):
     """
     Crea un file XML per la fattura elettronica conforme allo schema XSD.
     
     Args:
         dati_access: Dizionario con i dati della fattura estratti dal file XML di Access
         params: Dizionario con i parametri di configurazione
+        debug_sink: Opzionale, percorso o file binario su cui salvare una
+            copia dell'XML generato a scopo di debug. Con None (default) non
+            viene eseguito alcun accesso al disco.
+        linee: Opzionale, righe della fattura (vedi costruisci_fattura_elettronica)
+        cedente: Opzionale, ProfiloCedente (vedi costruisci_fattura_elettronica)
+        allegati: Opzionale, file da allegare (vedi costruisci_fattura_elettronica).
+            Il risultato è una stringa unica: per allegati grandi usare
+            scrivi_fattura_elettronica
         
     Returns:
         String: XML formattato della fattura elettronica
     """
+    root = costruisci_fattura_elettronica(dati_access, params, linee, cedente, allegati)
+    with misura("serializzazione"):
+        xml_str = "".join(iter_xml(root))
+    if debug_sink is not None:
+        xml_bytes = xml_str.encode("utf-8")
+        conta("byte_output", len(xml_bytes))
+        _scrivi_debug(debug_sink, xml_bytes)
+    elif metriche_attive():
+        conta("byte_output", len(xml_str.encode("utf-8")))
+    return xml_str
+
+
+def scrivi_fattura_elettronica(dati_access, params, file, linee=None, cedente=None, allegati=None):
+    """
+    Come crea_fattura_elettronica, ma scrive i byte UTF-8 direttamente su un
+    file binario senza costruire la stringa completa in memoria. Gli allegati
+    vengono letti e codificati a blocchi mentre vengono scritti.
+
+    Returns:
+        int: Numero di byte scritti
+    """
+    root = costruisci_fattura_elettronica(dati_access, params, linee, cedente, allegati)
+    return scrivi_xml(root, file)
+
+
+def costruisci_fattura_elettronica(dati_access, params, linee=None, cedente=None, allegati=None):
+    """
+    Costruisce l'albero ElementTree della fattura elettronica.
+
+    Args:
+        dati_access: Dizionario con i dati della fattura estratti dal file XML di Access
+        params: Dizionario con i parametri di configurazione
+        linee: Opzionale, iterabile di dizionari con le righe della fattura
+            (chiavi Descrizione, Quantita, UnitaMisura, PrezzoUnitario, Sconto,
+            PrezzoTotale, AliquotaIVA, Natura). Viene consumato una sola volta:
+            NumeroLinea è assegnato in sequenza e viene prodotto un DatiRiepilogo
+            per ogni coppia (AliquotaIVA, Natura). Se None vengono usate le
+            righe lette dal file Access (dati_access["Linee"]) oppure, in
+            mancanza, le righe L1_*/L2_* e il riepilogo Riepilogo_* di params.
+        cedente: Opzionale, ProfiloCedente costruito dallo stesso profilo di
+            params: le parti fisse dell'header vengono prese da lì invece di
+            essere ricostruite e validate a ogni fattura
+        allegati: Opzionale, iterabile di Allegato (o di percorsi di file) da
+            inserire nei blocchi Allegati; se None vengono usati quelli in
+            dati_access["Allegati"], se presenti. I file vengono letti solo
+            durante la serializzazione
+
+    Returns:
+        xml.etree.ElementTree.Element: Elemento radice FatturaElettronica
+    """
+    with misura("costruzione"):
+        root = _crea_radice(params, cedente)
+        _aggiungi_header(root, params, cedente)
+        _aggiungi_body(root, dati_access, params, linee, allegati)
+    return root
+
+
+def costruisci_lotto(fatture, profilo, registro=None, cedente=None):
+    """
+    Costruisce un'unica FatturaElettronica "lotto" con un
+    FatturaElettronicaBody per ogni fattura e un solo header condiviso.
+
+    Tutte le fatture devono avere lo stesso cessionario (vedi
+    raggruppa_per_cessionario): l'header viene costruito una sola volta dai
+    dati della prima.
+
+    Args:
+        fatture: Lista di dizionari restituiti da parse_access_xml / iter_fatture_access
+        profilo: Parametri comuni (trasmissione, cedente, pagamento, ...)
+        registro: Opzionale, RegistroClienti per i dati del cessionario
+            (vedi compila_params)
+        cedente: Opzionale, ProfiloCedente costruito da profilo
+
+    Returns:
+        xml.etree.ElementTree.Element: Elemento radice FatturaElettronica
+    """
+    if not fatture:
+        raise ValueError("Il lotto deve contenere almeno una fattura")
+
+    with misura("costruzione"):
+        root = _crea_radice(profilo, cedente)
+        _aggiungi_header(root, compila_params(profilo, fatture[0], registro), cedente)
+        for dati in fatture:
+            _aggiungi_body(root, dati, profilo)
+    return root
+
+
+def crea_lotto_fatture(fatture, profilo, registro=None, cedente=None):
+    """Come costruisci_lotto, ma restituisce l'XML formattato."""
+    root = costruisci_lotto(fatture, profilo, registro, cedente)
+    with misura("serializzazione"):
+        return "".join(iter_xml(root))
+
+
+def chiave_cessionario(dati_access):
+    """Identifica il cessionario di una fattura: partita IVA, codice fiscale o, in mancanza, la denominazione."""
+    destinatario = dati_access.get("Destinatario", {})
+    partita_iva = destinatario.get("PartitaIVA", "")
+    codice_fiscale = destinatario.get("CodiceFiscale", "")
+    if partita_iva or codice_fiscale:
+        return partita_iva, codice_fiscale
+    return "", destinatario.get("Denominazione") or dati_access.get("Cliente", "")
+
+
+def raggruppa_per_cessionario(fatture):
+    """
+    Raggruppa le fatture per cessionario, mantenendo l'ordine di lettura.
+
+    Returns:
+        dict: {chiave_cessionario: lista di fatture}
+    """
+    gruppi = {}
+    for dati in fatture:
+        gruppi.setdefault(chiave_cessionario(dati), []).append(dati)
+    return gruppi
+
+
+def _crea_radice(params, cedente=None):
     # Namespace URLs
     ns_uri = XML_SCHEMA_NAMESPACE
     
-    # Register namespaces - this ensures proper prefixes are used
-    ET.register_namespace("p", ns_uri)  # Register with prefix "p" for compatibility
-    ET.register_namespace("ds", "http://www.w3.org/2000/09/xmldsig#")
-    ET.register_namespace("xsi", "http://www.w3.org/2001/XMLSchema-instance")
-    
     # Determine schema location - use local file if specified
     use_local_schema = params.get("UseLocalSchema", False)
     if use_local_schema:
@@ -261,36 +834,54 @@ def crea_fattura_elettronica(dati_access, params):
         # Use online schema
         schema_location = f"{ns_uri} http://www.fatturapa.gov.it/export/fatturazione/sdi/fatturapa/v1.2/Schema_del_file_xml_FatturaPA_versione_1.2.xsd"
     
-    # Create the root element with proper namespace formatting using prefix "p"
-    # Non includiamo xmlns:p poiché è già registrato con ET.register_namespace
+    # Create the root element; the xmlns declarations are written by iter_xml
     root = ET.Element("{" + ns_uri + "}FatturaElettronica", {
-        "versione": validate_param(params["FormatoTrasmissione"], VALID_FORMATI_TRASMISSIONE, "FormatoTrasmissione"),
-        "xmlns:ds": "http://www.w3.org/2000/09/xmldsig#",
-        "xmlns:xsi": "http://www.w3.org/2001/XMLSchema-instance",
-        "xsi:schemaLocation": schema_location
+        "versione": cedente.formato_trasmissione if cedente is not None else validate_param(
+            params["FormatoTrasmissione"], VALID_FORMATI_TRASMISSIONE, "FormatoTrasmissione"),
+        "{" + XSI_NAMESPACE + "}schemaLocation": schema_location
     })
+    return root
 
-    # HEADER
-    header = ET.SubElement(root, "FatturaElettronicaHeader")
-    
-    # 1. Dati Trasmissione
-    trasm = ET.SubElement(header, "DatiTrasmissione")
-    id_trasm = ET.SubElement(trasm, "IdTrasmittente")
+
+class _Frammento(ET.Element):
+    """Radice di un sottoalbero fisso, condiviso tra più fatture.
+
+    Il serializzatore produce il suo XML una sola volta per indentazione e lo
+    riusa per tutte le fatture successive: il sottoalbero non va modificato
+    dopo la prima serializzazione.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self._serializzato = {}
+
+    def serializzato(self, indent):
+        testo = self._serializzato.get(indent)
+        if testo is None:
+            testo = "".join(_iter_elemento(self, indent, _attributi(self)))
+            self._serializzato[indent] = testo
+        return testo
+
+
+def _crea_id_trasmittente(params, elemento=ET.Element):
+    id_trasm = elemento("IdTrasmittente")
     ET.SubElement(id_trasm, "IdPaese").text = validate_param(params["IdPaeseMittente"], VALID_COUNTRIES, "IdPaese")
     ET.SubElement(id_trasm, "IdCodice").text = params["IdCodiceMittente"]
-    ET.SubElement(trasm, "ProgressivoInvio").text = params["ProgressivoInvio"]
-    ET.SubElement(trasm, "FormatoTrasmissione").text = validate_param(params["FormatoTrasmissione"], VALID_FORMATI_TRASMISSIONE, "FormatoTrasmissione")
-    ET.SubElement(trasm, "CodiceDestinatario").text = params["CodiceDestinatario"]
-    
+    return id_trasm
+
+
+def _crea_contatti_trasmittente(params, elemento=ET.Element):
     # Contatti Trasmittente (opzionali)
-    contatti_trasm = ET.SubElement(trasm, "ContattiTrasmittente")
+    contatti_trasm = elemento("ContattiTrasmittente")
     if "TelefonoTrasmittente" in params and params["TelefonoTrasmittente"]:
         ET.SubElement(contatti_trasm, "Telefono").text = params["TelefonoTrasmittente"]
     if "EmailTrasmittente" in params and params["EmailTrasmittente"]:
         ET.SubElement(contatti_trasm, "Email").text = params["EmailTrasmittente"]
+    return contatti_trasm
 
-    # 2. Cedente/Prestatore
-    cedente = ET.SubElement(header, "CedentePrestatore")
+
+def _crea_cedente_prestatore(params, elemento=ET.Element):
+    cedente = elemento("CedentePrestatore")
     dati_anag = ET.SubElement(cedente, "DatiAnagrafici")
     id_iva = ET.SubElement(dati_anag, "IdFiscaleIVA")
     ET.SubElement(id_iva, "IdPaese").text = validate_param(params["IdPaeseMittente"], VALID_COUNTRIES, "IdPaese")
@@ -323,6 +914,68 @@ def crea_fattura_elettronica(dati_access, params):
         ET.SubElement(contatti, "Telefono").text = params["TelefonoCedente"]
         if "EmailCedente" in params and params["EmailCedente"]:
             ET.SubElement(contatti, "Email").text = params["EmailCedente"]
+    return cedente
+
+
+class ProfiloCedente:
+    """Parti fisse dell'header di un cedente, validate e costruite una sola volta.
+
+    IdTrasmittente, ContattiTrasmittente e CedentePrestatore sono uguali in
+    tutte le fatture dello stesso profilo: vengono costruiti qui e inseriti
+    così come sono in ogni fattura, e il serializzatore ne riusa l'XML già
+    prodotto. Per ogni fattura restano da costruire solo ProgressivoInvio,
+    CodiceDestinatario, PECDestinatario e il cessionario.
+
+        cedente = ProfiloCedente(profilo)
+        for dati in iter_fatture_access(percorso):
+            root = costruisci_fattura_elettronica(dati, compila_params(profilo, dati), cedente=cedente)
+
+    Args:
+        profilo (dict): Parametri del cedente e della trasmissione; gli stessi
+            valori devono essere presenti nei params passati insieme al profilo
+
+    Raises:
+        ValueError: Se un parametro del cedente non è tra i valori ammessi
+        KeyError: Se manca un parametro obbligatorio del cedente
+    """
+
+    def __init__(self, profilo):
+        self.params = dict(profilo)
+        self.formato_trasmissione = validate_param(
+            self.params["FormatoTrasmissione"], VALID_FORMATI_TRASMISSIONE, "FormatoTrasmissione")
+        self.id_trasmittente = _crea_id_trasmittente(self.params, _Frammento)
+        self.contatti_trasmittente = _crea_contatti_trasmittente(self.params, _Frammento)
+        self.cedente_prestatore = _crea_cedente_prestatore(self.params, _Frammento)
+
+
+def _aggiungi_header(root, params, cedente=None):
+    # HEADER
+    header = ET.SubElement(root, "FatturaElettronicaHeader")
+    
+    # 1. Dati Trasmissione
+    trasm = ET.SubElement(header, "DatiTrasmissione")
+    if cedente is not None:
+        trasm.append(cedente.id_trasmittente)
+    else:
+        trasm.append(_crea_id_trasmittente(params))
+    ET.SubElement(trasm, "ProgressivoInvio").text = params["ProgressivoInvio"]
+    if cedente is not None:
+        ET.SubElement(trasm, "FormatoTrasmissione").text = cedente.formato_trasmissione
+    else:
+        ET.SubElement(trasm, "FormatoTrasmissione").text = validate_param(params["FormatoTrasmissione"], VALID_FORMATI_TRASMISSIONE, "FormatoTrasmissione")
+    ET.SubElement(trasm, "CodiceDestinatario").text = params["CodiceDestinatario"]
+    if cedente is not None:
+        trasm.append(cedente.contatti_trasmittente)
+    else:
+        trasm.append(_crea_contatti_trasmittente(params))
+    if params.get("PECDestinatario"):
+        ET.SubElement(trasm, "PECDestinatario").text = params["PECDestinatario"]
+
+    # 2. Cedente/Prestatore
+    if cedente is not None:
+        header.append(cedente.cedente_prestatore)
+    else:
+        header.append(_crea_cedente_prestatore(params))
     
     # 3. Cessionario/Committente (destinatario)
     cessionario = ET.SubElement(header, "CessionarioCommittente")
@@ -345,7 +998,9 @@ def crea_fattura_elettronica(dati_access, params):
     ET.SubElement(sede_dest, "Comune").text = params["ComuneDestinatario"]
     ET.SubElement(sede_dest, "Provincia").text = params["ProvinciaDestinatario"]
     ET.SubElement(sede_dest, "Nazione").text = validate_param(params["NazioneDestinatario"], VALID_COUNTRIES, "NazioneDestinatario")
-    
+
+
+def _aggiungi_body(root, dati_access, params, linee=None, allegati=None):
     # BODY
     body = ET.SubElement(root, "FatturaElettronicaBody")
     
@@ -356,70 +1011,33 @@ def crea_fattura_elettronica(dati_access, params):
     ET.SubElement(dati_doc, "Divisa").text = params.get("Divisa", "EUR")
     ET.SubElement(dati_doc, "Data").text = params.get("DataFattura", dati_access.get("Data", ""))
     ET.SubElement(dati_doc, "Numero").text = params.get("NumeroFattura", dati_access.get("Numero", ""))
-    ET.SubElement(dati_doc, "ImportoTotaleDocumento").text = params.get("ImportoTotale", dati_access.get("ImportoTotale", "0.00"))
+    importo_totale = ET.SubElement(dati_doc, "ImportoTotaleDocumento")
     ET.SubElement(dati_doc, "Causale").text = params.get("Causale", dati_access.get("Causale", ""))
     
     # 2. Dati Beni Servizi
     dati_beni_servizi = ET.SubElement(body, "DatiBeniServizi")
     
-    # Dettaglio Linee - Linea 1
-    if all(k in params for k in ("L1_Descrizione", "L1_Quantita", "L1_PrezzoUnitario")):
-        dettaglio1 = ET.SubElement(dati_beni_servizi, "DettaglioLinee")
-        ET.SubElement(dettaglio1, "NumeroLinea").text = "1"
-        ET.SubElement(dettaglio1, "Descrizione").text = params["L1_Descrizione"]
-        ET.SubElement(dettaglio1, "Quantita").text = params["L1_Quantita"]
-        
-        if "L1_UnitaMisura" in params and params["L1_UnitaMisura"]:
-            ET.SubElement(dettaglio1, "UnitaMisura").text = params["L1_UnitaMisura"]
-        
-        ET.SubElement(dettaglio1, "PrezzoUnitario").text = params["L1_PrezzoUnitario"]
-        
-        # Sconto/Maggiorazione (opzionale)
-        if "L1_Sconto" in params and params["L1_Sconto"]:
-            sconto1 = ET.SubElement(dettaglio1, "ScontoMaggiorazione")
-            ET.SubElement(sconto1, "Tipo").text = "SC"  # SC: sconto, MG: maggiorazione
-            ET.SubElement(sconto1, "Percentuale").text = params["L1_Sconto"]
-        
-        ET.SubElement(dettaglio1, "PrezzoTotale").text = params["L1_PrezzoTotale"]
-        ET.SubElement(dettaglio1, "AliquotaIVA").text = params.get("L1_AliquotaIVA", "0.00")
-        
-        # Natura IVA (opzionale)
-        if "L1_Natura" in params and params["L1_Natura"]:
-            ET.SubElement(dettaglio1, "Natura").text = params["L1_Natura"]
-    
-    # Dettaglio Linee - Linea 2
-    if all(k in params for k in ("L2_Descrizione", "L2_Quantita", "L2_PrezzoUnitario")):
-        dettaglio2 = ET.SubElement(dati_beni_servizi, "DettaglioLinee")
-        ET.SubElement(dettaglio2, "NumeroLinea").text = "2"
-        ET.SubElement(dettaglio2, "Descrizione").text = params["L2_Descrizione"]
-        ET.SubElement(dettaglio2, "Quantita").text = params["L2_Quantita"]
-        
-        if "L2_UnitaMisura" in params and params["L2_UnitaMisura"]:
-            ET.SubElement(dettaglio2, "UnitaMisura").text = params["L2_UnitaMisura"]
-        
-        ET.SubElement(dettaglio2, "PrezzoUnitario").text = params["L2_PrezzoUnitario"]
-        
-        # Sconto/Maggiorazione (opzionale)
-        if "L2_Sconto" in params and params["L2_Sconto"]:
-            sconto2 = ET.SubElement(dettaglio2, "ScontoMaggiorazione")
-            ET.SubElement(sconto2, "Tipo").text = "SC"
-            ET.SubElement(sconto2, "Percentuale").text = params["L2_Sconto"]
-        
-        ET.SubElement(dettaglio2, "PrezzoTotale").text = params["L2_PrezzoTotale"]
-        ET.SubElement(dettaglio2, "AliquotaIVA").text = params.get("L2_AliquotaIVA", "0.00")
-        
-        # Natura IVA (opzionale)
-        if "L2_Natura" in params and params["L2_Natura"]:
-            ET.SubElement(dettaglio2, "Natura").text = params["L2_Natura"]
+    # Dettaglio Linee
+    if linee is None:
+        linee = dati_access.get("Linee") or None
+    riepilogo_da_params = linee is None and all(k in params for k in ("Riepilogo_AliquotaIVA", "Riepilogo_Imponibile"))
+    if linee is None:
+        linee = _linee_da_params(params)
+    # Con il riepilogo già fornito in params non serve accumulare gli imponibili
+    riepiloghi = None if riepilogo_da_params else {}
+    for numero, linea in enumerate(linee, 1):
+        _aggiungi_linea(dati_beni_servizi, numero, linea, riepiloghi)
     
     # Dati Riepilogo
-    if all(k in params for k in ("Riepilogo_AliquotaIVA", "Riepilogo_Imponibile")):
+    totale_calcolato = None
+    if riepilogo_da_params:
         riepilogo = ET.SubElement(dati_beni_servizi, "DatiRiepilogo")
         ET.SubElement(riepilogo, "AliquotaIVA").text = params["Riepilogo_AliquotaIVA"]
         
         # Natura IVA (opzionale)
         if "Riepilogo_Natura" in params and params["Riepilogo_Natura"]:
-            ET.SubElement(riepilogo, "Natura").text = params["Riepilogo_Natura"]
+            ET.SubElement(riepilogo, "Natura").text = validate_param(
+                params["Riepilogo_Natura"], VALID_NATURE, "Natura")
         
         ET.SubElement(riepilogo, "ImponibileImporto").text = params["Riepilogo_Imponibile"]
         ET.SubElement(riepilogo, "Imposta").text = params["Riepilogo_Imposta"]
@@ -429,48 +1047,365 @@ def crea_fattura_elettronica(dati_access, params):
             # Tronca il valore a 100 caratteri come richiesto dallo schema XML
             riferimento_normativo = params["Riepilogo_Riferimento"][:100]
             ET.SubElement(riepilogo, "RiferimentoNormativo").text = riferimento_normativo
+    elif riepiloghi:
+        totale_calcolato = _aggiungi_riepiloghi(dati_beni_servizi, riepiloghi, params.get("Riepilogo_Riferimento"))
+    
+    # Se l'importo totale non è indicato si usa quello calcolato dai riepiloghi
+    importo_totale.text = params.get("ImportoTotale", totale_calcolato or dati_access.get("ImportoTotale", "0.00"))
     
     # 3. Dati di Pagamento
-    if all(k in params for k in ("CondizioniPagamento", "ModalitaPagamento", "ImportoPagamento")):
+    importo_pagamento = params.get("ImportoPagamento", totale_calcolato)
+    if all(k in params for k in ("CondizioniPagamento", "ModalitaPagamento")) and importo_pagamento is not None:
         dati_pagamento = ET.SubElement(body, "DatiPagamento")
-        ET.SubElement(dati_pagamento, "CondizioniPagamento").text = params["CondizioniPagamento"]
+        ET.SubElement(dati_pagamento, "CondizioniPagamento").text = validate_param(
+            params["CondizioniPagamento"], VALID_CONDIZIONI_PAGAMENTO, "CondizioniPagamento")
         
         dettaglio_pagamento = ET.SubElement(dati_pagamento, "DettaglioPagamento")
         ET.SubElement(dettaglio_pagamento, "ModalitaPagamento").text = validate_param(
             params["ModalitaPagamento"], VALID_MODALITA_PAGAMENTO, "ModalitaPagamento")
-        ET.SubElement(dettaglio_pagamento, "ImportoPagamento").text = params["ImportoPagamento"]
+        ET.SubElement(dettaglio_pagamento, "ImportoPagamento").text = importo_pagamento
         
         # IBAN (opzionale)
         if "IBAN" in params and params["IBAN"]:
             ET.SubElement(dettaglio_pagamento, "IBAN").text = params["IBAN"]
-    
-    # Convert the ElementTree to string with encoding specified
-    xml_bytes = ET.tostring(root, encoding="utf-8")
-    gen_tmp_file = Path("data/output.xml")
-    gen_tmp_file.parent.mkdir(parents=True, exist_ok=True)
-    with open(gen_tmp_file, "wb") as f:
-        f.write(xml_bytes)
 
-    # Parse with minidom for pretty printing, maintaining correct namespace handling
-    dom = minidom.parseString(xml_bytes)
+    # 4. Allegati (opzionali), letti dal disco solo durante la serializzazione
+    if allegati is None:
+        allegati = dati_access.get("Allegati") or ()
+    for allegato in allegati:
+        _aggiungi_allegato(body, allegato)
+
+
+# Byte letti e codificati per volta: multiplo di 3, così i blocchi base64
+# si possono concatenare senza padding intermedio
+ALLEGATO_CHUNK_SIZE = 3 * 16 * 1024
+
+
+class ContenutoBase64:
+    """Testo dell'elemento Attachment, codificato in base64 a blocchi.
+
+    Viene assegnato come .text dell'elemento al posto di una stringa: il
+    serializzatore legge la sorgente e la codifica un blocco alla volta
+    mentre scrive l'output, quindi il contenuto non viene mai tenuto tutto in
+    memoria. La sorgente può essere un percorso (riaperto a ogni
+    serializzazione), dei bytes o uno stream binario (riportato alla
+    posizione iniziale se consente il seek).
+    """
+
+    def __init__(self, sorgente, chunk_size=ALLEGATO_CHUNK_SIZE):
+        self.sorgente = sorgente
+        self.chunk_size = max(3, chunk_size - chunk_size % 3)
+        self._inizio = sorgente.tell() if hasattr(sorgente, "read") and sorgente.seekable() else None
+
+    def _blocchi(self):
+        if isinstance(self.sorgente, (bytes, bytearray, memoryview)):
+            for i in range(0, len(self.sorgente), self.chunk_size):
+                yield self.sorgente[i:i + self.chunk_size]
+        elif hasattr(self.sorgente, "read"):
+            if self._inizio is not None:
+                self.sorgente.seek(self._inizio)
+            yield from iter(lambda: self.sorgente.read(self.chunk_size), b"")
+        else:
+            with open(self.sorgente, "rb") as f:
+                yield from iter(lambda: f.read(self.chunk_size), b"")
+
+    def iter_base64(self):
+        """Produce il contenuto codificato in base64, un blocco alla volta."""
+        resto = b""
+        for blocco in self._blocchi():
+            # Una read può restituire meno byte di quelli chiesti: si codifica
+            # solo la parte multipla di 3 e il resto passa al blocco successivo
+            blocco = resto + bytes(blocco)
+            taglio = len(blocco) - len(blocco) % 3
+            resto = blocco[taglio:]
+            if taglio:
+                with misura("allegati"):
+                    testo = base64.b64encode(blocco[:taglio]).decode("ascii")
+                yield testo
+        if resto:
+            yield base64.b64encode(resto).decode("ascii")
+
+    def __repr__(self):
+        return f"ContenutoBase64({self.sorgente!r})"
+
+
+class Allegato:
+    """Un file da allegare alla fattura (blocco Allegati).
+
+    Args:
+        sorgente: Percorso del file, bytes o stream binario
+        nome (str): NomeAttachment (default: nome del file o dello stream)
+        formato (str): FormatoAttachment (default: estensione del nome, es. "PDF")
+        descrizione (str): DescrizioneAttachment (opzionale)
+        algoritmo_compressione (str): AlgoritmoCompressione, es. "ZIP" (opzionale)
+    """
+
+    def __init__(self, sorgente, nome=None, formato=None, descrizione=None, algoritmo_compressione=None):
+        if nome is None:
+            nome = getattr(sorgente, "name", None) if hasattr(sorgente, "read") else sorgente
+            if not isinstance(nome, (str, Path)):
+                raise ValueError("Indicare il nome dell'allegato")
+            nome = Path(nome).name
+        if formato is None:
+            formato = Path(nome).suffix[1:].upper() or None
+        self.nome = nome
+        self.formato = formato
+        self.descrizione = descrizione
+        self.algoritmo_compressione = algoritmo_compressione
+        self.contenuto = ContenutoBase64(sorgente)
+
+
+def _aggiungi_allegato(body, allegato):
+    if not isinstance(allegato, Allegato):
+        allegato = Allegato(allegato)
+    # Lunghezze massime dei campi nello schema XSD
+    elem = ET.SubElement(body, "Allegati")
+    ET.SubElement(elem, "NomeAttachment").text = allegato.nome[:60]
+    if allegato.algoritmo_compressione:
+        ET.SubElement(elem, "AlgoritmoCompressione").text = allegato.algoritmo_compressione[:10]
+    if allegato.formato:
+        ET.SubElement(elem, "FormatoAttachment").text = allegato.formato[:10]
+    if allegato.descrizione:
+        ET.SubElement(elem, "DescrizioneAttachment").text = allegato.descrizione[:100]
+    ET.SubElement(elem, "Attachment").text = allegato.contenuto
+
+
+# Campi di una riga fattura, nello stesso ordine di DettaglioLinee nello schema
+CAMPI_LINEA = ("Descrizione", "Quantita", "UnitaMisura", "PrezzoUnitario", "Sconto",
+               "PrezzoTotale", "AliquotaIVA", "Natura")
+
+_CENTESIMI = Decimal("0.01")
+# Quantita, PrezzoUnitario e PrezzoTotale ammettono da 2 a 8 decimali
+_MIN_DECIMALI = 2
+_MAX_DECIMALI = 8
+
+
+def _linee_da_params(params):
+    """Righe L1_*/L2_* del dizionario params, nel formato accettato da costruisci_fattura_elettronica."""
+    for prefisso in ("L1_", "L2_"):
+        if all(prefisso + k in params for k in ("Descrizione", "Quantita", "PrezzoUnitario")):
+            yield {campo: params[prefisso + campo] for campo in CAMPI_LINEA if prefisso + campo in params}
+
+
+def _testo(valore):
+    return valore if isinstance(valore, str) else str(valore)
+
+
+def _decimale(valore, campo, numero):
+    try:
+        return Decimal(_testo(valore).strip())
+    except InvalidOperation:
+        raise ValueError(f"{campo} non valido nella linea {numero}: {valore!r}")
+
+
+def _testo_decimale(valore, campo, numero):
+    """Il valore nel formato degli importi dello schema: da 2 a 8 decimali, senza esponente."""
+    decimale = _decimale(valore, campo, numero)
+    esponente = decimale.as_tuple().exponent
+    if esponente > -_MIN_DECIMALI:
+        decimale = decimale.quantize(_CENTESIMI)
+    elif esponente < -_MAX_DECIMALI:
+        decimale = decimale.quantize(Decimal(1).scaleb(-_MAX_DECIMALI), ROUND_HALF_UP)
+    return f"{decimale:f}"
+
+
+def _testo_aliquota(valore, campo, numero):
+    """Aliquota o percentuale con esattamente 2 decimali (RateType)."""
+    return f"{_decimale(valore, campo, numero).quantize(_CENTESIMI, ROUND_HALF_UP):f}"
+
+
+def _aggiungi_linea(dati_beni_servizi, numero, linea, riepiloghi):
+    """Aggiunge un DettaglioLinee e, se riepiloghi non è None, accumula
+    l'imponibile nel riepilogo della sua aliquota/natura."""
+    for campo in ("Descrizione", "PrezzoUnitario"):
+        if campo not in linea:
+            raise ValueError(f"{campo} mancante nella linea {numero}")
+    
+    dettaglio = ET.SubElement(dati_beni_servizi, "DettaglioLinee")
+    ET.SubElement(dettaglio, "NumeroLinea").text = str(numero)
+    ET.SubElement(dettaglio, "Descrizione").text = _testo(linea["Descrizione"])
+    if linea.get("Quantita") not in (None, ""):
+        ET.SubElement(dettaglio, "Quantita").text = _testo_decimale(linea["Quantita"], "Quantita", numero)
+    
+    if linea.get("UnitaMisura"):
+        ET.SubElement(dettaglio, "UnitaMisura").text = _testo(linea["UnitaMisura"])
     
-    # Format with proper indentation
-    pretty_xml = dom.toprettyxml(indent="  ", encoding="utf-8")
+    ET.SubElement(dettaglio, "PrezzoUnitario").text = _testo_decimale(
+        linea["PrezzoUnitario"], "PrezzoUnitario", numero)
     
-    # Convert bytes to string for return
-    pretty_xml_str = pretty_xml.decode('utf-8')
+    # Sconto/Maggiorazione (opzionale)
+    if linea.get("Sconto"):
+        sconto = ET.SubElement(dettaglio, "ScontoMaggiorazione")
+        ET.SubElement(sconto, "Tipo").text = "SC"  # SC: sconto, MG: maggiorazione
+        ET.SubElement(sconto, "Percentuale").text = _testo_aliquota(linea["Sconto"], "Sconto", numero)
     
-    # Remove extra blank lines that minidom sometimes adds
-    lines = pretty_xml_str.splitlines()
-    filtered_lines = [line for line in lines if line.strip()]
-    pretty_xml_clean = '\n'.join(filtered_lines)
+    if "PrezzoTotale" in linea:
+        prezzo_totale = _testo_decimale(linea["PrezzoTotale"], "PrezzoTotale", numero)
+    else:
+        # PrezzoTotale = PrezzoUnitario x Quantita, al netto dello sconto percentuale
+        prezzo_totale = _decimale(linea["PrezzoUnitario"], "PrezzoUnitario", numero)
+        prezzo_totale *= _decimale(linea.get("Quantita") or "1", "Quantita", numero)
+        if linea.get("Sconto"):
+            prezzo_totale *= 1 - _decimale(linea["Sconto"], "Sconto", numero) / 100
+        prezzo_totale = str(prezzo_totale.quantize(_CENTESIMI, ROUND_HALF_UP))
+    ET.SubElement(dettaglio, "PrezzoTotale").text = prezzo_totale
+    aliquota = _testo_aliquota(linea.get("AliquotaIVA", "0.00"), "AliquotaIVA", numero)
+    ET.SubElement(dettaglio, "AliquotaIVA").text = aliquota
     
-    # Ensure XML declaration is correct
-    if not pretty_xml_clean.startswith('<?xml'):
-        pretty_xml_clean = '<?xml version="1.0" encoding="UTF-8"?>\n' + pretty_xml_clean
+    # Natura IVA (opzionale)
+    natura = linea.get("Natura") or ""
+    if natura:
+        ET.SubElement(dettaglio, "Natura").text = validate_param(_testo(natura), VALID_NATURE, "Natura")
     
-    # Add a final newline
-    if not pretty_xml_clean.endswith('\n'):
-        pretty_xml_clean += '\n'
+    if riepiloghi is None:
+        return
+    chiave = (Decimal(aliquota), natura)
+    riepiloghi[chiave] = riepiloghi.get(chiave, 0) + _decimale(prezzo_totale, "PrezzoTotale", numero)
+
+
+def _aggiungi_riepiloghi(dati_beni_servizi, riepiloghi, riferimento=None):
+    """Scrive un DatiRiepilogo per ogni (AliquotaIVA, Natura); restituisce il totale documento."""
+    totale = Decimal(0)
+    for (aliquota, natura), imponibile in riepiloghi.items():
+        imponibile = imponibile.quantize(_CENTESIMI, ROUND_HALF_UP)
+        imposta = (imponibile * aliquota / 100).quantize(_CENTESIMI, ROUND_HALF_UP)
+        totale += imponibile + imposta
         
-    return pretty_xml_clean
+        riepilogo = ET.SubElement(dati_beni_servizi, "DatiRiepilogo")
+        ET.SubElement(riepilogo, "AliquotaIVA").text = str(aliquota)
+        if natura:
+            ET.SubElement(riepilogo, "Natura").text = _testo(natura)
+        ET.SubElement(riepilogo, "ImponibileImporto").text = str(imponibile)
+        ET.SubElement(riepilogo, "Imposta").text = str(imposta)
+        
+        # Riferimento Normativo (opzionale, solo per le operazioni con Natura)
+        if natura and riferimento:
+            ET.SubElement(riepilogo, "RiferimentoNormativo").text = riferimento[:100]
+    return str(totale)
+
+
+# Caratteri che str.splitlines() considera fine riga
+_RE_FINE_RIGA = re.compile("[\n\r\x0b\x0c\x1c\x1d\x1e\x85\u2028\u2029]")
+_RE_ESCAPE = re.compile('[&<>"]')
+_ESCAPE = {"&": "&amp;", "<": "&lt;", ">": "&gt;", '"': "&quot;"}
+_nomi_qualificati = {}
+
+
+def _escape(testo):
+    if not isinstance(testo, str):
+        raise TypeError(f"cannot serialize {testo!r} (type {type(testo).__name__})")
+    return _RE_ESCAPE.sub(lambda m: _ESCAPE[m.group()], testo)
+
+
+def _nome_qualificato(nome):
+    """Converte un nome '{uri}locale' nella forma 'prefisso:locale'."""
+    qname = _nomi_qualificati.get(nome)
+    if qname is None:
+        if nome[:1] == "{":
+            uri, locale = nome[1:].split("}", 1)
+            qname = f"{NAMESPACE_PREFISSI[uri]}:{locale}"
+        else:
+            qname = nome
+        _nomi_qualificati[nome] = qname
+    return qname
+
+
+def _riga(riga):
+    """Chiude una riga di output, eliminando le righe vuote come faceva la
+    vecchia pipeline minidom + splitlines quando il testo contiene a capo."""
+    if _RE_FINE_RIGA.search(riga):
+        return "".join(r + "\n" for r in riga.splitlines() if r.strip())
+    return riga + "\n"
+
+
+def _iter_elemento(elem, indent, attributi):
+    tag = _nome_qualificato(elem.tag)
+    apertura = f"{indent}<{tag}{attributi}"
+    figli = len(elem)
+
+    if not figli:
+        if type(elem.text) is ContenutoBase64:
+            yield apertura + ">"
+            yield from elem.text.iter_base64()
+            yield f"</{tag}>\n"
+        elif elem.text:
+            yield _riga(f"{apertura}>{_escape(elem.text)}</{tag}>")
+        else:
+            yield apertura + "/>\n"
+        return
+
+    yield apertura + ">\n"
+    indent_figli = indent + "  "
+    if elem.text:
+        yield _riga(indent_figli + _escape(elem.text))
+    for figlio in elem:
+        if type(figlio) is _Frammento:
+            yield figlio.serializzato(indent_figli)
+        else:
+            yield from _iter_elemento(figlio, indent_figli, _attributi(figlio))
+        if figlio.tail:
+            yield _riga(indent_figli + _escape(figlio.tail))
+    yield f"{indent}</{tag}>\n"
+
+
+def _attributi(elem):
+    if not elem.attrib:
+        return ""
+    return "".join(f' {_nome_qualificato(k)}="{_escape(v)}"' for k, v in elem.attrib.items())
+
+
+def iter_xml(root):
+    """
+    Serializza la fattura in un solo passaggio, producendo l'XML indentato
+    riga per riga (stesso output della precedente formattazione con minidom).
+
+    Args:
+        root: Elemento radice restituito da costruisci_fattura_elettronica
+
+    Yields:
+        str: Frammenti consecutivi del documento
+    """
+    yield '<?xml version="1.0" encoding="utf-8"?>\n'
+    dichiarazioni = "".join(f' xmlns:{prefisso}="{uri}"' for uri, prefisso in NAMESPACE_PREFISSI.items())
+    yield from _iter_elemento(root, "", dichiarazioni + _attributi(root))
+
+
+def _blocchi_utf8(root, chunk_size):
+    buffer = []
+    dimensione = 0
+    for frammento in iter_xml(root):
+        buffer.append(frammento)
+        dimensione += len(frammento)
+        if dimensione >= chunk_size:
+            yield "".join(buffer).encode("utf-8")
+            buffer.clear()
+            dimensione = 0
+    if buffer:
+        yield "".join(buffer).encode("utf-8")
+
+
+def iter_xml_bytes(root, chunk_size=64 * 1024):
+    """Come iter_xml, ma produce blocchi di byte UTF-8 di circa chunk_size byte."""
+    blocchi = _blocchi_utf8(root, chunk_size)
+    if not metriche_attive():
+        yield from blocchi
+        return
+
+    # Misura solo il tempo speso a produrre i blocchi, non quello del chiamante
+    while True:
+        with misura("serializzazione"):
+            blocco = next(blocchi, None)
+        if blocco is None:
+            return
+        conta("byte_output", len(blocco))
+        yield blocco
+
+
+def scrivi_xml(root, file):
+    """Scrive la fattura serializzata su un file binario; restituisce i byte scritti."""
+    scritti = 0
+    for blocco in iter_xml_bytes(root):
+        with misura("scrittura"):
+            file.write(blocco)
+        scritti += len(blocco)
+    return scritti
@@ -0,0 +1,112 @@
+# xsd_validator.py
+"""
+Validazione delle fatture generate rispetto allo schema locale Schema_VFPR12.xsd.
+
+Lo schema viene compilato una sola volta, al primo utilizzo, e riusato per
+tutte le validazioni successive del processo. Gli alberi prodotti da
+costruisci_fattura_elettronica vengono validati direttamente, senza
+serializzarli e rileggerli.
+"""
+import re
+import threading
+import xml.etree.ElementTree as ET
+
+from xml_invoice_backend import SCHEMA_XSD_PATH, ContenutoBase64, misura
+
+_RE_NAMESPACE = re.compile(r"\{[^}]*\}")
+
+_schema = None
+_schema_lock = threading.Lock()
+
+
+def carica_schema():
+    """Restituisce lo schema XSD compilato, compilandolo al primo utilizzo.
+
+    Richiede il pacchetto xmlschema. La firma ds:Signature viene risolta con
+    la copia di xmldsig-core-schema.xsd inclusa in xmlschema, quindi non
+    serve accesso alla rete.
+    """
+    global _schema
+    if _schema is None:
+        with _schema_lock:
+            if _schema is None:
+                try:
+                    import xmlschema
+                except ImportError as e:
+                    raise ImportError("La validazione XSD richiede il pacchetto 'xmlschema' (pip install xmlschema)") from e
+                _schema = xmlschema.XMLSchema(str(SCHEMA_XSD_PATH), allow="local")
+    return _schema
+
+
+def _percorso_leggibile(percorso):
+    """Rimuove il namespace '{uri}' dai nomi degli elementi nel percorso dell'errore."""
+    return _RE_NAMESPACE.sub("", percorso or "")
+
+
+def errori_fattura(fattura):
+    """Valida una fattura e restituisce gli errori trovati.
+
+    Args:
+        fattura: Elemento radice restituito da costruisci_fattura_elettronica,
+            oppure il documento XML già serializzato (str o bytes)
+
+    Returns:
+        list: Una lista di dizionari con le chiavi "percorso", "messaggio" e
+            "valore"; vuota se la fattura è valida
+
+    Il contenuto degli allegati (ContenutoBase64) non viene letto: durante la
+    validazione è sostituito da un base64 vuoto, perché è sempre generato
+    dalla codifica e quindi valido per costruzione.
+    """
+    if isinstance(fattura, (str, bytes)):
+        fattura = ET.fromstring(fattura)
+
+    schema = carica_schema()
+    errori = []
+    allegati = [e for e in fattura.iter("Attachment") if type(e.text) is ContenutoBase64]
+    contenuti = [e.text for e in allegati]
+    try:
+        for elem in allegati:
+            elem.text = ""
+        with misura("validazione"):
+            for errore in schema.iter_errors(fattura):
+                valore = errore.obj.text if ET.iselement(errore.obj) else errore.obj
+                errori.append({
+                    "percorso": _percorso_leggibile(errore.path),
+                    "messaggio": errore.reason or errore.message,
+                    "valore": valore,
+                })
+    finally:
+        for elem, contenuto in zip(allegati, contenuti):
+            elem.text = contenuto
+    return errori
+
+
+def valida_fattura(fattura):
+    """Come errori_fattura, ma solleva ValueError se la fattura non è valida."""
+    errori = errori_fattura(fattura)
+    if errori:
+        dettagli = "; ".join(f"{e['percorso']}: {e['messaggio']}" for e in errori)
+        raise ValueError(f"Fattura non conforme allo schema XSD: {dettagli}")
+    return fattura
+
+
+def valida_lotto(fatture):
+    """Valida molte fatture con lo stesso schema compilato.
+
+    Args:
+        fatture: Dizionario {identificativo: fattura} oppure iterabile di
+            coppie (identificativo, fattura)
+
+    Returns:
+        dict: {identificativo: lista di errori} per le sole fatture non valide
+    """
+    if isinstance(fatture, dict):
+        fatture = fatture.items()
+
+    risultati = {}
+    for identificativo, fattura in fatture:
+        errori = errori_fattura(fattura)
+        if errori:
+            risultati[identificativo] = errori
+    return risultati